@@ -0,0 +1,12 @@
+"""
+Benchmarks for the performance critical parts of the CLDF conversion and the doreco commands.
+
+Run a benchmark as module from the repository root, e.g.
+
+    python -m benchmarks.fix_text
+
+End-to-end benchmarks of the conversion, the database and audio slicing on synthetic corpora of
+configurable size are run via
+
+    python -m benchmarks.suite --scale 1 5 10
+"""
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark of `util.igt.fix_text` over the transcriptions and translations in the raw
+`*_wd.csv` files - i.e. the calls made in `Dataset.iter_rows('*_wd.csv')`.
+
+    python -m benchmarks.fix_text
+"""
+import re
+import csv
+import timeit
+import pathlib
+
+from util import igt
+
+RAW_DIR = pathlib.Path(__file__).parent.parent / 'raw'
+
+
+def fix_text_original(s, type_, gc):
+    """
+    The implementation of `fix_text` before the fixes were compiled and memoized - as baseline.
+    """
+    s = s.strip()
+    for m, repl in {'â\x80\x9d': '”', 'â\x80\x9c': '“', '\u200e\u200e': ''}.items():
+        s = s.replace(m, repl)
+
+    if gc == 'bain1259' and type_ == 'ft' and '|' in s:
+        french, _, s = s.partition('|')
+        s = s.strip()
+
+    if (gc == 'bain1259' or gc == 'anal1239' or gc == 'beja1238') and type_ == 'tx':
+        while s.endswith('/'):
+            s = s[:-1].strip()
+
+    if type_ == 'ft':
+        if s.startswith("'") and s.endswith("'"):
+            s = s[1:-1].strip()
+        elif s.startswith("`") and s.endswith("'"):
+            s = s[1:-1].strip()
+        if s == 'EMPTY':
+            s = ''
+
+    s = re.sub(r'\s+', ' ', s)
+    return s
+
+
+def iter_calls(raw_dir=RAW_DIR):
+    for p in sorted(raw_dir.glob('*_wd.csv'), key=lambda pp: pp.name):
+        gc = p.name.partition('_')[0]
+        with p.open(encoding='utf8') as f:
+            delimiter = '\t' if '\t' in f.readline() else ','
+            f.seek(0)
+            for row in csv.DictReader(f, delimiter=delimiter):
+                for k in ['ft', 'tx']:
+                    if k in row:
+                        yield row[k], k, gc
+
+
+def main(number=3):
+    calls = list(iter_calls())
+    if not calls:
+        print('No *_wd.csv files found in {}; run `cldfbench download` first.'.format(RAW_DIR))
+        return
+    print('{} calls, {} distinct (text, type, corpus)'.format(len(calls), len(set(calls))))
+
+    def original():
+        for args in calls:
+            fix_text_original(*args)
+
+    def uncached():
+        for s, type_, gc in calls:
+            igt.text_normalizer(gc, type_)(s)
+
+    def cached():
+        igt.fix_text.cache_clear()
+        for args in calls:
+            igt.fix_text(*args)
+
+    mismatches = sum(1 for args in calls if fix_text_original(*args) != igt.fix_text(*args))
+    if mismatches:
+        print('WARNING: {} calls with results differing from the original'.format(mismatches))
+
+    for name, func in [
+        ('original', original),
+        ('compiled', uncached),
+        ('compiled + memoized', cached),
+    ]:
+        t = min(timeit.repeat(func, number=1, repeat=number))
+        print('{:<20} {:8.3f}s  {:8.2f}µs/call'.format(name, t, t * 1e6 / len(calls)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,261 @@
+"""
+End-to-end benchmarks on synthetic corpora, see `benchmarks.synthetic`.
+
+For each scale - a multiple of the 2M phones of DoReCo 1.2 - a synthetic raw corpus is generated
+and the following steps are timed and memory-profiled:
+- `build`: the CLDF conversion, i.e. `Dataset.cmd_makecldf`,
+- `createdb`: loading the CLDF data into SQLite, i.e. `cldf createdb`,
+- `views`: creating the views from `etc/views.sql` and reading all rows of each view,
+- `audio`: slicing the utterances from the synthetic WAV files, via `util.wav` and via `pydub`.
+
+Each step runs in a fresh process, so the reported peak RSS is the step's own. The results are
+written as JSON to `benchmarks/results/`, and two result files can be compared:
+
+    python -m benchmarks.suite --scale 1 5 10
+    python -m benchmarks.suite --compare benchmarks/results/A.json benchmarks/results/B.json
+
+No network access is needed: Unless the location of a CLTS clone is passed via `--clts`, IPA
+symbols are mapped to stand-in BIPA sounds - looking up sounds in CLTS is not what we benchmark.
+"""
+import os
+import re
+import json
+import time
+import types
+import logging
+import pathlib
+import argparse
+import platform
+import resource
+import datetime
+import traceback
+import tempfile
+import subprocess
+import multiprocessing
+
+from benchmarks import synthetic
+
+REPOS_DIR = pathlib.Path(__file__).parent.parent
+RESULTS_DIR = pathlib.Path(__file__).parent / 'results'
+CLTS_DIR = 'cldf-clts-clts-6dc73af'
+STEPS = ['generate', 'build', 'createdb', 'views', 'audio']
+
+
+class SyntheticCLTS:
+    """
+    Stand-in for `pyclts.CLTS`, resolving any IPA symbol to a sound with the symbol as name.
+    """
+    class BIPA(dict):
+        def __missing__(self, key):
+            return types.SimpleNamespace(s=key, name='synthetic {}'.format(key), type='sound')
+
+    def __init__(self, repos):
+        self.bipa = self.BIPA()
+
+
+def step_generate(path, scale, corpora, wavs):
+    return {k: str(v) for k, v in synthetic.generate(
+        path, scale=scale, corpora=corpora, wavs=wavs).items()}
+
+
+def step_build(path, clts):
+    import pyclts
+    import cldfbench_doreco
+
+    # Worker processes of the conversion instantiate `Dataset()`, so we re-locate the class.
+    cldfbench_doreco.Dataset.dir = path
+    os.chdir(str(path))
+    if clts:
+        if not path.joinpath(CLTS_DIR).exists():
+            path.joinpath(CLTS_DIR).symlink_to(pathlib.Path(clts).resolve())
+    else:
+        path.joinpath(CLTS_DIR).mkdir(exist_ok=True)
+        pyclts.CLTS = SyntheticCLTS
+    cldfbench_doreco.Dataset()._cmd_makecldf(argparse.Namespace(
+        log=logging.getLogger(__name__),
+        dev=False,
+        verbose=False,
+        glottolog=None,
+        concepticon=None,
+        clts=None,
+        with_cldfreadme=False,
+        with_zenodo=False,
+    ))
+
+
+def step_createdb(path):
+    from pycldf import Dataset
+    from pycldf.db import Database
+
+    db = Database(
+        Dataset.from_metadata(path / 'cldf' / 'Generic-metadata.json'),
+        fname=path / 'doreco.sqlite')
+    db.write_from_tg(_force=True)
+
+
+def step_views(path):
+    from dorecocommands.query import Database
+
+    sql = REPOS_DIR.joinpath('etc', 'views.sql').read_text(encoding='utf8')
+    res = {}
+    with Database(path / 'doreco.sqlite').connection() as conn:
+        res['phones.csv'] = dict(rows=conn.execute('SELECT count(*) FROM `phones.csv`').fetchone()[0])
+        start = time.perf_counter()
+        conn.executescript(sql)
+        res['create'] = dict(seconds=time.perf_counter() - start)
+        for view in re.findall(r'CREATE\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', sql):
+            start, n = time.perf_counter(), 0
+            for _ in conn.execute('SELECT * FROM {}'.format(view)):
+                n += 1
+            res[view] = dict(seconds=time.perf_counter() - start, rows=n)
+    return res
+
+
+def step_audio(path, wavs):
+    from util import wav
+    from dorecocommands.query import Database
+
+    db = Database(path / 'doreco.sqlite')
+    res = dict(wav=dict(seconds=0.0, slices=0), pydub=dict(seconds=0.0, slices=0))
+    for fid, p in sorted(wavs.items()):
+        utts = db.query(
+            'SELECT start, end FROM `utterances.csv` WHERE cldf_mediaReference = ?', (fid,))
+        start = time.perf_counter()
+        w = wav.Wav(p)
+        for s, e in utts:
+            w.read(start=s, end=e)
+        res['wav']['seconds'] += time.perf_counter() - start
+        res['wav']['slices'] += len(utts)
+
+        try:
+            import pydub
+            from dorecocommands.audio import get_mono_channel, INTERVAL_OFFSET, FADE_TIME
+        except ImportError:  # pragma: no cover
+            res['pydub'] = None
+            continue
+        start = time.perf_counter()
+        audio = get_mono_channel(pydub.AudioSegment.from_wav(str(p)))
+        for s, e in utts:
+            audio[s * 1000 - INTERVAL_OFFSET:e * 1000 + INTERVAL_OFFSET]\
+                .fade_in(duration=FADE_TIME).fade_out(duration=FADE_TIME)
+        res['pydub']['seconds'] += time.perf_counter() - start
+        res['pydub']['slices'] += len(utts)
+    return res
+
+
+def _measure(queue, func, args):
+    start, cpu = time.perf_counter(), os.times()
+    try:
+        result = func(*args)
+    except Exception:
+        queue.put(dict(error=traceback.format_exc()))
+        raise
+    wall, cpu_end = time.perf_counter() - start, os.times()
+    queue.put(dict(
+        seconds=wall,
+        cpu_seconds=sum(cpu_end[:4]) - sum(cpu[:4]),  # Including worker processes.
+        max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        max_rss_children_mb=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        **({} if result is None else dict(result=result))
+    ))
+
+
+def measure(func, *args):
+    """
+    Run `func(*args)` in a fresh process, measuring time and peak memory.
+
+    Processes are forked - so that worker processes of the conversion inherit the re-located
+    `Dataset` class - from this lightweight driver process, which does not inflate the peak RSS.
+    """
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(queue, func, args))
+    proc.start()
+    res = queue.get()
+    proc.join()
+    if 'error' in res:
+        raise RuntimeError('{} failed:\n{}'.format(func.__name__, res['error']))
+    return res
+
+
+def run(scale, workdir, corpora=51, wavs=2, clts=None, log=print):
+    workdir.mkdir(parents=True, exist_ok=True)
+    res = dict(scale=scale, corpora=corpora)
+    for step in STEPS:
+        log('scale {}: {}'.format(scale, step))
+        if step == 'generate':
+            res[step] = measure(step_generate, workdir, scale, corpora, wavs)
+            files = {k: pathlib.Path(v) for k, v in res[step].pop('result').items()}
+        elif step == 'build':
+            res[step] = measure(step_build, workdir, clts)
+        elif step == 'createdb':
+            res[step] = measure(step_createdb, workdir)
+        elif step == 'views':
+            res[step] = measure(step_views, workdir)
+            res['phones'] = res[step]['result'].pop('phones.csv')['rows']
+        else:
+            res[step] = measure(step_audio, workdir, files)
+        log('  {:.1f}s, {:.0f}MB'.format(res[step]['seconds'], res[step]['max_rss_mb']))
+    return res
+
+
+def compare(old, new):
+    old, new = [json.loads(pathlib.Path(p).read_text(encoding='utf8')) for p in [old, new]]
+    old = {r['scale']: r for r in old['runs']}
+    for run_ in new['runs']:
+        if run_['scale'] not in old:
+            continue
+        for step in STEPS:
+            o, n = old[run_['scale']].get(step), run_.get(step)
+            if o and n:
+                print('{:>5}x {:<10} {:8.2f}s -> {:8.2f}s ({:+.0%})  {:8.0f}MB -> {:8.0f}MB'.format(
+                    run_['scale'], step,
+                    o['seconds'], n['seconds'], n['seconds'] / o['seconds'] - 1,
+                    o['max_rss_mb'], n['max_rss_mb']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--scale', type=float, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--corpora', type=int, default=51)
+    parser.add_argument(
+        '--wavs', type=int, default=2, help='Number of WAV files to create for audio slicing.')
+    parser.add_argument('--clts', type=pathlib.Path, default=None, help='Path to CLTS data.')
+    parser.add_argument(
+        '--workdir', type=pathlib.Path, default=None,
+        help='Directory to create the synthetic datasets in (defaults to a temporary directory).')
+    parser.add_argument('--output', type=pathlib.Path, default=None)
+    parser.add_argument('--compare', type=pathlib.Path, nargs=2, default=None)
+    args = parser.parse_args(args)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=str(REPOS_DIR)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):  # pragma: no cover
+        commit = None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    results = dict(
+        created=now.isoformat(),
+        commit=commit,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        runs=[])
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scale:
+            workdir = (args.workdir or pathlib.Path(tmp)) / 'scale-{}'.format(scale)
+            results['runs'].append(
+                run(scale, workdir, corpora=args.corpora, wavs=args.wavs, clts=args.clts))
+
+    output = args.output or RESULTS_DIR / '{}.json'.format(now.strftime('%Y%m%dT%H%M%S'))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding='utf8')
+    print('results written to {}'.format(output))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,230 @@
+"""
+Generator of synthetic raw DoReCo corpora, for benchmarking without downloading the real data.
+
+The generated files follow the formats read by `Dataset.cmd_makecldf` - `languages.csv`,
+`sources.bib` and per corpus `<gc>_metadata.csv`, `<gc>_files.json`, `<gc>_gloss-abbreviations.csv`,
+`<gc>_wd.csv` and `<gc>_ph.csv` - with phones drawn from `etc/orthography.tsv` according to their
+frequency. The size of the corpus is given as multiple of the 2M phones of DoReCo 1.2:
+
+    python -m benchmarks.synthetic /tmp/doreco-synthetic --scale 0.1 --wavs 2
+
+Optionally, WAV files with noise are created for the first file of the first corpora, so audio
+slicing can be benchmarked, too.
+"""
+import csv
+import json
+import wave
+import random
+import pathlib
+import argparse
+import itertools
+
+import numpy as np
+
+ETC_DIR = pathlib.Path(__file__).parent.parent / 'etc'
+PHONES_PER_SCALE = 2000000
+PHONES_PER_FILE = 4000
+LABELS = ['<<fp>>', '<<ui>>', '<<fs>>']
+GLOSSES = ['PL', 'SG', 'PST', 'NEG', '1SG', '3PL']
+SAMPLE_RATE = 16000
+
+LANGUAGES_HEADER = [
+    "Language", "Glottocode", "iso-639-3", "Family", "fam_glottocode", "Area", "Creator",
+    "Latitude", "Longitude", "Archive", "Archive_link", "Translation", "Annotation license",
+    "Audio license", "DOI", "Gloss", "Extended speakers", "Extended word tokens", "Extended texts",
+    "Core speakers", "core word tokens", "Core texts", "Years of recordings in core set"]
+METADATA_HEADER = [
+    'name', 'extended', 'rec_date', 'rec_date_c', 'genre', 'genre_stim', 'gloss', 'transl',
+    'sound_quality', 'background_noise', 'spk_code', 'spk_age', 'spk_sex', 'spk_age_c']
+PH_HEADER = ['lang', 'file', 'core_extended', 'speaker', 'wd_ID', 'ph_ID', 'ph', 'start', 'end']
+WD_HEADER = [
+    'lang', 'file', 'core_extended', 'speaker', 'wd_ID', 'wd', 'start', 'end', 'ref', 'tx', 'ft',
+    'mb', 'ps', 'gl', 'mb_ID']
+
+
+def glottocode(i):
+    return 'synt{}'.format(1000 + i)
+
+
+def file_id(gc, i):
+    return 'doreco_{}_F{:03d}'.format(gc, i)
+
+
+class Generator:
+    """
+    Writes one synthetic corpus per Glottocode, with files of about `PHONES_PER_FILE` phones.
+    """
+    def __init__(self, raw_dir, scale=1.0, corpora=51, seed=1):
+        self.raw_dir = pathlib.Path(raw_dir)
+        self.raw_dir.mkdir(parents=True, exist_ok=True)
+        self.rng = random.Random(seed)
+        self.glottocodes = [glottocode(i) for i in range(corpora)]
+        self.nfiles = max(1, int(round(scale * PHONES_PER_SCALE / PHONES_PER_FILE / corpora)))
+        graphemes, weights = [], []
+        with ETC_DIR.joinpath('orthography.tsv').open(encoding='utf8') as f:
+            for row in csv.DictReader(f, delimiter='\t'):
+                if row['Grapheme'] and not row['Grapheme'].startswith('<'):
+                    graphemes.append(row['Grapheme'])
+                    weights.append(int(row['Frequency'] or 1))
+        self.graphemes, self.weights = graphemes, list(itertools.accumulate(weights))
+
+    def phones(self, n):
+        return self.rng.choices(self.graphemes, cum_weights=self.weights, k=n)
+
+    def write_languages(self):
+        with self.raw_dir.joinpath('languages.csv').open('w', encoding='utf8', newline='') as f:
+            w = csv.DictWriter(f, LANGUAGES_HEADER)
+            w.writeheader()
+            for i, gc in enumerate(self.glottocodes):
+                row = {k: '' for k in LANGUAGES_HEADER}
+                row.update({
+                    'Language': 'Synthetic {}'.format(i),
+                    'Glottocode': gc,
+                    'Family': 'Synthetic',
+                    'Area': 'Eurasia',
+                    'Creator': 'Doe, Jane',
+                    'Latitude': '0',
+                    'Longitude': '0',
+                    'Archive': 'none',
+                    'Archive_link': 'none',
+                    'Annotation license': 'CC BY',
+                    'Audio license': 'CC BY',
+                    'DOI': '10.34847/nkl.synthetic{}'.format(i),
+                })
+                w.writerow(row)
+        self.raw_dir.joinpath('sources.bib').write_text(''.join(
+            '@misc{{doreco-{0},\n  title = {{Synthetic corpus {0}}}\n}}\n'.format(gc)
+            for gc in self.glottocodes), encoding='utf8')
+
+    def write_corpus(self, gc):
+        files = {}
+        with self.raw_dir.joinpath('{}_metadata.csv'.format(gc)).open(
+                'w', encoding='utf8', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(METADATA_HEADER)
+            for i in range(self.nfiles):
+                fid = file_id(gc, i)
+                w.writerow([
+                    fid.split('_', maxsplit=2)[-1], 'no', '2020', 'certain', 'personal narrative',
+                    'na', 'yes', 'eng', 'good', 'none', 'S1/S2', '30/40', 'f/m', 'certain'])
+                files[fid] = ['https://example.org/{}.wav'.format(fid), 1]
+        with self.raw_dir.joinpath('{}_files.json'.format(gc)).open('w', encoding='utf8') as f:
+            json.dump(files, f)
+        with self.raw_dir.joinpath('{}_gloss-abbreviations.csv'.format(gc)).open(
+                'w', encoding='utf8', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['Gloss', 'LGR', 'Meaning'])
+            w.writerows([[g, 'yes', g.lower()] for g in GLOSSES])
+
+        durations = {}
+        with self.raw_dir.joinpath('{}_ph.csv'.format(gc)).open(
+                'w', encoding='utf8', newline='') as fph, \
+                self.raw_dir.joinpath('{}_wd.csv'.format(gc)).open(
+                    'w', encoding='utf8', newline='') as fwd:
+            ph, wd = csv.writer(fph), csv.writer(fwd)
+            ph.writerow(PH_HEADER)
+            wd.writerow(WD_HEADER)
+            wid, pid, mid = 0, 0, 0
+            for i in range(self.nfiles):
+                fid, t, nphones, u = file_id(gc, i), 0.0, 0, 0
+                while nphones < PHONES_PER_FILE:
+                    u += 1
+                    speaker = self.rng.choice(['S1', 'S2'])
+                    words = []
+                    for _ in range(self.rng.randint(1, 8)):
+                        if self.rng.random() < 0.03:
+                            words.append([self.rng.choice(LABELS)])
+                        else:
+                            words.append(self.phones(self.rng.randint(1, 7)))
+                    tx = ' '.join(''.join(w) for w in words)
+                    ft = 'Translation of utterance {}.'.format(u) if u % 5 else '****'
+                    for phones in words + [['<p:>']]:
+                        wid += 1
+                        wstart = t
+                        for p in phones:
+                            pid += 1
+                            d = 0.3 if p == '<p:>' else self.rng.uniform(0.03, 0.2)
+                            ph.writerow([
+                                gc, fid, 'core', speaker, 'w{}'.format(wid), 'p{}'.format(pid), p,
+                                '{:.3f}'.format(t), '{:.3f}'.format(t + d)])
+                            t = float('{:.3f}'.format(t + d))
+                        nphones += len(phones)
+                        form = ''.join(phones)
+                        ref, txt, ftt = '{}_{}'.format(fid, u), tx, ft
+                        if form == '<p:>':
+                            mb, ps, gl, mbid, ref, txt, ftt = '', '', '', '', '', form, form
+                        elif form.startswith('<'):
+                            mb, ps, gl, mbid = '', '', '', ''
+                        else:
+                            mid += 2
+                            gloss = self.rng.choice(GLOSSES)
+                            mb, ps, gl = form + ' -' + gloss.lower(), 'n sfx', 'stem -' + gloss
+                            mbid = 'm{} m{}'.format(mid - 1, mid)
+                        wd.writerow([
+                            gc, fid, 'core', speaker, 'w{}'.format(wid), form,
+                            '{:.3f}'.format(wstart), '{:.3f}'.format(t), ref, txt, ftt,
+                            mb, ps, gl, mbid])
+                durations[fid] = t
+        return durations
+
+    def write_wav(self, path, duration):
+        """
+        Write a mono 16-bit WAV file of `duration` seconds of noise.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(0)
+        nframes = int(duration * SAMPLE_RATE) + SAMPLE_RATE
+        with wave.open(str(path), 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            for i in range(0, nframes, SAMPLE_RATE * 60):
+                n = min(SAMPLE_RATE * 60, nframes - i)
+                w.writeframes((rng.standard_normal(n) * 3000).astype('<i2').tobytes())
+
+    def generate(self, audio_dir=None, wavs=0):
+        """
+        :param audio_dir: Directory to write WAV files to, in the layout of `Dataset.audio_dir`.
+        :param wavs: Number of corpora for which to write a WAV file (of the first file).
+        :return: `dict` mapping File_IDs of the created WAV files to their paths.
+        """
+        self.write_languages()
+        res = {}
+        for i, gc in enumerate(self.glottocodes):
+            durations = self.write_corpus(gc)
+            if audio_dir and i < wavs:
+                fid = file_id(gc, 0)
+                res[fid] = pathlib.Path(audio_dir) / gc / '{}.wav'.format(fid)
+                self.write_wav(res[fid], durations[fid])
+        return res
+
+
+def generate(path, scale=1.0, corpora=51, wavs=0, seed=1):
+    """
+    Create a synthetic dataset directory with `raw/` and (optionally) `audio/` data, and a copy of
+    `etc/`.
+    """
+    path = pathlib.Path(path)
+    path.joinpath('etc').mkdir(parents=True, exist_ok=True)
+    for p in ETC_DIR.iterdir():
+        if p.is_file():
+            path.joinpath('etc', p.name).write_bytes(p.read_bytes())
+    return Generator(path / 'raw', scale=scale, corpora=corpora, seed=seed).generate(
+        audio_dir=path / 'audio', wavs=wavs)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('path', type=pathlib.Path)
+    parser.add_argument(
+        '--scale', type=float, default=1.0,
+        help='Size of the corpus as multiple of {} phones.'.format(PHONES_PER_SCALE))
+    parser.add_argument('--corpora', type=int, default=51)
+    parser.add_argument('--wavs', type=int, default=0, help='Number of WAV files to create.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(args)
+    generate(args.path, scale=args.scale, corpora=args.corpora, wavs=args.wavs, seed=args.seed)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
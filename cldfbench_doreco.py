@@ -22,30 +22,24 @@ import re
 import html
 import decimal
 import pathlib
+import functools
 import itertools
 import subprocess
 import collections
+import concurrent.futures
 import urllib.error
 import urllib.parse
 import urllib.request
 
-from tqdm import tqdm
-import pybtex.database
-from pyclts import CLTS
 from cldfbench import Dataset as BaseDataset
 from cldfbench import CLDFSpec
 from clldutils.clilib import confirm
 from clldutils.jsonlib import dump, load
 from clldutils.markup import add_markdown_text
-from clldutils.lgr import ABBRS, PERSONS
-
-from util import nakala
-from util import igt
 
 SILENT_PAUSE = '<p:>'
 FILLER = '****'
 LABEL_PATTERN = re.compile(r'<<(?P<label>fp|fs|pr|fm|sg|bc|id|on|wip|ui)>(?P<content>[^>]+)?>')
-LGR_PERSON_AND_ABBR = {p + a for p, a in itertools.product(PERSONS, ABBRS)}
 CORPUS_CITATION_FMT = \
     "{Creator}. 2022. {Language} DoReCo dataset. In Seifart, Frank, Ludger Paschen and " \
     "Matthew Stave (eds.). Language Documentation Reference Corpus (DoReCo) 1.2. Berlin & Lyon: " \
@@ -54,14 +48,59 @@ CORPUS_CITATION_FMT = \
     "https://doreco.huma-num.fr/languages/{Glottocode}. DOI:{DOI}"
 
 
+@functools.lru_cache(maxsize=None)
+def lgr_abbrs():
+    from clldutils.lgr import ABBRS, PERSONS
+
+    return set(ABBRS) | {p + a for p, a in itertools.product(PERSONS, ABBRS)}
+
+
 def is_lgr_abbr(s):
-    return s in ABBRS or (s in LGR_PERSON_AND_ABBR)
+    return s in lgr_abbrs()
 
 
 def global_id(glottocode, local_id):
     return '{}_{}'.format(glottocode, local_id)
 
 
+def utterances(rows):
+    """
+    Group rows from `*_wd.csv` by utterance, i.e. by (file, tx, ft).
+    """
+    return itertools.groupby(rows, lambda r: (r['file'], r['tx'], r['ft']))
+
+
+def is_example(tx, ft):
+    # Create an entry in ExampleTable if tx not in ['', None, '****', '<p:>']
+    return bool(tx and ft and ft not in {FILLER, SILENT_PAUSE})
+
+
+def corpus_examples(gc, files):
+    """
+    Create the IGT examples for the utterances of one corpus, in order.
+
+    :param files: IDs of the downloadable audio files of the corpus.
+    :return: `tuple` (examples, rows) - a `list` with one item - an example `dict` or `None` - per \
+    utterance for which `is_example` is true, and the `list` of rows of `{gc}_wd.csv`, such that \
+    the file needs to be read and normalized only once.
+    """
+    from util import igt
+
+    eids = collections.defaultdict(int)
+    res, wd_rows = [], list(Dataset().iter_rows('{}_wd.csv'.format(gc)))
+    for (f, tx, ft), rows in utterances(wd_rows):
+        if is_example(tx, ft):
+            rows = list(rows)
+            res.append(igt.igt(
+                rows,
+                tx,
+                ft,
+                eids,
+                rows[0]['file']
+                if rows[0]['core_extended'] != 'extended' and rows[0]['file'] in files else None))
+    return res, wd_rows
+
+
 class Dataset(BaseDataset):
     dir = pathlib.Path(__file__).parent
     id = "doreco"
@@ -73,7 +112,24 @@ class Dataset(BaseDataset):
             zipped={'phones.csv', 'words.csv'},
         )
 
+    @property
+    def audio_dir(self):
+        return self.dir / 'audio'
+
+    def iter_media(self):
+        """
+        Iterate over the files listed in MediaTable for which the audio has been downloaded.
+
+        :return: Generator of pairs (MediaTable row as `dict`, path to the WAV file).
+        """
+        for row in self.cldf_dir.read_csv('media.csv', dicts=True):
+            p = self.audio_dir / row['Corpus_ID'] / '{}.wav'.format(row['ID'])
+            if p.exists():
+                yield row, p
+
     def cmd_download(self, args):
+        from util import nakala
+
         self.raw_dir.download(
             "https://sharedocs.huma-num.fr/wl/?id=sbLShl5tHQ7J2INRpMaJcotNYWPQioDV&fmode=download",  # v1.2
             'languages.csv')
@@ -99,7 +155,7 @@ class Dataset(BaseDataset):
                         if f.mime_type == 'audio/x-wav':
                             audio[f.name.replace('.wav', '')] = (f.url, f.size)
                             if with_audio_data:
-                                target = self.dir / 'audio' / row['Glottocode'] / f.name
+                                target = self.audio_dir / row['Glottocode'] / f.name
                                 target.parent.mkdir(parents=True, exist_ok=True)
                                 if not target.exists():
                                     try:
@@ -150,6 +206,8 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
     """, section="Description")
 
     def iter_rows(self, pattern):
+        from util import igt
+
         mismatch = set()
         for p in sorted(self.raw_dir.glob(pattern), key=lambda pp: pp.name):
             # What to do if there are tab-delimited files? Sniff!
@@ -178,6 +236,10 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                 yield row
 
     def cmd_makecldf(self, args):
+        import pybtex.database
+        from tqdm import tqdm
+        from pyclts import CLTS
+
         clts_data = pathlib.Path('cldf-clts-clts-6dc73af')
         if not clts_data.exists():
             clts_data = pathlib.Path(input('Path to clts data: '))
@@ -196,7 +258,9 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
         ))
 
         known, i = {}, 0
+        xsampa_to_ipa = {}
         for xsampa, bipa in xsampa_to_bipa.items():
+            xsampa_to_ipa[xsampa] = bipa.s
             if bipa.s not in known:
                 i += 1
                 args.writer.objects['ParameterTable'].append(dict(
@@ -296,10 +360,93 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                 "Glottocode": row["Glottocode"]
             })
 
-        wd_intervals = {}  # We store start and end of words - as specified by contained phones.
+        from util.checkpoints import Checkpoints
+
+        # Results of each stage are checkpointed per corpus, so a failed run can be resumed:
+        checkpoints = Checkpoints(
+            getattr(args, 'checkpoints', None) or self.dir / 'checkpoints',
+            resume=getattr(args, 'resume', False))
+        orthography = self.etc_dir / 'orthography.tsv'
+
         uid = 0  # We are adding utterance IDs.
-        gc = None
-        for wid, rows in tqdm(itertools.groupby(self.iter_rows('*_ph.csv'), lambda r: r['wd_ID']), desc='phones'):
+        # Utterances are aggregated from their phones while we iterate over phones:
+        utts = collections.OrderedDict()
+        # Per corpus, we store start and end of words - as specified by contained phones - and the
+        # segments of words - as IPA if possible, X-SAMPA otherwise.
+        wd_intervals, wd_segments = {}, {}
+        phone_fps = {}
+        for gc in tqdm(self.corpora('ph'), desc='phones'):
+            fp = phone_fps[gc] = checkpoints.fingerprint(
+                uid, orthography, self.raw_dir / '{}_ph.csv'.format(gc),
+                self.raw_dir / '{}_files.json'.format(gc), sorted(speakers))
+            res = checkpoints.load('phones', gc, fp)
+            if res is None:
+                res = self.corpus_phones(
+                    gc, uid, speakers, filemd[gc], xsampa_to_bipa, xsampa_to_ipa)
+                checkpoints.save('phones', gc, fp, res)
+            uid = res['uid']
+            args.writer.objects["phones.csv"].extend(res['phones'])
+            utts.update(res['utterances'])
+            wd_intervals[gc], wd_segments[gc] = res['intervals'], res['segments']
+
+        for utt in utts.values():
+            utt['speech_rate'] = (utt['phones'] / utt['duration']).quantize(decimal.Decimal('0.001')) \
+                if utt['duration'] else None
+            args.writer.objects['utterances.csv'].append(utt)
+
+        # IGT examples are created per corpus in worker processes, while words are added here.
+        corpora = self.corpora('wd')
+        fps = {
+            gc: checkpoints.fingerprint(
+                self.raw_dir / '{}_wd.csv'.format(gc),
+                self.raw_dir / '{}_files.json'.format(gc),
+                phone_fps.get(gc))
+            for gc in corpora}
+        done = {gc: checkpoints.load('words', gc, fps[gc]) for gc in corpora}
+        todo = [gc for gc in corpora if done[gc] is None]
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            examples = executor.map(corpus_examples, todo, [set(filemd[gc]) for gc in todo])
+            for gc in tqdm(corpora, desc='words'):
+                res = done[gc]
+                if res is None:
+                    res = self.corpus_words(
+                        gc,
+                        *next(examples),
+                        wd_intervals.get(gc, {}),
+                        wd_segments.get(gc, {}),
+                        filemd[gc])
+                    assert not wd_intervals.get(gc), \
+                        '{} missing wd_IDs linked from phones!'.format(len(wd_intervals[gc]))
+                    checkpoints.save('words', gc, fps[gc], res)
+                args.writer.objects['ExampleTable'].extend(res['examples'])
+                args.writer.objects["words.csv"].extend(res['words'])
+                wd_intervals.pop(gc, None)
+        missing = sum(len(v) for v in wd_intervals.values())
+        assert not missing, '{} missing wd_IDs linked from phones!'.format(missing)
+        checkpoints.clear()
+
+    def corpora(self, kind):
+        """
+        :param kind: `ph` or `wd`.
+        :return: Glottocodes of the corpora with raw files of the given kind, in processing order.
+        """
+        return [
+            p.name.partition('_')[0]
+            for p in sorted(self.raw_dir.glob('*_{}.csv'.format(kind)), key=lambda pp: pp.name)]
+
+    def corpus_phones(self, gc, uid, speakers, files, xsampa_to_bipa, xsampa_to_ipa):
+        """
+        Process the phones of one corpus, aggregating utterances and the time intervals of words.
+
+        :param uid: The utterance ID counter at the start of the corpus.
+        :return: `dict` with phones, utterances, word intervals and segments and the counter `uid`.
+        """
+        phones, utts, wd_intervals, wd_segments = [], collections.OrderedDict(), {}, {}
+        ukey, uwid = None, None
+        # The previous phone in the same file and speaker, and in an utterance:
+        prev, prev_key, uprev = None, None, None
+        for wid, rows in itertools.groupby(
+                self.iter_rows('{}_ph.csv'.format(gc)), lambda r: r['wd_ID']):
             i, core, row, global_wid = 0, True, None, None
             while core:
                 try:
@@ -312,11 +459,7 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                     break
                 start, end = decimal.Decimal(row["start"]), decimal.Decimal(row["end"])
                 if i == 0:  # The first phone in the word.
-                    if row['Glottocode'] != gc:
-                        # A new corpus, make sure we are not conflating utterance.
-                        # FIXME: Should be done per file!
-                        uid += 1
-                    gc = row['Glottocode']
+                    assert gc == row['Glottocode']
                     if wid.split()[0] != wid:
                         # Known problem of the Evenki corpus, see
                         # https://github.com/DoReCo/doreco/issues/13
@@ -324,17 +467,41 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                         wid = wid.split()[-1]
                     global_wid = global_id(gc, wid)
                     wd_intervals[global_wid] = [start, None]
+                    wd_segments[global_wid] = []
                     speaker = global_id(gc, row['speaker'])
                     if speaker.startswith('yuca1254_0'):
                         # Known problem of the Yucatec corpus, see
                         # https://github.com/DoReCo/doreco/issues/5#issuecomment-1490180631
                         speaker = speaker.replace('0', '')
                     assert speaker in speakers, 'Unknown speaker: {}'.format(speaker)
+                    if (gc, row['file'], speaker) != ukey:
+                        # A new corpus, file or speaker, make sure we are not conflating utterances.
+                        uid += 1
+                        ukey = (gc, row['file'], speaker)
                 else:
-                    assert start >= args.writer.objects["phones.csv"][-1]['end']
+                    assert start >= phones[-1]['end']
                 if row['ph'] == SILENT_PAUSE:  # Silent pauses delimit utterances.
                     uid += 1
-                args.writer.objects["phones.csv"].append({
+                else:
+                    if str(uid) not in utts:
+                        utts[str(uid)] = {
+                            'u_ID': str(uid),
+                            'Language_ID': gc,
+                            'File_ID': row['file'] if row['file'] in files else None,
+                            'Speaker_ID': speaker,
+                            'start': start,
+                            'duration': 0,
+                            'phones': 0,
+                            'words': 0,
+                        }
+                    utt = utts[str(uid)]
+                    utt['end'] = end
+                    utt['duration'] += end - start
+                    utt['phones'] += 1
+                    if (uid, global_wid) != uwid:
+                        utt['words'] += 1
+                        uwid = (uid, global_wid)
+                phone = {
                     "ph_ID": gc + "_" + row["ph_ID"],
                     "ph": row["ph"],
                     "IPA": xsampa_to_bipa[row['ph']] if row['ph'] in xsampa_to_bipa else None,
@@ -345,45 +512,78 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                     'u_ID': None if row['ph'] == SILENT_PAUSE else str(uid),
                     'Token_Type': 'pause' if row['ph'] == SILENT_PAUSE else (
                         'label' if row['ph'].startswith('<<') else 'xsampa'),
-                })
+                    'wd_position': i + 1,
+                    'wd_initial': i == 0,
+                    'wd_final': False,  # Set when we reach the end of the word.
+                }
+                # Positional information which is only known once we see the next phone is filled
+                # in for the previous phone:
+                if prev and prev_key == ukey:
+                    phone['prev_ph_ID'] = prev['ph_ID']
+                    prev['next_ph_ID'] = phone['ph_ID']
+                prev, prev_key = phone, ukey
+                if phone['u_ID']:
+                    phone['u_position'] = utt['phones']
+                    phone['u_initial'] = utt['phones'] == 1
+                    phone['u_final'] = False
+                    if uprev and uprev['u_ID'] != phone['u_ID']:
+                        uprev['u_final'] = True
+                    uprev = phone
+                if phone['Token_Type'] == 'xsampa':
+                    wd_segments[global_wid].append(xsampa_to_ipa.get(row['ph'], row['ph']))
+                phones.append(phone)
                 i += 1
-
-        eids = collections.defaultdict(int)
-        for (f, tx, ft), rows in tqdm(itertools.groupby(self.iter_rows('*_wd.csv'), lambda r: (r['file'], r['tx'], r['ft'])), desc='words'):
+            if i:
+                phones[-1]['wd_final'] = True
+        if uprev:  # The next corpus starts with a new utterance.
+            uprev['u_final'] = True
+        return dict(
+            phones=phones, utterances=utts, intervals=wd_intervals, segments=wd_segments, uid=uid)
+
+    def corpus_words(self, gc, corpus_exs, wd_rows, wd_intervals, wd_segments, files):
+        """
+        Process the words of one corpus, linking them to examples.
+
+        :param corpus_exs: The examples returned by `corpus_examples` for the corpus.
+        :param wd_rows: The rows of `{gc}_wd.csv` as returned by `corpus_examples`.
+        :param wd_intervals: The word intervals of the corpus, as computed from the phones. \
+        Intervals of words are removed when the word is processed.
+        :return: `dict` with examples and words.
+        """
+        res = dict(examples=[], words=[])
+        corpus_exs = iter(corpus_exs)
+        for (f, tx, ft), rows in utterances(wd_rows):
             rows = list(rows)
             eid = None
-            # Create an entry in ExampleTable if tx not in ['', None, '****', '<p:>']
-            if tx and ft and ft not in {FILLER, SILENT_PAUSE}:
-                ex = igt.igt(
-                    rows,
-                    tx,
-                    ft,
-                    eids,
-                    rows[0]['file'] if rows[0]['core_extended'] != 'extended' and rows[0]['file'] in filemd[rows[0]['Glottocode']] else None)
+            if is_example(tx, ft):
+                ex = next(corpus_exs)
                 if ex:
-                    args.writer.objects['ExampleTable'].append(ex)
+                    res['examples'].append(ex)
                     eid = ex['ID']
 
             for row in rows:
                 gc = row['Glottocode']
                 wid = global_id(gc, row['wd_ID'])
-                sid = None
+                sid, segments = None, None
                 start, end = decimal.Decimal(row["start"]), decimal.Decimal(row["end"])
                 if wid in wd_intervals:
                     ps, pe = wd_intervals[wid]
                     assert start <= ps and pe <= end, 'Conflicting time alignment of wd and ph.'
                     sid = global_id(gc, row["speaker"])
                     del wd_intervals[wid]
+                    segments = wd_segments.pop(wid)
                 core = row['core_extended'] != 'extended'
-                args.writer.objects["words.csv"].append({
+                res['words'].append({
                     "Language_ID": gc,
-                    "File_ID": row["file"] if core and row['file'] in filemd[gc] else None,
+                    "File_ID": row["file"] if core and row['file'] in files else None,
                     "core": core,
                     # Only speakers for core words are normalized.
                     "Speaker_ID": sid,
                     "Example_ID": eid,
                     "wd_ID": wid,
                     "wd": row["wd"],
+                    "IPA": ''.join(segments) if segments else None,
+                    "Segments": segments or None,
                     "start": start,
                     "end": end,
                     "duration": end - start,
@@ -395,7 +595,7 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                     "ps": row["ps"].split(),
                     "gl": row["gl"].split(),
                 })
-        assert not wd_intervals, '{} missing wd_IDs linked from phones!'.format(len(wd_intervals))
+        return res
 
     def create_schema(self, cldf):
         t = cldf.add_component(
@@ -542,7 +742,7 @@ See [USAGE](USAGE.md) for information how the dataset can be analyszed.
                 'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#parameterReference'},
             {
                 'name': 'u_ID',
-                'dc:description': 'Utterance ID. Utterances are words/phones delimited by silent pauses.',
+                'dc:description': 'Link to the utterance. Utterances are words/phones delimited by silent pauses.',
                 'datatype': 'string'},
             {
                 'name': 'Token_Type',
@@ -588,9 +788,99 @@ labels, the <p:> symbol has only one of each bracket, and no other content may b
                 'dc:description': 'Link to corresponding word.',
                 'datatype': 'string',
             },
+            {
+                'name': 'wd_position',
+                'dc:description': '1-based position of the phone (or pause or label) in the word.',
+                'datatype': 'integer',
+            },
+            {
+                'name': 'wd_initial',
+                'dc:description': 'Flag signaling whether the phone is the first in the word.',
+                'datatype': 'boolean',
+            },
+            {
+                'name': 'wd_final',
+                'dc:description': 'Flag signaling whether the phone is the last in the word.',
+                'datatype': 'boolean',
+            },
+            {
+                'name': 'u_position',
+                'dc:description': '1-based position of the phone (or label) in the utterance.',
+                'datatype': 'integer',
+            },
+            {
+                'name': 'u_initial',
+                'dc:description': 'Flag signaling whether the phone is the first in the utterance.',
+                'datatype': 'boolean',
+            },
+            {
+                'name': 'u_final',
+                'dc:description': 'Flag signaling whether the phone is the last in the utterance.',
+                'datatype': 'boolean',
+            },
+            {
+                'name': 'prev_ph_ID',
+                'dc:description': 'ID of the preceding phone (or pause or label) of the same speaker in the same file.',
+                'datatype': 'string',
+            },
+            {
+                'name': 'next_ph_ID',
+                'dc:description': 'ID of the following phone (or pause or label) of the same speaker in the same file.',
+                'datatype': 'string',
+            },
         )
         t.common_props['dc:description'] = 'This table lists individual, time-aligned phones.'
 
+        t = cldf.add_table(
+            'utterances.csv',
+            {'name': 'u_ID', 'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#id'},
+            {
+                'name': 'Language_ID',
+                'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#languageReference',
+                'datatype': 'string',
+            },
+            {
+                'name': 'File_ID',
+                'dc:description': 'Link to the audio file to which start and end markers pertain.',
+                'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#mediaReference',
+                'datatype': 'string',
+            },
+            {'name': 'Speaker_ID', 'datatype': 'string'},
+            {
+                'name': 'start',
+                'dc:description': 'Start of the utterance in the linked sound file in (floating point) seconds.',
+                'datatype': 'decimal',
+            },
+            {
+                'name': 'end',
+                'dc:description': 'End of the utterance in the linked sound file in (floating point) seconds.',
+                'datatype': 'decimal',
+            },
+            {
+                'name': 'duration',
+                'dc:description': 'Summed duration of the phones in the utterance in (floating point) seconds.',
+                'datatype': 'decimal',
+            },
+            {
+                'name': 'phones',
+                'dc:description': 'Number of phones (including labels) in the utterance.',
+                'datatype': 'integer',
+            },
+            {
+                'name': 'words',
+                'dc:description': 'Number of words with phones in the utterance.',
+                'datatype': 'integer',
+            },
+            {
+                'name': 'speech_rate',
+                'dc:description': 'Speech rate of the utterance in phones per second.',
+                'datatype': 'decimal',
+            },
+        )
+        t.common_props['dc:description'] = \
+            'This table lists utterances, i.e. stretches of speech of one speaker in one file, ' \
+            'delimited by silent pauses.'
+
         cldf.add_table(
             'words.csv',
             {'name': 'wd_ID', 'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#id'},
@@ -612,6 +902,20 @@ labels, the <p:> symbol has only one of each bracket, and no other content may b
                 'datatype': 'string',
             },
             {'name': 'Speaker_ID', 'datatype': 'string'},
+            {
+                'name': 'IPA',
+                'dc:description': 'The word form transcribed into IPA, concatenated from the phones of '
+                                  'the word (using X-SAMPA for phones without IPA correspondence).',
+                'datatype': 'string',
+            },
+            {
+                'name': 'Segments',
+                'dc:description': 'The phones of the word (excluding pauses and labels), as IPA if '
+                                  'possible, X-SAMPA otherwise.',
+                'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#segments',
+                'separator': ' ',
+                'datatype': 'string',
+            },
             {
                 'name': 'start',
                 'dc:description': 'Start of the word in the linked sound file in (floating point) seconds.',
@@ -673,3 +977,5 @@ labels, the <p:> symbol has only one of each bracket, and no other content may b
         cldf.add_foreign_key('ContributionTable', 'ID', 'LanguageTable', 'ID')
         cldf.add_foreign_key('phones.csv', 'wd_ID', 'words.csv', 'wd_ID')
         cldf.add_foreign_key('words.csv', 'Speaker_ID', 'speakers.csv', 'ID')
+        cldf.add_foreign_key('phones.csv', 'u_ID', 'utterances.csv', 'u_ID')
+        cldf.add_foreign_key('utterances.csv', 'Speaker_ID', 'speakers.csv', 'ID')
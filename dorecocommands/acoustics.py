@@ -0,0 +1,112 @@
+"""
+Compute acoustic measures for all phones in the downloaded audio files.
+
+For each file in MediaTable for which the WAV has been downloaded, RMS intensity, zero-crossing rate,
+spectral centroid and a simple F0 estimate are computed for all phones aligned to the file. The
+results are written to a table `phone_acoustics` in the SQLite database, keyed by phone ID.
+
+Files are processed in parallel; already processed files are skipped unless --force is given.
+"""
+import concurrent.futures
+
+from cldfbench_doreco import Dataset
+from .query import Database
+
+SQL_PHONES = """
+SELECT
+    p.cldf_id, p.start, p.end
+FROM
+    `phones.csv` AS p,
+    `words.csv` AS w
+WHERE
+    p.wd_id = w.cldf_id AND w.cldf_mediaReference = ?
+ORDER BY p.start
+"""
+TABLE = 'phone_acoustics'
+
+
+def register(parser):
+    parser.add_argument(
+        '--channel',
+        type=int,
+        default=1,
+        help='Channel of the recordings to analyse.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (defaults to the number of CPUs).')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        default=False,
+        help='Recompute measures for files which have been processed before.')
+
+
+def create_table(conn):
+    conn.execute("""
+CREATE TABLE IF NOT EXISTS {} (
+    ph_ID TEXT PRIMARY KEY NOT NULL,
+    File_ID TEXT NOT NULL,
+    rms REAL,
+    zcr REAL,
+    spectral_centroid REAL,
+    f0 REAL,
+    voiced REAL,
+    FOREIGN KEY(ph_ID) REFERENCES `phones.csv`(cldf_id)
+)""".format(TABLE))
+    conn.execute('CREATE INDEX IF NOT EXISTS {0}_file ON {0}(File_ID)'.format(TABLE))
+
+
+def file_features(dbpath, fid, path, channel):
+    """
+    Compute acoustic measures for all phones aligned to one file.
+
+    :return: list of rows for the `phone_acoustics` table.
+    """
+    from util import wav
+    from util import acoustics
+
+    phones = Database(dbpath).query(SQL_PHONES, (fid,))
+    if not phones:
+        return []
+    ids, starts, ends = zip(*phones)
+    res = acoustics.interval_features(wav.Wav(path), starts, ends, channel=channel)
+    return [
+        (pid, fid) + tuple(None if v != v else float(v) for v in values)  # NaN -> NULL
+        for pid, values in zip(ids, zip(*[res[k] for k in acoustics.FEATURES]))]
+
+
+def run(args):
+    from util import acoustics
+
+    ds = Dataset()
+    db = Database(ds.dir / 'doreco.sqlite')
+    with db.connection() as conn:
+        create_table(conn)
+        conn.commit()
+        done = {r[0] for r in conn.execute('SELECT DISTINCT File_ID FROM {}'.format(TABLE))}
+
+    todo = [(row['ID'], p) for row, p in ds.iter_media() if args.force or row['ID'] not in done]
+    args.log.info('computing acoustic measures for {} files'.format(len(todo)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(file_features, db.fname, fid, p, args.channel): fid
+            for fid, p in todo}
+        with db.connection() as conn:
+            for future in concurrent.futures.as_completed(futures):
+                fid = futures[future]
+                try:
+                    rows = future.result()
+                except ValueError as e:
+                    args.log.warning('{}: {}'.format(fid, e))
+                    continue
+                # Writing is done in the main process, with one transaction per file:
+                with conn:
+                    conn.execute('DELETE FROM {} WHERE File_ID = ?'.format(TABLE), (fid,))
+                    conn.executemany(
+                        'INSERT INTO {} VALUES (?, ?, {})'.format(
+                            TABLE, ', '.join('?' for _ in acoustics.FEATURES)),
+                        rows)
+                args.log.info('{}: {} phones'.format(fid, len(rows)))
@@ -0,0 +1,183 @@
+"""
+Check the alignment of phone annotations with the downloaded audio files.
+
+For each file in MediaTable for which the WAV has been downloaded, a frame-energy envelope is
+computed for all channels. Then we check
+- that silent pauses (<p:>) are low-energy and speech phones are not,
+- whether the energy envelope correlates best with the annotated speech/pause pattern when shifted
+  by a global time offset,
+- whether another channel of the recording matches the annotations better.
+
+Files for which a check fails are flagged as
+- "offset": the best correlation is found at a non-zero time offset,
+- "channel": another channel separates speech from pauses better,
+- "mismatch": weak separation of speech and pauses or weak correlation, e.g. because the WAV is from
+  a different session.
+"""
+import concurrent.futures
+
+from clldutils.clilib import Table, add_format
+
+from cldfbench_doreco import Dataset, SILENT_PAUSE
+from .query import Database
+
+SQL_PHONES = """
+SELECT
+    p.start, p.end, p.cldf_name, p.token_type
+FROM
+    `phones.csv` AS p,
+    `words.csv` AS w
+WHERE
+    p.wd_id = w.cldf_id AND w.cldf_mediaReference = ?
+"""
+COLS = [
+    'File_ID',
+    'channel',
+    'phones',
+    'pauses',
+    'speech_dB',
+    'pause_dB',
+    'separation',
+    'loud_pauses',
+    'offset',
+    'correlation',
+    'issues']
+
+
+def register(parser):
+    parser.add_argument(
+        '--channel',
+        type=int,
+        default=1,
+        help='Channel of the recordings which the annotations are assumed to pertain to.')
+    parser.add_argument(
+        '--max-offset',
+        type=float,
+        default=5.0,
+        help='Maximal global time offset (in seconds) to look for.')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.05,
+        help='Offsets (in seconds) up to this value are not flagged.')
+    parser.add_argument(
+        '--min-separation',
+        type=float,
+        default=6.0,
+        help='Minimal difference (in dB) between median speech and median pause energy.')
+    parser.add_argument(
+        '--min-correlation',
+        type=float,
+        default=0.2,
+        help='Minimal correlation between energy envelope and annotated speech/pause pattern.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (defaults to the number of CPUs).')
+    parser.add_argument(
+        '--only-issues',
+        action='store_true',
+        default=False,
+        help='Only list files for which at least one check failed.')
+    add_format(parser, 'simple')
+
+
+def check_file(dbpath,
+               fid,
+               path,
+               channel=1,
+               max_offset=5.0,
+               tolerance=0.05,
+               min_separation=6.0,
+               min_correlation=0.2):
+    """
+    Run the alignment checks for one file.
+
+    :return: `dict` with keys `COLS`, or `None` if no phones are aligned to the file.
+    """
+    import numpy as np
+    from util import wav
+    from util import acoustics
+
+    phones = Database(dbpath).query(SQL_PHONES, (fid,))
+    if not phones:
+        return None
+    starts, ends, ph, token_type = [np.array(c) for c in zip(*phones)]
+    starts, ends = starts.astype(float), ends.astype(float)
+    pause = (ph == SILENT_PAUSE) | (token_type == 'pause')
+    speech = token_type == 'xsampa'
+
+    env = acoustics.energy_envelope(wav.Wav(path))
+    means = acoustics.interval_means(env, starts, ends)  # Shape (phones, channels)
+    pause_db = np.median(means[pause], axis=0) if pause.any() else np.full(env.shape[1], np.nan)
+    speech_db = np.median(means[speech], axis=0) if speech.any() else np.full(env.shape[1], np.nan)
+    separation = speech_db - pause_db
+    channel = min(channel, env.shape[1]) - 1
+
+    # The annotated speech/pause pattern on the frame grid of the envelope: +1 for speech, -1 for
+    # pauses, 0 for everything else (labels, unannotated stretches).
+    pattern = np.zeros(len(env) + 1)
+    step = acoustics.FRAME_STEP
+    i = np.clip((starts / step).astype(np.int64), 0, len(env))
+    j = np.clip((ends / step).astype(np.int64), 0, len(env))
+    weights = np.where(speech, 1.0, np.where(pause, -1.0, 0.0))
+    np.add.at(pattern, i, weights)
+    np.add.at(pattern, j, -weights)
+    lag, corr = acoustics.best_lag(
+        env[:, channel], np.cumsum(pattern)[:-1], int(max_offset / step))
+
+    issues = []
+    if abs(lag * step) > tolerance:
+        issues.append('offset')
+    best = int(np.nanargmax(separation)) if not np.isnan(separation).all() else channel
+    if best != channel and separation[best] - separation[channel] > 3:
+        issues.append('channel')
+    if not (separation[channel] >= min_separation) or corr < min_correlation:
+        issues.append('mismatch')
+    return dict(
+        File_ID=fid,
+        channel=channel + 1,
+        phones=int(speech.sum()),
+        pauses=int(pause.sum()),
+        speech_dB=round(float(speech_db[channel]), 1),
+        pause_dB=round(float(pause_db[channel]), 1),
+        separation=round(float(separation[channel]), 1),
+        # Share of pauses which are louder than the median speech phone:
+        loud_pauses=round(float((means[pause, channel] > speech_db[channel]).mean()), 3)
+        if pause.any() else None,
+        offset=round(lag * step, 3),
+        correlation=round(corr, 3),
+        issues=' '.join(issues),
+    )
+
+
+def run(args):
+    ds = Dataset()
+    db = Database(ds.dir / 'doreco.sqlite')
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(
+                check_file,
+                db.fname,
+                row['ID'],
+                p,
+                channel=args.channel,
+                max_offset=args.max_offset,
+                tolerance=args.tolerance,
+                min_separation=args.min_separation,
+                min_correlation=args.min_correlation): row['ID']
+            for row, p in ds.iter_media()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                res = future.result()
+            except ValueError as e:
+                args.log.warning('{}: {}'.format(futures[future], e))
+                continue
+            if res and (res['issues'] or not args.only_issues):
+                rows.append(res)
+
+    with Table(args, *COLS) as t:
+        for row in sorted(rows, key=lambda r: r['File_ID']):
+            t.append([row[col] for col in COLS])
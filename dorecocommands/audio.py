@@ -2,30 +2,30 @@
 
 """
 import math
+import json
+import collections
 import pathlib
 import datetime
 import dataclasses
 from html import escape
 
-import pydub
 from clldutils.clilib import PathType
 
 from cldfbench_doreco import Dataset
 from .query import Database
 
 
-# FIXME: get all phones for a filename, including IPA.
+# Words of a file, with the utterances they belong to.
 SQL = """
 select
-    p.u_id, p.ph, p.start, p.end, p.wd_id, ipa.cldf_name as ipa
+    p.u_id, w.cldf_id, min(p.start), max(p.end), coalesce(w.ipa, w.cldf_name) as ipa
 from
     `phones.csv` as p,
     `words.csv` as w
-left outer join 
-    parametertable as ipa on p.cldf_parameterreference = ipa.cldf_id
 where
-    p.wd_id = w.cldf_id and w.filename = ?
-order by p.cldf_id;
+    p.wd_id = w.cldf_id and w.cldf_mediaReference = ? and p.u_id is not null
+group by p.u_id, w.cldf_id
+order by min(p.start);
 """
 
 FADE_TIME = INTERVAL_OFFSET = 50
@@ -66,33 +66,19 @@ def register(parser):
 
 
 def iter_utterances(db, filename):
-    def to_word(phones):
-        return Word(
-            id=phones[0][0], start=phones[0][1], end=phones[-1][2], ipa=''.join(p[-1] for p in phones))
-
-    curr_uid, curr_wid = None, None
-    words, word = [], []
-    for row in db.query(SQL, (filename,)):
-        # p.u_id, p.ph, p.start, p.end, p.wd_id, ipa.cldf_name as ipa
-        uid, ph, s, e, wid, ipa = row
-        if not uid:
-            continue
-        if uid != curr_uid:
-            if words:
-                yield curr_uid, [to_word(w) for w in words]
-            curr_uid = uid
-            curr_wid = wid
-            words, word = [], []
-        if curr_wid != wid:
-            words.append(word)
-            word = []
-            curr_wid = wid
-        word.append((curr_wid, s, e, ipa or ph))
-    if words:
-        yield curr_uid, [to_word(w) for w in words]
+    # Utterances of overlapping speakers interleave when ordered by start, so we collect the words
+    # per utterance - in order of the start of the utterance.
+    utterances = collections.OrderedDict()
+    for uid, wid, s, e, ipa in db.query(SQL, (filename,)):
+        utterances.setdefault(uid, []).append(Word(id=wid, start=s, end=e, ipa=ipa))
+    yield from utterances.items()
 
 
 def run(args):
+    # pydub warns about a missing ffmpeg on import, so we only import it when needed.
+    import pydub
+    from util import wav
+
     ds = Dataset()
     db = Database(ds.dir / 'doreco.sqlite')
 
@@ -103,6 +89,8 @@ def run(args):
         return '{}%'.format(math.floor(f * 1000) / 10)
 
     audio = get_mono_channel(pydub.AudioSegment.from_wav(args.audio))
+    # Waveforms are rendered from precomputed peaks (see `cldfbench doreco.peaks`).
+    peaks = wav.load_peaks(args.audio)
     uts = []
     for i, (uid, words) in enumerate(iter_utterances(db, args.audio.stem)):
         if i > 20:
@@ -113,7 +101,15 @@ def run(args):
 
         # FIXME: create the HTML! start the http server, open in browser!
         duration = e - s
-        uts.append((uid, duration, words))
+        # The clip as exported by `utterance`:
+        clip_start = words[0].start - INTERVAL_OFFSET / 1000
+        clip_end = words[-1].end + INTERVAL_OFFSET / 1000
+        uts.append((
+            uid,
+            duration,
+            words,
+            wav.peak_slice(peaks, clip_start, clip_end),
+            clip_end - clip_start))
         for w in words:
             w.start -= s
             w.end -= s
@@ -159,7 +155,11 @@ def utterance(audio, start, end, out):
     audio_chunk.export(str(out), tags=tags, format='mp3', bitrate="128k")
 
 
-def audioplayer(width, uid, words):
+def audioplayer(width, uid, words, peaks=None, duration=None):
+    """
+    :param peaks: Normalized, interleaved min/max peaks of the clip. If given, WaveSurfer renders \
+    the waveform from these, rather than decoding the audio.
+    """
     player = 'ws_{}'.format(uid)
     return """
 <div style="width: {4}%;">
@@ -182,10 +182,16 @@ document.addEventListener('DOMContentLoaded', function() {{
     backend: 'MediaElement',
     progressColor: 'purple'
 }});
-{1}.load('http://localhost:8000/{3}.mp3');
+{1}.load('http://localhost:8000/{3}.mp3'{5});
 }})
 </script>
-    """.format(uid, player, ''.join(w.html(uid) for w in words), uid[1:], width)
+    """.format(
+        uid,
+        player,
+        ''.join(w.html(uid) for w in words),
+        uid[1:],
+        width,
+        ', [{}], {}'.format(json.dumps(peaks), duration) if peaks else '')
 
 
 def html(utterances):
@@ -201,4 +207,11 @@ def html(utterances):
 {}
 </body>
 </html>
-""".format('\n'.join(audioplayer(math.floor(dur * 100 / maxdur), 'u' + uid, words) for uid, dur, words in utterances))
+""".format('\n'.join(
+        audioplayer(
+            math.floor(dur * 100 / maxdur),
+            'u' + uid,
+            words,
+            peaks=peaks,
+            duration=clip_duration)
+        for uid, dur, words, peaks, clip_duration in utterances))
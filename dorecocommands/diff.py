@@ -0,0 +1,55 @@
+"""
+Compare two builds of the CLDF dataset, e.g. before a release.
+
+Reports the numbers of added, removed and changed rows per table and corpus, the numbers of changed
+rows per column, and samples of the changes. Unchanged tables, corpora and files are recognized by
+comparing digests, so only the rows of changed files are compared in detail.
+"""
+from clldutils.clilib import Table, add_format, PathType
+
+from cldfbench_doreco import Dataset
+
+
+def register(parser):
+    parser.add_argument(
+        'old',
+        type=PathType(type='dir'),
+        help='Directory containing the CLDF data of the old build.')
+    parser.add_argument(
+        '--new',
+        type=PathType(type='dir'),
+        default=None,
+        help='Directory containing the CLDF data of the new build (defaults to the cldf directory '
+             'of the dataset).')
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=None,
+        help='Number of samples to show per kind of change and column (defaults to '
+             '`util.diff.SAMPLE_SIZE`).')
+    add_format(parser, 'simple')
+
+
+def run(args):
+    from util.diff import Diff, SAMPLE_SIZE
+
+    diffs = Diff(
+        args.old,
+        args.new or Dataset().cldf_dir,
+        samples=SAMPLE_SIZE if args.samples is None else args.samples).diff()
+    if not diffs:
+        args.log.info('no differences')
+        return
+
+    with Table(args, 'table', 'corpus', 'added', 'removed', 'changed') as t:
+        for d in diffs:
+            for corpus, counts in sorted(d.counts.items()):
+                t.append([d.table, corpus, counts['added'], counts['removed'], counts['changed']])
+    print('')
+    with Table(args, 'table', 'column', 'changed') as t:
+        for d in diffs:
+            t.extend([d.table, col, n] for col, n in d.columns.most_common())
+    print('')
+    with Table(args, 'table', 'status', 'ID', 'column', 'old', 'new') as t:
+        for d in diffs:
+            t.extend([d.table] + ['' if v is None else v for v in s] for s in d.samples)
@@ -0,0 +1,203 @@
+"""
+Keyword-in-context listing of word forms.
+
+Lists all tokens of a word form (`words.csv`.wd) with N words of left and right context from the
+same file, together with File_ID, start and end of the token, e.g. for audio playback.
+
+The concordance is built from the words in the SQLite database on first use - stored in file and
+time order in compact arrays together with an inverted index from word forms to positions - and
+cached in a file `doreco.kwic.npz`, which is rebuilt whenever the database changes.
+"""
+import re
+import pathlib
+
+from clldutils.clilib import Table, add_format
+
+from cldfbench_doreco import Dataset, SILENT_PAUSE
+from .query import Database
+
+SQL_WORDS = """
+SELECT
+    cldf_id, cldf_languageReference, coalesce(cldf_mediaReference, ''), cldf_name, start, end
+FROM
+    `words.csv`
+ORDER BY
+    cldf_languageReference,
+    cldf_mediaReference,
+    -- Words without audio file are kept in the order of their IDs, i.e. of the raw data.
+    CASE WHEN cldf_mediaReference IS NULL THEN cldf_id END,
+    start,
+    cldf_id
+"""
+
+
+class Concordance:
+    """
+    Words in file and time order, with an inverted index from word forms to positions.
+
+    :ivar form: Word form code per position.
+    :ivar media: File code per position - words without audio file get a code of their own per \
+    language.
+    :ivar start: Start time per position.
+    :ivar end: End time per position.
+    :ivar postings: Positions sorted by form code (and position).
+    :ivar offsets: Positions of word form `i` are `postings[offsets[i]:offsets[i + 1]]`.
+    """
+    def __init__(self, arrays):
+        from util.arrays import unpack
+
+        self.arrays = arrays
+        for k, v in arrays.items():
+            setattr(self, k, v)
+        self.vocabulary = unpack(self.vocab_data, self.vocab_offsets)
+        self.codes = {s: i for i, s in enumerate(self.vocabulary)}
+        self.languages = unpack(self.language_data, self.language_offsets)
+        self.files = unpack(self.media_data, self.media_offsets)
+
+    @classmethod
+    def from_db(cls, db: Database):
+        import numpy as np
+        from util.arrays import pack
+
+        ids, langs, files, forms, starts, ends = [], [], [], [], [], []
+        with db.connection() as conn:
+            for wid, lang, fid, form, start, end in conn.execute(SQL_WORDS):
+                ids.append(wid)
+                langs.append(lang)
+                files.append(fid or '')
+                forms.append(form or '')
+                starts.append(start)
+                ends.append(end)
+        arrays = {}
+        for name, values in [('vocab', forms), ('language', langs), ('media', files)]:
+            uniq, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+            arrays[name] = codes.astype(np.int32)
+            arrays['{}_data'.format(name)], arrays['{}_offsets'.format(name)] = pack(uniq)
+        arrays['form'] = arrays.pop('vocab')
+        arrays['start'] = np.array(starts, dtype=np.float64)
+        arrays['end'] = np.array(ends, dtype=np.float64)
+        arrays['id_data'], arrays['id_offsets'] = pack(ids)
+        arrays['postings'] = np.argsort(arrays['form'], kind='stable').astype(np.int64)
+        arrays['offsets'] = np.zeros(len(arrays['vocab_offsets']), dtype=np.int64)
+        np.cumsum(
+            np.bincount(arrays['form'], minlength=len(arrays['offsets']) - 1),
+            out=arrays['offsets'][1:])
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, db: Database, path=None):
+        """
+        Load the concordance from the cache file, rebuilding it if the database has changed.
+        """
+        import numpy as np
+
+        dbpath = pathlib.Path(db.fname)
+        path = pathlib.Path(path or dbpath.parent / 'doreco.kwic.npz')
+        fingerprint = np.array([dbpath.stat().st_size, dbpath.stat().st_mtime_ns])
+        if path.exists():
+            with np.load(path) as data:
+                if np.array_equal(data['fingerprint'], fingerprint):
+                    return cls({k: data[k] for k in data.files if k != 'fingerprint'})
+        res = cls.from_db(db)
+        with path.open('wb') as f:
+            np.savez(f, fingerprint=fingerprint, **res.arrays)
+        return res
+
+    def positions(self, forms, language=None) -> 'numpy.ndarray':
+        """
+        Sorted positions of tokens of any of `forms`, optionally restricted to one language.
+        """
+        import numpy as np
+
+        res = [
+            self.postings[self.offsets[c]:self.offsets[c + 1]]
+            for c in (self.codes.get(f) for f in forms) if c is not None]
+        res = np.sort(np.concatenate(res)) if res else np.zeros(0, dtype=np.int64)
+        if language is not None:
+            if language not in self.languages:
+                return res[:0]
+            res = res[self.language[res] == self.languages.index(language)]
+        return res
+
+    def match(self, pattern, ignore_case=False):
+        """
+        Word forms in the vocabulary fully matching the regular expression `pattern`.
+        """
+        pattern = re.compile(pattern, flags=re.IGNORECASE if ignore_case else 0)
+        return [f for f in self.vocabulary if pattern.fullmatch(f)]
+
+    def kwic(self, positions, context=5, skip=(SILENT_PAUSE,)):
+        """
+        :param skip: Word forms which are not counted as context words.
+        :return: Generator of tuples (ID, Language, File_ID, start, end, left, keyword, right).
+        """
+        import numpy as np
+        from util.arrays import unpack
+
+        skip = [self.codes[s] for s in skip if s in self.codes]
+        # Positions of words counted as context:
+        kept = np.flatnonzero(~np.isin(self.form, skip)) if skip else np.arange(len(self.form))
+        for pos in positions:
+            i, j = np.searchsorted(kept, pos), np.searchsorted(kept, pos, side='right')
+            left, right = kept[max(i - context, 0):i], kept[j:j + context]
+            # Context is restricted to words from the same file:
+            left, right = [
+                a[(self.media[a] == self.media[pos]) & (self.language[a] == self.language[pos])]
+                for a in (left, right)]
+            yield (
+                unpack(self.id_data, self.id_offsets, [pos])[0],
+                self.languages[self.language[pos]],
+                self.files[self.media[pos]] or None,
+                float(self.start[pos]),
+                float(self.end[pos]),
+                ' '.join(self.vocabulary[c] for c in self.form[left]),
+                self.vocabulary[self.form[pos]],
+                ' '.join(self.vocabulary[c] for c in self.form[right]),
+            )
+
+
+def register(parser):
+    parser.add_argument('form', help='Word form (or regular expression, see --regex).')
+    parser.add_argument(
+        '--language',
+        default=None,
+        help='Only list tokens of the language with the specified Glottocode.')
+    parser.add_argument(
+        '--context',
+        type=int,
+        default=5,
+        help='Number of words of left and right context.')
+    parser.add_argument(
+        '--regex',
+        action='store_true',
+        default=False,
+        help='Interpret form as regular expression, matching full word forms.')
+    parser.add_argument(
+        '--ignore-case',
+        action='store_true',
+        default=False,
+        help='Match word forms case-insensitively.')
+    parser.add_argument(
+        '--with-pauses',
+        action='store_true',
+        default=False,
+        help='Count silent pauses as context words.')
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=None,
+        help='Maximal number of tokens to list.')
+    add_format(parser, 'simple')
+
+
+def run(args):
+    ds = Dataset()
+    conc = Concordance.load(Database(ds.dir / 'doreco.sqlite'))
+    if args.regex or args.ignore_case:
+        forms = conc.match(args.form if args.regex else re.escape(args.form), args.ignore_case)
+    else:
+        forms = [args.form]
+    positions = conc.positions(forms, language=args.language)[:args.limit]
+    with Table(
+            args, 'ID', 'Language', 'File_ID', 'start', 'end', 'left', 'word', 'right') as t:
+        t.extend(conc.kwic(positions, args.context, skip=() if args.with_pauses else (SILENT_PAUSE,)))
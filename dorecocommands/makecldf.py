@@ -0,0 +1,33 @@
+"""
+Run `cldfbench makecldf` for the dataset, resuming a failed run from its checkpoints.
+
+The results of the CLDF conversion are checkpointed per corpus and stage (phones, words and
+examples) in a work directory. After a run failed - e.g. because of conflicting time alignments of
+words and phones in a corpus - and the problem has been fixed, running
+
+    cldfbench doreco.makecldf cldfbench_doreco.py --resume
+
+only re-processes the stages of corpora without valid checkpoint, i.e. checkpoints created from the
+same raw data. The output is identical to the output of an uninterrupted run.
+"""
+from clldutils.clilib import PathType
+from cldfbench.commands import makecldf
+
+
+def register(parser):
+    makecldf.register(parser)
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        default=False,
+        help='Re-use valid checkpoints of a previous run.')
+    parser.add_argument(
+        '--checkpoints',
+        type=PathType(type='dir', must_exist=False),
+        default=None,
+        help='Directory to store checkpoints in (defaults to the checkpoints directory of the '
+             'dataset).')
+
+
+def run(args):
+    makecldf.run(args)
@@ -0,0 +1,157 @@
+"""
+Count phone n-grams per language.
+
+N-grams are counted over sequences of phones (i.e. rows in `phones.csv` with Token_Type "xsampa")
+within utterances; pauses and labels interrupt sequences. Counts are reported per context:
+- "word": n-grams within a word,
+- "boundary": n-grams spanning at least one word boundary,
+- "initial": utterance-initial n-grams,
+- "final": utterance-final n-grams.
+Thus, "word" and "boundary" counts add up to the total count per n-gram, while utterance-initial
+and -final n-grams are also counted under "word" or "boundary".
+
+Phones are read once, in order, with integer-coded symbols, and n-grams for all n are counted from
+these arrays. The results are written to a table `phone_ngrams` in the SQLite database and to a
+CSV file.
+"""
+import pathlib
+
+from csvw.dsv import UnicodeWriter
+from clldutils.clilib import PathType
+
+from cldfbench_doreco import Dataset
+from .query import Database
+
+SQL_PHONES = """
+SELECT
+    {}, p.token_type = 'xsampa', p.wd_id, p.u_id, w.cldf_languageReference
+FROM
+    `phones.csv` AS p
+JOIN
+    `words.csv` AS w ON p.wd_id = w.cldf_id
+LEFT OUTER JOIN
+    parametertable AS ipa ON p.cldf_parameterReference = ipa.cldf_id
+ORDER BY
+    p.rowid
+"""
+TABLE = 'phone_ngrams'
+CONTEXTS = ['word', 'boundary', 'initial', 'final']
+
+
+def register(parser):
+    parser.add_argument(
+        '-n',
+        type=int,
+        nargs='+',
+        default=[2, 3],
+        help='Lengths of n-grams to count.')
+    parser.add_argument(
+        '--ipa',
+        action='store_true',
+        default=False,
+        help='Count n-grams of IPA symbols (falling back to X-SAMPA for phones without IPA).')
+    parser.add_argument(
+        '--output',
+        type=PathType(type='file', must_exist=False),
+        default=pathlib.Path('{}.csv'.format(TABLE)),
+        help='Path of the CSV file to write.')
+
+
+def read_phones(db, ipa=False):
+    """
+    Read phones in order as arrays.
+
+    :return: `tuple` (symbols, languages, codes, langs, ok, wb, ub), where `codes` and `langs` are \
+    integer codes into `symbols` and `languages`, `ok` flags phones proper, and `wb` and `ub` flag \
+    rows which start a new word or utterance.
+    """
+    import numpy as np
+
+    symbols, languages = {}, {}
+    codes, langs, ok, wb, ub = [], [], [], [], []
+    prev_wid, prev_uid = None, None
+    with db.connection() as conn:
+        for sym, is_phone, wid, uid, lang in conn.execute(
+                SQL_PHONES.format('coalesce(ipa.cldf_name, p.cldf_name)' if ipa else 'p.cldf_name')):
+            codes.append(symbols.setdefault(sym, len(symbols)))
+            langs.append(languages.setdefault(lang, len(languages)))
+            ok.append(bool(is_phone) and uid is not None)
+            wb.append(wid != prev_wid)
+            ub.append(uid != prev_uid or uid is None)
+            prev_wid, prev_uid = wid, uid
+    return (
+        list(symbols),
+        list(languages),
+        np.array(codes, dtype=np.int32),
+        np.array(langs, dtype=np.int32),
+        np.array(ok, dtype=bool),
+        np.array(wb, dtype=bool),
+        np.array(ub, dtype=bool),
+    )
+
+
+def count_ngrams(n, codes, langs, ok, wb, ub):
+    """
+    Count n-grams of length `n`.
+
+    :return: Generator of tuples (context, language code, n-gram codes, counts).
+    """
+    import numpy as np
+
+    m = len(codes) - n + 1
+    if m <= 0:
+        return
+    valid = ok[:m].copy()
+    crosses = np.zeros(m, dtype=bool)
+    for k in range(1, n):
+        valid &= ok[k:k + m] & ~ub[k:k + m]
+        crosses |= wb[k:k + m]
+    # Whether the phone after the n-gram starts a new utterance (or is missing):
+    after = np.ones(m, dtype=bool)
+    after[:-1] = ub[n:]
+    for context, mask in [
+        ('word', valid & ~crosses),
+        ('boundary', valid & crosses),
+        ('initial', valid & ub[:m]),
+        ('final', valid & after),
+    ]:
+        idx = np.flatnonzero(mask)
+        if not len(idx):
+            continue
+        keys = np.stack([langs[idx]] + [codes[idx + k] for k in range(n)], axis=1)
+        uniq, counts = np.unique(keys, axis=0, return_counts=True)
+        yield context, uniq[:, 0], uniq[:, 1:], counts
+
+
+def run(args):
+    ds = Dataset()
+    db = Database(ds.dir / 'doreco.sqlite')
+    symbols, languages, codes, langs, ok, wb, ub = read_phones(db, ipa=args.ipa)
+    args.log.info('read {} phones'.format(len(codes)))
+
+    rows = []
+    for n in sorted(set(args.n)):
+        for context, lcodes, ngrams, counts in count_ngrams(n, codes, langs, ok, wb, ub):
+            rows.extend(
+                (languages[lg], n, context, ' '.join(symbols[c] for c in ngram), int(count))
+                for lg, ngram, count in zip(lcodes, ngrams, counts))
+    rows.sort(key=lambda r: (r[0], r[1], CONTEXTS.index(r[2]), -r[4], r[3]))
+
+    with db.connection() as conn:
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS {}'.format(TABLE))
+            conn.execute("""
+CREATE TABLE {0} (
+    language TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    context TEXT NOT NULL,
+    sequence TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (language, n, context, sequence)
+)""".format(TABLE))
+            conn.executemany('INSERT INTO {} VALUES (?, ?, ?, ?, ?)'.format(TABLE), rows)
+
+    with UnicodeWriter(args.output) as w:
+        w.writerow(['language', 'n', 'context', 'sequence', 'count'])
+        w.writerows(rows)
+    args.log.info('{} n-gram counts written to {} and {}'.format(len(rows), TABLE, args.output))
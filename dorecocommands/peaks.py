@@ -0,0 +1,57 @@
+"""
+Precompute multi-resolution waveform peaks for the downloaded audio files.
+
+For each file in MediaTable for which the WAV has been downloaded (see `cldfbench download`), a
+sidecar file `<File_ID>.peaks.json` is written next to the WAV, which is then used to render
+waveforms in the viewer created by `cldfbench doreco.audio` without decoding the audio. Sidecar
+files are recomputed if they are older than the WAV or have been computed for another channel.
+"""
+import concurrent.futures
+
+from cldfbench_doreco import Dataset
+
+
+def register(parser):
+    parser.add_argument(
+        '--channel',
+        type=int,
+        default=1,
+        help='Channel of the recordings to compute peaks for.')
+    parser.add_argument(
+        '--levels',
+        type=int,
+        nargs='+',
+        default=None,
+        help='Samples per pixel for the zoom levels; each must be a multiple of the previous one '
+             '(defaults to `util.wav.PEAK_LEVELS`).')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (defaults to the number of CPUs).')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        default=False,
+        help='Recompute peaks even if an up-to-date sidecar file exists.')
+
+
+def run(args):
+    from util import wav
+
+    ds = Dataset()
+    levels = tuple(args.levels or wav.PEAK_LEVELS)
+    todo = []
+    for _, p in ds.iter_media():
+        if args.force or wav.read_peaks(p, channel=args.channel) is None:
+            todo.append(p)
+    args.log.info('computing peaks for {} files'.format(len(todo)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(wav.write_peaks, p, args.channel, levels): p for p in todo}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                args.log.info('wrote {}'.format(future.result()))
+            except ValueError as e:
+                args.log.warning('{}: {}'.format(futures[future].name, e))
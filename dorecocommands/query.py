@@ -5,16 +5,75 @@ Running queries via this `cldfbench` subcommand makes sure
 - SQLite's built-in math functions are available (because Python's sqlite3 module is used to
   interface with the database) and
 - a `stdev` function is available.
+
+Besides a single query, the command accepts a file with multiple SQL statements, a directory of
+`.sql` files or a glob pattern. Such batches of queries are run concurrently on a small pool of
+read-only connections - with memory-mapped I/O, so all connections share the operating system's
+page cache - writing each result to its own file.
+
+For large numeric results, `--columnar npz` (or `arrow`) writes one array per result column - filled
+batch by batch from the cursor, with dtypes derived from the declared column types - instead of
+formatting rows as text.
+
+To find out why a query is slow, run it with
+- `--explain` to see SQLite's query plan, with full scans of the big tables and temporary B-trees
+  (for sorting and grouping) flagged, and indexes suggested which may help,
+- `--profile` to see wall time, number of rows and SQLite VM steps.
+Passing `--slow-log` records all queries slower than `--slow-threshold` in a (JSON lines) log file.
+
+With `--shards`, queries are run on the per-corpus databases built with `cldfbench doreco.shards`.
 """
+import re
+import json
 import math
+import time
+import hashlib
+import datetime
 import typing
+import logging
 import pathlib
 import sqlite3
+import argparse
+import threading
 import contextlib
 import collections
+import urllib.parse
+import importlib.util
+import concurrent.futures
 
-from clldutils.clilib import Table, add_format, PathType
-from cldfbench_doreco import Dataset
+from clldutils.clilib import Table, add_format, PathType, ParserError
+from clldutils.markup import TableFormat
+
+# Size of the memory map used by read-only connections - larger than the database.
+MMAP_SIZE = 2 ** 40
+# The progress handler used for profiling is called every PROGRESS_STEPS SQLite VM instructions.
+PROGRESS_STEPS = 1000
+LARGE_TABLES = ['phones.csv', 'words.csv', 'utterances.csv', 'ExampleTable']
+# Columns used in joins for which an index may help: (table, column)
+INDEXABLE = [
+    ('phones.csv', 'wd_id'),
+    ('phones.csv', 'u_id'),
+    ('words.csv', 'cldf_languageReference'),
+    ('utterances.csv', 'cldf_languageReference'),
+    ('ExampleTable', 'cldf_languageReference'),
+]
+# Table listing the shards in a catalog database, see `dorecocommands.shards`.
+SHARDS_TABLE = 'doreco_shards'
+CATALOG = 'catalog.sqlite'
+# Database materializing the union of more shards than SQLite can attach, see `_materialize_union`.
+UNION = 'union-{}.sqlite'
+UNION_STATE = 'doreco_union_state'
+# numpy dtypes for the declared types of columns in the database:
+DTYPES = {'REAL': 'float64', 'INTEGER': 'int64', 'TEXT': 'object'}
+# Number of rows fetched at once for columnar results:
+BATCH_SIZE = 50000
+EXTENSIONS = {
+    TableFormat.pipe: 'md',
+    TableFormat.simple: 'txt',
+    TableFormat.ascii: 'txt',
+    TableFormat.tsv: 'tsv',
+    TableFormat.csv: 'csv',
+}
 
 
 class StdevFunc:
@@ -43,6 +102,15 @@ class StdevFunc:
         return math.sqrt(self.S / (self.k-2))
 
 
+def attach_limit(conn) -> int:
+    """
+    The maximal number of databases which can be attached to `conn` - typically 10.
+    """
+    if hasattr(conn, 'getlimit'):
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    return 10  # pragma: no cover - Python < 3.11
+
+
 class Database:
     """
     Provides SQLite database access through Python's sqlite3, meaning SQLite's built-in math
@@ -56,14 +124,153 @@ class Database:
         ...         print(row)
         ...
         (2389790,)
+
+    If `fname` is the catalog of per-corpus databases - see `dorecocommands.shards` - the shards are
+    attached to each connection, and temporary `UNION ALL` views are created with the names of the
+    corpus-specific tables (and for the views defined in the shards).
+    If there are more shards than SQLite can attach at once, the union of the corpus-specific tables
+    is materialized in a database next to the catalog, which is attached instead.
     """
-    def __init__(self, fname):
+    def __init__(self, fname, slow_log=None, slow_threshold=1.0, glottocodes=None):
+        """
+        :param slow_log: Path of a file to which queries running longer than `slow_threshold` \
+        seconds are logged.
+        :param glottocodes: Restrict the union of shards to the ones for these Glottocodes.
+        """
         self.fname = fname
+        self.glottocodes = glottocodes
+        self.slow_log = slow_log
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_shards(cls, shards_dir, glottocodes=None, **kw) -> 'Database':
+        """
+        Target a single shard, if only one Glottocode is passed, or the union of the shards.
+
+        >>> Database.from_shards('shards', ['movi1243']).query('SELECT count(*) FROM `phones.csv`')
+        [(34527,)]
+        """
+        shards_dir = pathlib.Path(shards_dir)
+        if glottocodes and len(glottocodes) == 1:
+            return cls(shards_dir / '{}.sqlite'.format(glottocodes[0]), **kw)
+        return cls(shards_dir / CATALOG, glottocodes=glottocodes, **kw)
 
-    def connection(self):
-        conn = sqlite3.connect(str(self.fname))
+    def connection(self, readonly=False):
+        return contextlib.closing(self._connect(readonly=readonly))
+
+    def _connect(self, readonly=False):
+        if readonly:
+            conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(urllib.parse.quote(pathlib.Path(self.fname).as_posix())),
+                uri=True,
+                check_same_thread=False)
+            conn.execute('PRAGMA mmap_size = {}'.format(MMAP_SIZE))
+        else:
+            conn = sqlite3.connect(str(self.fname))
         conn.create_aggregate("stdev", 1, StdevFunc)
-        return contextlib.closing(conn)
+        self._attach_shards(conn, readonly)
+        return conn
+
+    def _attach_shards(self, conn, readonly):
+        if not conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (SHARDS_TABLE,)).fetchone():
+            return
+        shards = conn.execute(
+            'SELECT glottocode, path FROM {} ORDER BY glottocode'.format(SHARDS_TABLE)).fetchall()
+        if self.glottocodes:
+            unknown = set(self.glottocodes) - {gc for gc, _ in shards}
+            if unknown:
+                raise ValueError('No shards for {}'.format(', '.join(sorted(unknown))))
+            shards = [(gc, path) for gc, path in shards if gc in self.glottocodes]
+        if not shards:
+            raise ValueError('No shards listed in {}'.format(self.fname))
+        limit = attach_limit(conn)
+        if len(shards) > limit:
+            shards = [('doreco_union', self._materialize_union(shards, limit))]
+
+        for gc, path in shards:
+            path = pathlib.Path(self.fname).parent / path
+            if readonly:
+                path = 'file:{}?mode=ro'.format(urllib.parse.quote(path.as_posix()))
+            conn.execute('ATTACH DATABASE ? AS "{}"'.format(gc), (str(path),))
+            if readonly:
+                conn.execute('PRAGMA "{}".mmap_size = {}'.format(gc, MMAP_SIZE))
+
+        main = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name, type_, sql in conn.execute(
+                'SELECT name, type, sql FROM "{}".sqlite_master '
+                "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'".format(
+                    shards[0][0])).fetchall():
+            if type_ == 'table' and name not in main:
+                conn.execute('CREATE TEMP VIEW `{}` AS {}'.format(name, ' UNION ALL '.join(
+                    'SELECT * FROM "{}".`{}`'.format(gc, name) for gc, _ in shards)))
+            elif type_ == 'view':
+                # Views in the shards refer to the tables of the shard, so we re-create them:
+                conn.execute(re.sub(r'^\s*CREATE\s+VIEW', 'CREATE TEMP VIEW', sql, flags=re.I))
+
+    def _materialize_union(self, shards, limit) -> pathlib.Path:
+        """
+        SQLite limits the number of attached databases (typically to 10), so the union of more
+        shards cannot be provided by views. Instead, the rows of the corpus-specific tables of all
+        shards are copied - group by group - into one database, with the indexes and views of the
+        shards. This database is re-created whenever one of the shards has changed.
+
+        :return: Path of the database, relative to the catalog.
+        """
+        dirpath = pathlib.Path(self.fname).parent
+        union = UNION.format(hashlib.md5(' '.join(gc for gc, _ in shards).encode()).hexdigest()[:8])
+        fingerprint = json.dumps([
+            (gc, (dirpath / path).stat().st_mtime_ns, (dirpath / path).stat().st_size)
+            for gc, path in shards])
+        with self._lock:
+            if (dirpath / union).exists():
+                with contextlib.closing(sqlite3.connect(str(dirpath / union))) as conn:
+                    try:
+                        if conn.execute('SELECT fingerprint FROM {}'.format(UNION_STATE))\
+                                .fetchone()[0] == fingerprint:
+                            return pathlib.Path(union)
+                    except sqlite3.DatabaseError:  # pragma: no cover
+                        pass  # Not a complete union database.
+            tmp = dirpath / '{}.tmp'.format(union)
+            if tmp.exists():
+                tmp.unlink()
+            with contextlib.closing(sqlite3.connect(str(tmp))) as conn:
+                conn.execute('ATTACH DATABASE ? AS catalog', (str(self.fname),))
+                shared = {r[0] for r in conn.execute(
+                    "SELECT name FROM catalog.sqlite_master WHERE type = 'table'")}
+                conn.execute('DETACH DATABASE catalog')
+                conn.execute('ATTACH DATABASE ? AS shard', (str(dirpath / shards[0][1]),))
+                schema = conn.execute(
+                    "SELECT type, name, tbl_name, sql FROM shard.sqlite_master "
+                    "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'").fetchall()
+                conn.execute('DETACH DATABASE shard')
+                tables = [
+                    name for type_, name, _, _ in schema if type_ == 'table' and name not in shared]
+                for type_, name, _, sql in schema:
+                    if type_ == 'table' and name in tables:
+                        conn.execute(sql)
+                for i in range(0, len(shards), limit):
+                    group = shards[i:i + limit]
+                    for gc, path in group:
+                        conn.execute(
+                            'ATTACH DATABASE ? AS "{}"'.format(gc), (str(dirpath / path),))
+                    with conn:
+                        for name in tables:
+                            for gc, _ in group:
+                                conn.execute('INSERT INTO main.`{0}` SELECT * FROM "{1}".`{0}`'.format(
+                                    name, gc))
+                    for gc, _ in group:
+                        conn.execute('DETACH DATABASE "{}"'.format(gc))
+                with conn:
+                    for type_, name, tbl_name, sql in schema:
+                        if (type_ == 'index' and tbl_name in tables) or type_ == 'view':
+                            conn.execute(sql)
+                    conn.execute('CREATE TABLE {} (fingerprint TEXT NOT NULL)'.format(UNION_STATE))
+                    conn.execute('INSERT INTO {} VALUES (?)'.format(UNION_STATE), (fingerprint,))
+            tmp.replace(dirpath / union)
+        return pathlib.Path(union)
 
     def query(self,
               sql: str,
@@ -77,18 +284,414 @@ class Database:
         [OrderedDict([('n', 107648)])]
         """
         with self.connection() as conn:
-            cu = conn.execute(sql, params or ())
+            res = self.execute(conn, sql, params)
             if dicts:
-                cols = [tuple[0] for tuple in cu.description]
-                return [collections.OrderedDict(zip(cols, row)) for row in cu.fetchall()]
-            return list(cu.fetchall())
+                return [collections.OrderedDict(zip(res.columns, row)) for row in res.rows]
+            return res.rows
+
+    def execute(self, conn, sql, params=None, name=None, profile=False) -> 'QueryResult':
+        """
+        Run `sql` on connection `conn`, fetching all rows.
+
+        :param profile: Flag signaling whether to count SQLite VM steps - which is also done when \
+        slow queries are logged.
+        """
+        steps = [0]
+        if profile or self.slow_log:
+            def progress():
+                steps[0] += PROGRESS_STEPS
+                return 0
+            conn.set_progress_handler(progress, PROGRESS_STEPS)
+        start = time.perf_counter()
+        try:
+            cu = conn.execute(sql, params or ())
+            rows = cu.fetchall()
+        finally:
+            conn.set_progress_handler(None, 0)
+        res = QueryResult(
+            name,
+            [d[0] for d in cu.description or []],
+            rows,
+            Profile(
+                time.perf_counter() - start,
+                len(rows),
+                steps[0] if (profile or self.slow_log) else None))
+        if self.slow_log and res.profile.seconds >= self.slow_threshold:
+            with self._lock:
+                with pathlib.Path(self.slow_log).open('a', encoding='utf8') as log:
+                    log.write(json.dumps(collections.OrderedDict([
+                        ('time', datetime.datetime.now().isoformat()),
+                        ('name', name),
+                        ('seconds', round(res.profile.seconds, 3)),
+                        ('rows', res.profile.rows),
+                        ('vm_steps', res.profile.vm_steps),
+                        ('sql', sql),
+                    ])) + '\n')
+        return res
+
+    def column_dtypes(self, conn) -> typing.Dict[str, str]:
+        """
+        Map column names (lowercased) to numpy dtypes, according to the declared types of the
+        columns of tables and (temporary) views - which `pycldf` derives from the datatypes in the
+        CLDF schema. Names declared with conflicting types are left out.
+        """
+        res = {}
+        for (table,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "UNION SELECT name FROM sqlite_temp_master WHERE type = 'view'").fetchall():
+            for _, name, type_, *_ in conn.execute('PRAGMA table_info(`{}`)'.format(table)):
+                dtype = DTYPES.get((type_ or '').upper())
+                res[name.lower()] = dtype if res.get(name.lower(), dtype) == dtype else None
+        return {name: dtype for name, dtype in res.items() if dtype}
+
+    def _batches(self, conn, sql, params=None, dtypes=None, batch_size=BATCH_SIZE):
+        """
+        Fetch the result of `sql` in batches.
+
+        :return: Generator of triples (columns, dtypes, values per column) - with at least one, \
+        possibly empty, batch.
+        """
+        cu = conn.execute(sql, params or ())
+        columns, types = [], []
+        for i, d in enumerate(cu.description or []):
+            columns.append(d[0] if d[0] not in columns else '{}_{}'.format(d[0], i))
+        known, dtypes, n = self.column_dtypes(conn), dtypes or {}, 0
+        while True:
+            rows = cu.fetchmany(batch_size)
+            if not rows and n:
+                break
+            values = list(zip(*rows)) if rows else [()] * len(columns)
+            if not types:
+                types = [
+                    dtypes.get(col) or known.get(col.lower()) or infer_dtype(vals)
+                    for col, vals in zip(columns, values)]
+            n += len(rows)
+            yield columns, types, values
+            if not rows:
+                break
+
+    def execute_columnar(self,
+                         conn,
+                         sql,
+                         params=None,
+                         name=None,
+                         dtypes=None,
+                         batch_size=BATCH_SIZE) -> 'ColumnarResult':
+        """
+        Run `sql` on connection `conn`, filling one preallocated numpy array per result column
+        batch by batch - i.e. without materializing the list of all rows.
+
+        The dtypes of columns are looked up by name in `Database.column_dtypes` or inferred from the
+        first batch of values. Integer columns containing NULL are converted to float, with NULL as
+        NaN. Text is returned in arrays of dtype `object`.
+
+        :param dtypes: `dict` mapping column names to numpy dtypes, overriding the inferred ones.
+        """
+        import numpy as np
+
+        start, arrays, n = time.perf_counter(), None, 0
+        for columns, types, values in self._batches(conn, sql, params, dtypes, batch_size):
+            if arrays is None:
+                arrays = [np.empty(max(batch_size, len(values[0]) if values else 0), dtype=t)
+                          for t in types]
+            k = len(values[0]) if values else 0
+            for i, vals in enumerate(values):
+                if len(arrays[i]) < n + k:
+                    arrays[i].resize(2 * len(arrays[i]), refcheck=False)
+                if arrays[i].dtype.kind in 'iu' and not all(type(v) is int for v in vals):
+                    arrays[i] = arrays[i].astype(np.float64)
+                arrays[i][n:n + k] = vals
+            n += k
+        for a in arrays:
+            a.resize(n, refcheck=False)
+        return ColumnarResult(
+            name,
+            collections.OrderedDict(zip(columns, arrays)),
+            Profile(time.perf_counter() - start, n, None))
+
+    def fetch_arrays(self, sql, params=None, dtypes=None, batch_size=BATCH_SIZE):
+        """
+        Run `sql` on the database, returning the result as `OrderedDict` of numpy arrays.
+
+        >>> res = Database('doreco.sqlite').fetch_arrays('SELECT cldf_id, duration FROM `phones.csv`')
+        >>> res['duration'].dtype, len(res['duration'])
+        (dtype('float64'), 2389790)
+        """
+        with self.connection(readonly=True) as conn:
+            return self.execute_columnar(conn, sql, params, dtypes=dtypes, batch_size=batch_size)\
+                .arrays
+
+    def iter_record_batches(self, conn, sql, params=None, dtypes=None, batch_size=BATCH_SIZE):
+        """
+        Run `sql` on connection `conn`, yielding the result as Arrow record batches - with NULLs as
+        Arrow nulls. Requires `pyarrow`.
+
+        Like in `execute_columnar`, integer columns are promoted to float if a batch contains
+        non-integer numbers - so the schema of later batches may differ, see `write_arrow`.
+        """
+        pa = import_pyarrow()
+        types = {'float64': pa.float64(), 'int64': pa.int64(), 'object': pa.string()}
+        atypes = None
+        for columns, dts, values in self._batches(conn, sql, params, dtypes, batch_size):
+            if atypes is None:
+                atypes = [types.get(str(dt)) for dt in dts]
+            for i, vals in enumerate(values):
+                if atypes[i] == pa.int64() and \
+                        not all(type(v) is int for v in vals if v is not None):
+                    atypes[i] = pa.float64()
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(vals, type=t) for vals, t in zip(values, atypes)], names=columns)
+
+    def explain(self, sql, params=None) -> 'QueryPlan':
+        """
+        Get the query plan for `sql`, with full scans of large tables and temporary B-trees flagged.
+        """
+        # Map aliases of tables - shown in query plans - to table names:
+        aliases = {}
+        for table in LARGE_TABLES:
+            for m in re.finditer(
+                    r'[`"\[]?{}[`"\]]?(\s+(AS\s+)?(?P<alias>\w+))?'.format(re.escape(table)),
+                    sql,
+                    flags=re.IGNORECASE):
+                alias = m.group('alias')
+                if alias and alias.upper() not in {
+                        'WHERE', 'JOIN', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'LEFT', 'INNER', 'CROSS',
+                        'NATURAL', 'USING', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW', 'HAVING'}:
+                    aliases[alias] = table
+                aliases[table] = table
+
+        with self.connection() as conn:
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params or ()).fetchall()
+            indexed = set()
+            for table, col in INDEXABLE:
+                for index in conn.execute('PRAGMA index_list(`{}`)'.format(table)).fetchall():
+                    info = conn.execute('PRAGMA index_info(`{}`)'.format(index[1])).fetchall()
+                    if info and info[0][2].lower() == col.lower():
+                        indexed.add((table, col))
+
+        depth, steps, scanned = {0: -1}, [], set()
+        for id_, parent, _, detail in plan:
+            depth[id_] = depth.get(parent, -1) + 1
+            flag = None
+            m = re.fullmatch(r'SCAN (?P<table>\S+)(?P<index> USING .+)?', detail)
+            # Tables in attached shards are prefixed with the schema name:
+            table = m and (aliases.get(m.group('table')) or aliases.get(
+                m.group('table').partition('.')[2]))
+            if m and not m.group('index') and table in LARGE_TABLES:
+                flag = 'full scan of {}'.format(table)
+                scanned.add(table)
+            elif detail.startswith('USE TEMP B-TREE'):
+                flag = 'temporary B-tree'
+            steps.append((depth[id_], detail, flag))
+
+        indexes = [
+            'CREATE INDEX IF NOT EXISTS `{}_{}` ON `{}`({});'.format(
+                table.split('.')[0], col, table, col)
+            for table, col in INDEXABLE
+            if table in scanned and (table, col) not in indexed
+            and re.search(r'\b{}\b'.format(col), sql, flags=re.IGNORECASE)]
+        return QueryPlan(steps, indexes)
+
+    def run_batch(self,
+                  queries: typing.List[typing.Tuple[str, str]],
+                  params: typing.Optional[tuple] = None,
+                  workers: int = 4,
+                  profile: bool = False,
+                  fetch: typing.Optional[typing.Callable] = None):
+        """
+        Run queries concurrently, on a pool of `workers` read-only connections.
+
+        :param queries: `list` of pairs (name, SQL).
+        :param params: Values for placeholders, passed to all queries containing placeholders.
+        :param fetch: Function called as `fetch(conn, name, sql, params)` to run a query - \
+        defaulting to `Database.execute`.
+        :return: Generator of `QueryResult`s (or results of `fetch`), in order of completion.
+        """
+        local, connections = threading.local(), []
+
+        def run_one(name, sql):
+            if not hasattr(local, 'conn'):
+                local.conn = self._connect(readonly=True)
+                connections.append(local.conn)
+            if fetch:
+                return fetch(local.conn, name, sql, (params or ()) if '?' in sql else ())
+            return self.execute(
+                local.conn, sql, (params or ()) if '?' in sql else (), name=name, profile=profile)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(run_one, name, sql) for name, sql in queries]
+                for future in concurrent.futures.as_completed(futures):
+                    yield future.result()
+        finally:
+            for conn in connections:
+                conn.close()
+
+
+class Profile(typing.NamedTuple):
+    seconds: float
+    rows: int
+    vm_steps: typing.Optional[int]  # Counted in multiples of PROGRESS_STEPS.
+
+
+class QueryResult(typing.NamedTuple):
+    name: typing.Optional[str]
+    columns: typing.List[str]
+    rows: typing.List[tuple]
+    profile: Profile
+
+
+class ColumnarResult(typing.NamedTuple):
+    name: typing.Optional[str]
+    arrays: typing.Optional['collections.OrderedDict']  # Maps column names to numpy arrays.
+    profile: Profile
+
+
+class QueryPlan(typing.NamedTuple):
+    # Triples (depth, detail, flag) for the steps of the plan.
+    steps: typing.List[typing.Tuple[int, str, typing.Optional[str]]]
+    # SQL to create indexes which may speed up the query.
+    indexes: typing.List[str]
+
+    def render(self) -> str:
+        lines = []
+        for depth, detail, flag in self.steps:
+            lines.append('{}{}{}'.format(
+                '  ' * depth, detail, '  <-- {}'.format(flag.upper()) if flag else ''))
+        if self.indexes:
+            lines.extend(['', 'Suggested indexes:'] + self.indexes)
+        return '\n'.join(lines)
+
+
+def infer_dtype(values) -> str:
+    """
+    Infer the numpy dtype for a column of a query result from a batch of values.
+    """
+    types = {type(v) for v in values if v is not None}
+    if types and types <= {int, float}:
+        return 'int64' if types == {int} and None not in values else 'float64'
+    return 'object'
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:  # pragma: no cover
+        raise ParserError('Arrow output requires pyarrow - install it running\n'
+                          '    pip install pyarrow')
+    return pyarrow
+
+
+def write_npz(path: pathlib.Path, arrays: 'collections.OrderedDict'):
+    """
+    Write arrays to a `.npz` file - with text as unicode strings (and NULL as empty string), so the
+    file can be loaded without `allow_pickle`.
+    """
+    import numpy as np
+
+    np.savez(str(path), **collections.OrderedDict(
+        (name, np.array(['' if v is None else str(v) for v in a], dtype=str)
+         if a.dtype == object else a)
+        for name, a in arrays.items()))
+
+
+def write_arrow(path: pathlib.Path, batches) -> int:
+    """
+    Write record batches to an Arrow IPC file.
+
+    The schema of an IPC file is fixed. So if the schema of a batch differs from the ones before -
+    because a column has been promoted from integer to float - the batches written so far are
+    re-written, cast to the new schema.
+
+    :return: Number of rows written.
+    """
+    pa, n = import_pyarrow(), 0
+    tmp = [path.parent / '{}.tmp{}'.format(path.name, i) for i in range(2)]
+    sink, writer, schema = None, None, None
+    for batch in batches:
+        if writer and not batch.schema.equals(schema):
+            writer.close()
+            sink.close()
+            tmp.reverse()
+            sink = pa.OSFile(str(tmp[0]), 'wb')
+            writer = pa.ipc.new_file(sink, batch.schema)
+            with pa.memory_map(str(tmp[1])) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    for b in pa.Table.from_batches([reader.get_batch(i)])\
+                            .cast(batch.schema).to_batches():
+                        writer.write_batch(b)
+            tmp[1].unlink()
+        if writer is None:
+            sink = pa.OSFile(str(tmp[0]), 'wb')
+            writer = pa.ipc.new_file(sink, batch.schema)
+        schema = batch.schema
+        writer.write_batch(batch)
+        n += batch.num_rows
+    writer.close()
+    sink.close()
+    tmp[0].replace(path)
+    return n
+
+
+def split_statements(sql: str) -> typing.List[str]:
+    """
+    Split SQL into complete statements, dropping empty ones (i.e. just whitespace or comments).
+    """
+    res, buf = [], ''
+    for part in sql.split(';'):
+        buf += part + ';'
+        if sqlite3.complete_statement(buf):
+            if re.sub(r'--[^\n]*|/\*.*?\*/|[\s;]', '', buf, flags=re.DOTALL):
+                res.append(buf.strip())
+            buf = ''
+    # The `;` appended to the last part ends up in a trailing `--` comment without newline:
+    buf = buf[:-1] + '\n;'
+    if re.sub(r'--[^\n]*|/\*.*?\*/|[\s;]', '', buf, flags=re.DOTALL):
+        # Incomplete statements are kept, too - to fail when run rather than silently be skipped.
+        res.append(buf.strip())
+    return res
+
+
+def read_queries(spec: str) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Read the queries from a SQL file, a directory of `.sql` files or a glob pattern.
+
+    :return: `list` of pairs (name, SQL), with names derived from the file names - and the number \
+    of the statement for files with multiple statements.
+    """
+    p = pathlib.Path(spec)
+    if p.is_dir():
+        paths = sorted(p.glob('*.sql'))
+    elif p.exists():
+        paths = [p]
+    else:
+        paths = sorted(pathlib.Path(p.anchor or '.').glob(str(p.relative_to(p.anchor or '.'))))
+    res = []
+    for path in paths:
+        statements = split_statements(path.read_text(encoding='utf8'))
+        if len(statements) == 1:
+            res.append((path.stem, statements[0]))
+        else:
+            res.extend(
+                ('{}-{}'.format(path.stem, i), sql) for i, sql in enumerate(statements, start=1))
+    return res
+
+
+def db_path() -> pathlib.Path:
+    """
+    Path of the SQLite database, i.e. `Dataset().dir / 'doreco.sqlite'` - but determined without
+    importing `cldfbench_doreco` and thus `cldfbench`.
+    """
+    return pathlib.Path(importlib.util.find_spec('cldfbench_doreco').origin).parent / 'doreco.sqlite'
 
 
 def register(parser):
     parser.add_argument(
         'sql',
-        type=PathType(type='file'),
-        help='Path to a file containing the SQL to be run.')
+        help='Path to a file containing the SQL to be run, or - to run a batch of queries - a '
+             'directory containing .sql files or a glob pattern matching .sql files.')
     parser.add_argument(
         'parameters',
         nargs='*',
@@ -96,17 +699,135 @@ def register(parser):
              "https://docs.python.org/3/library/sqlite3.html#sqlite3-placeholders), the values for "
              "these can be passed as additional, positional arguments."
     )
+    parser.add_argument(
+        '--output',
+        type=PathType(type='dir', must_exist=False),
+        default=None,
+        help='Directory to write the results of a batch of queries to, one file per query.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of queries of a batch to run concurrently.')
+    parser.add_argument(
+        '--shards',
+        nargs='*',
+        default=None,
+        metavar='GLOTTOCODE',
+        help='Query the per-corpus databases built with `cldfbench doreco.shards` instead of '
+             'doreco.sqlite - all of them, or only the ones for the given Glottocodes.')
+    parser.add_argument(
+        '--explain',
+        action='store_true',
+        default=False,
+        help='Print the query plan - flagging full scans of large tables and temporary B-trees - '
+             'instead of running the query.')
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        default=False,
+        help='Report wall time, number of rows and (approximate) number of SQLite VM steps.')
+    parser.add_argument(
+        '--slow-log',
+        type=PathType(type='file', must_exist=False),
+        default=None,
+        help='Path of a file to append queries running longer than --slow-threshold to.')
+    parser.add_argument(
+        '--slow-threshold',
+        type=float,
+        default=1.0,
+        help='Minimal number of seconds for a query to be logged as slow.')
+    parser.add_argument(
+        '--columnar',
+        choices=['npz', 'arrow'],
+        default=None,
+        help='Write results to the --output directory as numpy .npz files or Arrow IPC files '
+             '(requires pyarrow) - for large numeric results.')
     add_format(parser, 'simple')
 
 
 def run(args):
-    ds = Dataset()
-    db = Database(ds.dir / 'doreco.sqlite')
-    rows = db.query(
-        pathlib.Path(args.sql).read_text(encoding='utf8'),
-        params=args.parameters or None,
-        dicts=True)
-
-    with Table(args, *rows[0].keys()) as t:
-        for row in rows:
-            t.append(row.values())
+    kw = dict(slow_log=args.slow_log, slow_threshold=args.slow_threshold)
+    if args.shards is not None:
+        db = Database.from_shards(db_path().parent / 'shards', args.shards, **kw)
+    else:
+        db = Database(db_path(), **kw)
+    queries = read_queries(args.sql)
+    if not queries:
+        raise ParserError('No SQL found for {}'.format(args.sql))
+    params = args.parameters or None
+
+    if args.explain:
+        for name, sql in queries:
+            if len(queries) > 1:
+                print('# {}'.format(name))
+            print(db.explain(sql, params=params if '?' in sql else None).render())
+            print('')
+        return
+
+    if args.columnar:
+        if not args.output:
+            raise ParserError('Columnar output requires an --output directory.')
+        if args.columnar == 'arrow':
+            import_pyarrow()
+        args.output.mkdir(parents=True, exist_ok=True)
+
+        def fetch(conn, name, sql, params):
+            out = args.output / '{}.{}'.format(name, args.columnar)
+            start = time.perf_counter()
+            if args.columnar == 'arrow':
+                n = write_arrow(out, db.iter_record_batches(conn, sql, params))
+            else:
+                res = db.execute_columnar(conn, sql, params, name=name)
+                write_npz(out, res.arrays)
+                n = res.profile.rows
+            return name, n, time.perf_counter() - start, out
+
+        with Table(args, 'query', 'rows', 'seconds', 'output', floatfmt='.3') as t:
+            t.extend(sorted(
+                db.run_batch(queries, params=params, workers=args.workers, fetch=fetch),
+                key=lambda r: [name for name, _ in queries].index(r[0])))
+        return
+
+    if len(queries) == 1:
+        with db.connection() as conn:
+            res = db.execute(conn, queries[0][1], params=params, profile=args.profile)
+        with Table(args, *res.columns) as t:
+            t.extend(res.rows)
+        if args.profile:
+            args.log.info('{:.3f}s, {} rows, {} VM steps'.format(*res.profile))
+        return
+
+    if not args.output:
+        raise ParserError('Running a batch of queries requires an --output directory.')
+    args.output.mkdir(parents=True, exist_ok=True)
+    timings = {}
+    for res in db.run_batch(queries, params=params, workers=args.workers, profile=args.profile):
+        out = args.output / '{}.{}'.format(res.name, EXTENSIONS[args.format])
+        with out.open('w', encoding='utf8') as f:
+            with Table(args, *res.columns, file=f) as t:
+                t.extend(res.rows)
+        timings[res.name] = (res.name, len(res.rows), res.profile.seconds) + \
+            ((res.profile.vm_steps,) if args.profile else ()) + (out,)
+    cols = ['query', 'rows', 'seconds'] + (['vm_steps'] if args.profile else []) + ['output']
+    with Table(args, *cols, floatfmt='.3') as t:
+        t.extend(timings[name] for name, _ in queries)
+
+
+def main(args=None):  # pragma: no cover
+    """
+    Run the command without `cldfbench` - and the startup cost of loading it - e.g. when running
+    many queries from scripts:
+
+        python -m dorecocommands.query query.sql
+    """
+    parser = argparse.ArgumentParser(prog='python -m dorecocommands.query', description=__doc__)
+    register(parser)
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args.log = logging.getLogger(__name__)
+    run(args)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,258 @@
+"""
+Draw stratified random samples of phones, words or utterances.
+
+E.g. to draw 200 tokens of each IPA phone for a language, run
+
+    cldfbench doreco.sample phones --by parameter --language teop1238 --token-type xsampa --size 200
+
+Rather than sorting a full table with `ORDER BY random()` for each sample, the rows of each table
+are numbered once in stratum order - by language, speaker and (for phones) Token_Type and
+cldf_parameterReference - and the resulting ranges of numbers per stratum are stored in the
+database. Samples are then drawn as random numbers from these ranges, i.e. in time proportional to
+the sample size. Given a seed, samples are reproducible.
+
+The sampling index is created on first use and re-created whenever the database has changed, i.e.
+when size or modification time of the database file differ from the ones recorded in
+`doreco.sample.json` after the index was written.
+"""
+import json
+import random
+import typing
+import pathlib
+import collections
+
+from clldutils.clilib import Table, add_format, ParserError
+
+from cldfbench_doreco import Dataset
+from .query import Database
+
+# Per source: the stratum dimensions, and SQL selecting (rowid, *dimensions) and - for sampled rows
+# - (number, ID, File_ID, start, end).
+SOURCES = collections.OrderedDict([
+    ('phones', dict(
+        table='phones.csv',
+        dimensions=['language', 'speaker', 'token_type', 'parameter'],
+        strata="""
+SELECT p.rowid, w.cldf_languageReference, w.Speaker_ID, p.token_type, p.cldf_parameterReference
+FROM `phones.csv` AS p JOIN `words.csv` AS w ON p.wd_id = w.cldf_id""",
+        rows="""
+SELECT s.pos, p.cldf_id, w.cldf_mediaReference, p.start, p.end
+FROM sample_phones AS s
+JOIN `phones.csv` AS p ON p.rowid = s.row
+JOIN `words.csv` AS w ON p.wd_id = w.cldf_id""",
+    )),
+    ('words', dict(
+        table='words.csv',
+        dimensions=['language', 'speaker'],
+        strata="SELECT rowid, cldf_languageReference, Speaker_ID FROM `words.csv`",
+        rows="""
+SELECT s.pos, w.cldf_id, w.cldf_mediaReference, w.start, w.end
+FROM sample_words AS s JOIN `words.csv` AS w ON w.rowid = s.row""",
+    )),
+    ('utterances', dict(
+        table='utterances.csv',
+        dimensions=['language', 'speaker'],
+        strata="SELECT rowid, cldf_languageReference, Speaker_ID FROM `utterances.csv`",
+        rows="""
+SELECT s.pos, u.cldf_id, u.cldf_mediaReference, u.start, u.end
+FROM sample_utterances AS s JOIN `utterances.csv` AS u ON u.rowid = s.row""",
+    )),
+])
+DIMENSIONS = ['language', 'speaker', 'token_type', 'parameter']
+# File next to the database, recording for which sources the sampling index is up-to-date:
+STATE = 'doreco.sample.json'
+
+
+class Sampler:
+    """
+    Stratified sampling from the tables in `SOURCES`.
+
+        >>> sampler = Sampler(Database('doreco.sqlite'))
+        >>> sample = sampler.sample('utterances', by=['speaker'], size=50, seed=42)
+    """
+    def __init__(self, db: Database):
+        self.db = db
+        self.state = pathlib.Path(db.fname).parent / STATE
+
+    def fingerprint(self) -> list:
+        """
+        Size and modification time of the database file (and of its write-ahead log).
+        """
+        dbpath = pathlib.Path(self.db.fname)
+        return [
+            [p.stat().st_size, p.stat().st_mtime_ns]
+            for p in [dbpath, dbpath.parent / '{}-wal'.format(dbpath.name)] if p.exists()]
+
+    def indexed(self) -> set:
+        """
+        :return: The sources for which the sampling index is up-to-date.
+        """
+        if self.state.exists():
+            state = json.loads(self.state.read_text(encoding='utf8'))
+            if state['fingerprint'] == self.fingerprint():
+                return set(state['sources'])
+        return set()
+
+    def update(self, source, log=None, rebuild=False):
+        """
+        (Re-)create the numbering of rows and the strata ranges for `source` if necessary.
+        """
+        indexed = self.indexed()
+        if source in indexed and not rebuild:
+            return
+        with self.db.connection() as conn:
+            conn.execute("""
+CREATE TABLE IF NOT EXISTS sample_strata (
+    source TEXT NOT NULL,
+    language TEXT,
+    speaker TEXT,
+    token_type TEXT,
+    parameter TEXT,
+    lo INTEGER NOT NULL,
+    hi INTEGER NOT NULL
+)""")
+            if log:
+                log.info('creating sampling index for {}'.format(source))
+            spec = SOURCES[source]
+            rows = conn.execute(spec['strata']).fetchall()
+            # Sort by stratum - with NULLs first - and by rowid within strata:
+            rows.sort(key=lambda r: tuple((v is not None, v or '') for v in r[1:]) + (r[0],))
+            strata = []
+            for pos, row in enumerate(rows):
+                if strata and strata[-1][0] == row[1:]:
+                    strata[-1][2] = pos
+                else:
+                    strata.append([row[1:], pos, pos])
+            with conn:
+                conn.execute('DROP TABLE IF EXISTS sample_{}'.format(source))
+                conn.execute(
+                    'CREATE TABLE sample_{} (pos INTEGER PRIMARY KEY, row INTEGER NOT NULL)'.format(
+                        source))
+                conn.executemany(
+                    'INSERT INTO sample_{} VALUES (?, ?)'.format(source),
+                    ((pos, row[0]) for pos, row in enumerate(rows)))
+                conn.execute('DELETE FROM sample_strata WHERE source = ?', (source,))
+                conn.executemany(
+                    'INSERT INTO sample_strata (source, {}, lo, hi) VALUES (?, {}, ?, ?)'.format(
+                        ', '.join(spec['dimensions']), ', '.join('?' for _ in spec['dimensions'])),
+                    [(source,) + tuple(key) + (lo, hi) for key, lo, hi in strata])
+        # Writing the index changes the database file, so the fingerprint is taken afterwards.
+        self.state.write_text(
+            json.dumps(dict(fingerprint=self.fingerprint(), sources=sorted(indexed | {source}))),
+            encoding='utf8')
+
+    def strata(self, source, by=(), **filters) -> typing.Dict[tuple, typing.List[tuple]]:
+        """
+        :return: `dict` mapping stratum keys - values of the dimensions `by` - to lists of \
+        (lo, hi) ranges of row numbers.
+        """
+        dims = SOURCES[source]['dimensions']
+        for dim in list(by) + list(filters):
+            if dim not in dims:
+                raise ValueError('Invalid dimension for {}: {}'.format(source, dim))
+        sql = 'SELECT {}lo, hi FROM sample_strata WHERE source = ?'.format(
+            ''.join('{}, '.format(d) for d in by))
+        params = [source]
+        for dim, value in filters.items():
+            sql += ' AND {} = ?'.format(dim)
+            params.append(value)
+        res = collections.defaultdict(list)
+        with self.db.connection() as conn:
+            for row in conn.execute(sql + ' ORDER BY lo', params):
+                res[tuple(row[:-2])].append(tuple(row[-2:]))
+        return res
+
+    def sample(self,
+               source,
+               by=(),
+               size=100,
+               seed=None,
+               **filters) -> typing.List[typing.Tuple[tuple, str, str, float, float]]:
+        """
+        Draw up to `size` rows (without replacement) from each stratum.
+
+        :param by: Dimensions defining the strata.
+        :param filters: Values of dimensions to restrict sampling to.
+        :return: `list` of tuples (stratum key, ID, File_ID, start, end).
+        """
+        import numpy as np
+
+        self.update(source)
+        seed = random.randrange(2 ** 32) if seed is None else seed
+        sampled = []
+        for key, ranges in sorted(
+                self.strata(source, by=by, **filters).items(),
+                key=lambda i: tuple((v is not None, v or '') for v in i[0])):
+            sizes = np.array([hi - lo + 1 for lo, hi in ranges])
+            total = int(sizes.sum())
+            # Each stratum gets its own random generator, so samples for one stratum do not
+            # depend on which other strata are sampled.
+            rng = random.Random('{}-{}'.format(seed, key))
+            picks = np.array(sorted(rng.sample(range(total), min(size, total))), dtype=np.int64)
+            # Map numbers in [0, total) onto the (non-contiguous) ranges of the stratum:
+            cum = np.concatenate([[0], np.cumsum(sizes)])
+            i = np.searchsorted(cum, picks, side='right') - 1
+            los = np.array([lo for lo, _ in ranges])
+            sampled.extend((key, int(pos)) for pos in los[i] + picks - cum[i])
+
+        res = {}
+        with self.db.connection() as conn:
+            for j in range(0, len(sampled), 500):
+                chunk = [pos for _, pos in sampled[j:j + 500]]
+                for row in conn.execute(
+                        '{} WHERE s.pos IN ({})'.format(
+                            SOURCES[source]['rows'], ','.join('?' for _ in chunk)),
+                        chunk):
+                    res[row[0]] = row[1:]
+        return [(key,) + res[pos] for key, pos in sampled]
+
+
+def register(parser):
+    parser.add_argument('source', choices=list(SOURCES), help='Table to sample from.')
+    parser.add_argument(
+        '--by',
+        nargs='*',
+        choices=DIMENSIONS,
+        default=['language'],
+        help='Dimensions defining the strata.')
+    parser.add_argument(
+        '--size',
+        type=int,
+        default=100,
+        help='Number of rows to sample per stratum.')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Seed for the random number generator, to make samples reproducible.')
+    for dim in DIMENSIONS:
+        parser.add_argument(
+            '--{}'.format(dim.replace('_', '-')),
+            default=None,
+            help='Only sample rows with the specified {}.'.format(dim))
+    parser.add_argument(
+        '--with-media',
+        action='store_true',
+        default=False,
+        help='Include File_ID, start and end of the sampled rows, e.g. for audio review.')
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        default=False,
+        help='Re-create the sampling index.')
+    add_format(parser, 'simple')
+
+
+def run(args):
+    ds = Dataset()
+    filters = {dim: getattr(args, dim) for dim in DIMENSIONS if getattr(args, dim) is not None}
+    invalid = [d for d in list(args.by) + list(filters) if d not in SOURCES[args.source]['dimensions']]
+    if invalid:
+        raise ParserError('Invalid dimensions for {}: {}'.format(args.source, ', '.join(invalid)))
+    sampler = Sampler(Database(ds.dir / 'doreco.sqlite'))
+    sampler.update(args.source, log=args.log, rebuild=args.rebuild)
+    rows = sampler.sample(args.source, by=args.by, size=args.size, seed=args.seed, **filters)
+    cols = list(args.by) + ['ID'] + (['File_ID', 'start', 'end'] if args.with_media else [])
+    with Table(args, *cols) as t:
+        for key, id_, fid, start, end in rows:
+            t.append(list(key) + [id_] + ([fid, start, end] if args.with_media else []))
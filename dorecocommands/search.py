@@ -0,0 +1,249 @@
+"""
+Search examples and words by morpheme or gloss.
+
+The search is backed by an inverted index of morphemes, glosses and gloss categories in
+ExampleTable and `words.csv`, and gloss abbreviations in `glosses.csv`, which is stored in the
+SQLite database. Strings are split into tokens at whitespace and morpheme separators - and glosses
+additionally at "." - so searching for ERG will find "3SG.ERG-PL", but not "ERGATIVE".
+
+The index is created on first use, and updated for the corpora whose data has changed in the
+database whenever the command is run.
+"""
+import re
+import hashlib
+import functools
+
+from clldutils.clilib import Table, add_format
+
+from cldfbench_doreco import Dataset
+from .query import Database
+
+SOURCES = {'examples': 'ExampleTable', 'words': 'words.csv', 'glosses': 'glosses.csv'}
+CONTEXT = {
+    'ExampleTable': "SELECT cldf_id, cldf_analyzedWord || ' / ' || cldf_gloss FROM ExampleTable",
+    'words.csv': "SELECT cldf_id, cldf_name || ' ' || coalesce(mb, '') || ' / ' || "
+                 "coalesce(gl, '') FROM `words.csv`",
+    'glosses.csv': "SELECT cldf_id, cldf_name || ': ' || coalesce(Meaning, '') FROM `glosses.csv`",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def separators(gloss=False):
+    """
+    Regular expression matching separators of morphemes - and optionally of gloss categories.
+    """
+    from pyigt.lgrmorphemes import MORPHEME_SEPARATORS
+
+    return re.compile(r'[\s{}{}]+'.format(
+        '.' if gloss else '', re.escape(''.join(MORPHEME_SEPARATORS))))
+
+
+def morphemes(s):
+    """
+    Split a list of (analyzed) words into morphemes.
+
+    >>> list(morphemes('a-b=c\\td'))
+    ['a', 'b', 'c', 'd']
+    """
+    return [t for t in separators().split(s or '') if t]
+
+
+def glosses(s):
+    """
+    Split a list of word glosses into morpheme glosses and - in addition - gloss categories.
+
+    >>> glosses('3SG.ERG-PL')
+    ['3SG.ERG', '3SG', 'ERG', 'PL']
+    """
+    res = []
+    for gloss in morphemes(s):
+        res.append(gloss)
+        if '.' in gloss:
+            res.extend(t for t in separators(gloss=True).split(gloss) if t)
+    return res
+
+
+def words(s):
+    return [s] if s else []
+
+
+# The indexed fields: (source table, field name, column, tokenizer)
+FIELDS = [
+    ('ExampleTable', 'morpheme', 'cldf_analyzedWord', morphemes),
+    ('ExampleTable', 'gloss', 'cldf_gloss', glosses),
+    ('words.csv', 'morpheme', 'mb', morphemes),
+    ('words.csv', 'gloss', 'gl', glosses),
+    ('words.csv', 'word', 'cldf_name', words),
+    ('glosses.csv', 'gloss', 'cldf_name', words),
+]
+
+
+class SearchIndex:
+    """
+    An inverted index, mapping (term, language, field) to IDs of rows in the source tables.
+    """
+    def __init__(self, db: Database):
+        self.db = db
+
+    def create(self, conn):
+        conn.execute("""
+CREATE TABLE IF NOT EXISTS search_postings (
+    term TEXT NOT NULL,
+    language TEXT NOT NULL,
+    field TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    PRIMARY KEY (term, language, field, source, ref)
+) WITHOUT ROWID""")
+        conn.execute("""
+CREATE TABLE IF NOT EXISTS search_state (
+    source TEXT NOT NULL,
+    language TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (source, language)
+)""")
+
+    @staticmethod
+    def fingerprints(conn, source):
+        """
+        Fingerprints of the indexed data per language, i.e. hashes over IDs and indexed columns of
+        all rows of a language - in table order.
+        """
+        cols = [col for src, _, col, _ in FIELDS if src == source]
+        hashes = {}
+        for row in conn.execute('SELECT cldf_languageReference, cldf_id, {} FROM `{}`'.format(
+                ', '.join(cols), source)):
+            if row[0] not in hashes:
+                hashes[row[0]] = hashlib.md5()
+            hashes[row[0]].update(repr(row[1:]).encode('utf8'))
+        return {lg: h.hexdigest() for lg, h in hashes.items()}
+
+    def update(self, log=None, rebuild=False):
+        """
+        Update the index for all (source, language) pairs for which data has changed.
+        """
+        with self.db.connection() as conn:
+            self.create(conn)
+            if rebuild:
+                conn.execute('DELETE FROM search_postings')
+                conn.execute('DELETE FROM search_state')
+            state = {(s, lg): fp for s, lg, fp in conn.execute('SELECT * FROM search_state')}
+            for source in SOURCES.values():
+                current = self.fingerprints(conn, source)
+                stale = sorted(
+                    lg for lg in set(current) | {lg for s, lg in state if s == source}
+                    if state.get((source, lg)) != current.get(lg))
+                if not stale:
+                    continue
+                if log:
+                    log.info('indexing {} for {} languages'.format(source, len(stale)))
+                with conn:
+                    self._index(conn, source, stale)
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO search_state VALUES (?, ?, ?)',
+                        [(source, lg, current[lg]) for lg in stale if lg in current])
+                    conn.executemany(
+                        'DELETE FROM search_state WHERE source = ? AND language = ?',
+                        [(source, lg) for lg in stale if lg not in current])
+
+    @staticmethod
+    def _index(conn, source, languages):
+        conn.execute(
+            'DELETE FROM search_postings WHERE source = ? AND language IN ({})'.format(
+                ','.join('?' for _ in languages)),
+            [source] + languages)
+        fields = [(field, col, tokenizer) for src, field, col, tokenizer in FIELDS
+                  if src == source]
+        cu = conn.execute(
+            'SELECT cldf_id, cldf_languageReference, {} FROM `{}` WHERE '
+            'cldf_languageReference IN ({})'.format(
+                ', '.join(col for _, col, _ in fields),
+                source,
+                ','.join('?' for _ in languages)),
+            languages)
+
+        def postings():
+            for row in cu:
+                for (field, _, tokenize), value in zip(fields, row[2:]):
+                    for term in set(tokenize(value)):
+                        yield term, row[1], field, source, row[0]
+
+        conn.executemany('INSERT OR IGNORE INTO search_postings VALUES (?, ?, ?, ?, ?)', postings())
+
+    def search(self, term, field=None, language=None, source=None, prefix=False, limit=None):
+        """
+        :return: `list` of tuples (source, ID, language, field, matching term, context).
+        """
+        where, params = [], []
+        if prefix:
+            # A range query on the primary key, i.e. matching case-sensitively.
+            where.append('p.term >= ? AND p.term < ?')
+            params.extend([term, term + '\U0010ffff'])
+        else:
+            where.append('p.term = ?')
+            params.append(term)
+        for col, value in [('language', language), ('field', field), ('source', source)]:
+            if value:
+                where.append('p.{} = ?'.format(col))
+                params.append(value)
+        sql = 'SELECT p.source, p.ref, p.language, p.field, p.term FROM search_postings AS p ' \
+              'WHERE {} ORDER BY p.source, p.language, p.ref'.format(' AND '.join(where))
+        if limit:
+            sql += ' LIMIT {}'.format(int(limit))
+        with self.db.connection() as conn:
+            rows = list(conn.execute(sql, params))
+            res = []
+            for row in rows:
+                ctx = conn.execute(
+                    '{} WHERE cldf_id = ?'.format(CONTEXT[row[0]]), (row[1],)).fetchone()
+                res.append(row + (ctx[1] if ctx else None,))
+        return res
+
+
+def register(parser):
+    parser.add_argument('term', help='Morpheme, gloss (category) or word form to search for.')
+    parser.add_argument(
+        '--field',
+        choices=sorted({f[1] for f in FIELDS}),
+        default=None,
+        help='Only search the specified field.')
+    parser.add_argument(
+        '--source',
+        choices=sorted(SOURCES),
+        default=None,
+        help='Only search the specified table.')
+    parser.add_argument(
+        '--language',
+        default=None,
+        help='Only search data of the language with the specified Glottocode.')
+    parser.add_argument(
+        '--prefix',
+        action='store_true',
+        default=False,
+        help='Search for terms starting with the search term.')
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=None,
+        help='Maximal number of results.')
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        default=False,
+        help='Rebuild the search index from scratch.')
+    add_format(parser, 'simple')
+
+
+def run(args):
+    ds = Dataset()
+    index = SearchIndex(Database(ds.dir / 'doreco.sqlite'))
+    index.update(log=args.log, rebuild=args.rebuild)
+    rows = index.search(
+        args.term,
+        field=args.field,
+        language=args.language,
+        source=SOURCES[args.source] if args.source else None,
+        prefix=args.prefix,
+        limit=args.limit)
+    with Table(args, 'Source', 'ID', 'Language', 'Field', 'Term', 'Context') as t:
+        t.extend(rows)
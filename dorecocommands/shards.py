@@ -0,0 +1,82 @@
+"""
+Load the CLDF data into one SQLite database per corpus, i.e. per Glottocode.
+
+Each of these "shards" has the same schema as `doreco.sqlite` - tables shared by all corpora, like
+ParameterTable, are copied into each shard. A catalog database lists the shards; querying the
+catalog - e.g. with `cldfbench doreco.query --shards` - attaches the shards and provides `UNION ALL`
+views with the names of the corpus-specific tables, so SQL written for `doreco.sqlite` can be run
+unchanged. (For more corpora than SQLite can attach at once, the union is materialized in a
+database next to the catalog, see `dorecocommands.query.Database`.)
+
+Passing Glottocodes only (re-)builds the shards for these corpora.
+"""
+import re
+import sqlite3
+import pathlib
+import contextlib
+
+from clldutils.clilib import PathType
+
+from cldfbench_doreco import Dataset
+from .query import SHARDS_TABLE, CATALOG
+
+def write_catalog(out_dir: pathlib.Path, shared: list, source: pathlib.Path) -> pathlib.Path:
+    """
+    Write the catalog, listing all shards in `out_dir`, with the shared tables copied from `source`.
+    """
+    path = out_dir / CATALOG
+    tmp = path.parent / '{}.tmp'.format(path.name)
+    if tmp.exists():
+        tmp.unlink()
+    with contextlib.closing(sqlite3.connect(str(tmp))) as conn:
+        conn.execute('ATTACH DATABASE ? AS shard', (str(source),))
+        for name in shared:
+            sql = conn.execute(
+                "SELECT sql FROM shard.sqlite_master WHERE type = 'table' AND name = ?",
+                (name,)).fetchone()[0]
+            conn.execute(sql)
+            conn.execute('INSERT INTO main.`{0}` SELECT * FROM shard.`{0}`'.format(name))
+        conn.execute(
+            'CREATE TABLE {} (glottocode TEXT PRIMARY KEY, path TEXT NOT NULL)'.format(SHARDS_TABLE))
+        conn.executemany(
+            'INSERT INTO {} VALUES (?, ?)'.format(SHARDS_TABLE),
+            [(p.stem, p.name) for p in sorted(out_dir.glob('*.sqlite'))
+             if p.name != CATALOG and re.fullmatch('[a-z0-9]{4}[0-9]{4}', p.stem)])
+        conn.commit()
+    tmp.replace(path)
+    return path
+
+
+def register(parser):
+    parser.add_argument(
+        'glottocodes',
+        nargs='*',
+        metavar='GLOTTOCODE',
+        help='Only (re-)build the shards for the corpora with these Glottocodes.')
+    parser.add_argument(
+        '--output',
+        type=PathType(type='dir', must_exist=False),
+        default=None,
+        help='Directory to write the shards to (defaults to the shards directory of the dataset).')
+    parser.add_argument(
+        '--views',
+        action='store_true',
+        default=False,
+        help='Create the views defined in etc/views.sql in each shard.')
+
+
+def run(args):
+    from util.shards import Sharder
+
+    ds = Dataset()
+    sharder = Sharder(
+        ds.cldf_reader(),
+        args.output or ds.dir / 'shards',
+        glottocodes=args.glottocodes,
+        views=ds.etc_dir.joinpath('views.sql').read_text(encoding='utf8') if args.views else None)
+    sharder.write_from_tg()
+    if sharder.written:
+        write_catalog(sharder.out_dir, sharder.shared, sharder.written[0])
+    for gc in set(args.glottocodes) - {p.stem for p in sharder.written}:
+        args.log.warning('no data for Glottocode {}'.format(gc))
+    args.log.info('{} shards written to {}'.format(len(sharder.written), sharder.out_dir))
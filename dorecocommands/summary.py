@@ -0,0 +1,112 @@
+"""
+Compute summary statistics of phone and word durations.
+
+Durations are aggregated per language, speaker and file - and per Token_Type of phones (or type of
+words, i.e. "word", "pause" or "label") and per category of labels (see `LABEL_PATTERN`). Phones
+and words are streamed from the database in batches, updating accumulators per group:
+count, sum, sum of squares, minimum, maximum and a sketch of the distribution - a histogram with
+logarithmic bins, from which quantiles can be estimated with a relative error below 2%.
+
+The results are written to tables `summary_phones` and `summary_words` in the SQLite database. Since
+count, sum and sum of squares can be added up, statistics for larger groups can be computed from
+these tables, too, e.g. the mean duration of phones per speaker sex:
+
+    SELECT s.sex, sum(p.sum) / sum(p.n)
+    FROM summary_phones AS p JOIN `speakers.csv` AS s ON p.id = s.cldf_id
+    WHERE p.level = 'speaker' AND p.type = 'xsampa' AND p.label = ''
+    GROUP BY s.sex;
+"""
+from cldfbench_doreco import Dataset, LABEL_PATTERN, SILENT_PAUSE
+from .query import Database
+
+SQL = {
+    'phones': """
+SELECT
+    p.duration, p.Token_Type, p.cldf_name,
+    w.cldf_languageReference, w.Speaker_ID, w.cldf_mediaReference
+FROM
+    `phones.csv` AS p
+JOIN
+    `words.csv` AS w ON p.wd_id = w.cldf_id""",
+    'words': """
+SELECT
+    duration,
+    CASE WHEN cldf_name = ? THEN 'pause' WHEN cldf_name LIKE '<<%' THEN 'label' ELSE 'word' END,
+    cldf_name, cldf_languageReference, Speaker_ID, cldf_mediaReference
+FROM
+    `words.csv`""",
+}
+LEVELS = ['language', 'speaker', 'file']
+BATCH_SIZE = 100000
+
+
+def label(name):
+    m = LABEL_PATTERN.match(name or '')
+    return m.group('label') if m else None
+
+
+def summarize(conn, sql, params=()) -> 'util.summary.Summary':
+    """
+    Stream rows (duration, type, name, language, speaker, file) and accumulate per group.
+    """
+    import numpy as np
+    from util.summary import Summary
+
+    summary = Summary()
+    cu = conn.execute(sql, params)
+    while True:
+        rows = cu.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        keys, durations = [], []
+        for duration, type_, name, *ids in rows:
+            if duration is None:
+                continue
+            labels = ['']
+            if type_ == 'label' and label(name):
+                labels.append(label(name))
+            for level, id_ in zip(LEVELS, ids):
+                if id_ is not None:
+                    for lb in labels:
+                        keys.append((level, id_, type_, lb))
+                        durations.append(duration)
+        summary.add(keys, np.array(durations, dtype=np.float64))
+    return summary
+
+
+def register(parser):
+    pass
+
+
+def run(args):
+    from util.summary import QUANTILES
+
+    ds = Dataset()
+    db = Database(ds.dir / 'doreco.sqlite')
+    with db.connection() as conn:
+        for table, sql in SQL.items():
+            summary = summarize(conn, sql, (SILENT_PAUSE,) if '?' in sql else ())
+            name = 'summary_{}'.format(table)
+            with conn:
+                conn.execute('DROP TABLE IF EXISTS {}'.format(name))
+                conn.execute("""
+CREATE TABLE {0} (
+    level TEXT NOT NULL,
+    id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    label TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    sum_squares REAL NOT NULL,
+    mean REAL NOT NULL,
+    sd REAL,
+    {1},
+    PRIMARY KEY (level, id, type, label)
+)""".format(name, ',\n    '.join('{} REAL NOT NULL'.format(q) for q, _ in QUANTILES)))
+                rows = [key + tuple(row) for key, *row in summary.rows()]
+                conn.executemany(
+                    'INSERT INTO {} VALUES ({})'.format(name, ', '.join(['?'] * (11 + len(QUANTILES)))),
+                    rows)
+            args.log.info('{} groups written to {}'.format(len(summary.groups), name))
@@ -0,0 +1,229 @@
+"""
+Export the annotations of each audio file as Praat TextGrid.
+
+For each file in MediaTable, a TextGrid with interval tiers for phones, words and utterances - and
+for morphemes and glosses, if available in `words.csv` - is written, with one set of tiers per
+speaker (because intervals in a tier must not overlap). Rows without Speaker_ID are put in tiers
+for an "unknown speaker". The TextGrids span the duration of the WAV file if it has been downloaded
+(see `cldfbench download`), otherwise up to the end of the last annotation.
+
+Phones, words and utterances are read from the SQLite database in one pass each, sorted by File_ID,
+and the TextGrids are written by a pool of worker processes. TextGrids for which the source rows
+have not changed since the last export are skipped.
+"""
+import os
+import json
+import hashlib
+import pathlib
+import itertools
+import concurrent.futures
+
+from clldutils.clilib import PathType
+
+from cldfbench_doreco import Dataset
+from .query import Database
+
+# For each kind of tier, SQL selecting rows (File_ID, speaker, start, end, *texts) - sorted by
+# File_ID.
+SQL = {
+    'phones': """
+SELECT
+    w.cldf_mediaReference, w.Speaker_ID, p.start, p.end, p.cldf_name
+FROM
+    `phones.csv` AS p
+JOIN
+    `words.csv` AS w ON p.wd_id = w.cldf_id
+WHERE
+    w.cldf_mediaReference IS NOT NULL
+ORDER BY w.cldf_mediaReference, p.start""",
+    'words': """
+SELECT
+    cldf_mediaReference, Speaker_ID, start, end, cldf_name, mb, gl
+FROM
+    `words.csv`
+WHERE
+    cldf_mediaReference IS NOT NULL
+ORDER BY cldf_mediaReference, start""",
+    'utterances': """
+SELECT
+    cldf_mediaReference, Speaker_ID, start, end, cldf_id
+FROM
+    `utterances.csv`
+WHERE
+    cldf_mediaReference IS NOT NULL
+ORDER BY cldf_mediaReference, start""",
+}
+# Tiers: (name, kind of rows, index of the text in the rows)
+TIERS = [
+    ('utterances', 'utterances', 4),
+    ('words', 'words', 4),
+    ('morphemes', 'words', 5),
+    ('glosses', 'words', 6),
+    ('phones', 'phones', 4),
+]
+MANIFEST = 'textgrids.json'
+UNKNOWN_SPEAKER = 'unknown speaker'
+
+
+def register(parser):
+    parser.add_argument(
+        'out',
+        type=PathType(type='dir', must_exist=False),
+        help='Directory to write the TextGrid files to.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (defaults to the number of CPUs).')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        default=False,
+        help='Re-write TextGrids even if the annotations have not changed.')
+
+
+def iter_files(conn):
+    """
+    Merge the rows of all kinds in `SQL` by File_ID.
+
+    :return: Generator of pairs (File_ID, `dict` mapping kinds to lists of rows without File_ID).
+    """
+    groups = {
+        kind: itertools.groupby(conn.execute(sql), lambda r: r[0]) for kind, sql in SQL.items()}
+    heads = {kind: next(g, None) for kind, g in groups.items()}
+    while any(heads.values()):
+        fid = min(h[0] for h in heads.values() if h)
+        data = {}
+        for kind, head in heads.items():
+            data[kind] = []
+            if head and head[0] == fid:
+                data[kind] = [row[1:] for row in head[1]]
+                heads[kind] = next(groups[kind], None)
+        yield fid, data
+
+
+def intervals(rows, text_index, xmax):
+    """
+    Turn rows into a gapless list of non-overlapping (xmin, xmax, text) triples as required for
+    TextGrid interval tiers.
+    """
+    res, last = [], 0.0
+    for row in sorted(rows, key=lambda r: (r[1], r[2])):
+        start, end, text = max(row[1], last), min(row[2], xmax), row[text_index - 1]
+        if end <= start:  # Overlapping intervals - and intervals beyond xmax - are clipped.
+            continue
+        if start > last:
+            res.append((last, start, ''))
+        res.append((start, end, text or ''))
+        last = end
+    if xmax > last:
+        res.append((last, xmax, ''))
+    return res
+
+
+def quoted(s):
+    return '"{}"'.format(s.replace('"', '""'))
+
+
+def textgrid(data, xmax=None) -> str:
+    """
+    Render the rows for one file as TextGrid (in Praat's long text format).
+
+    :param xmax: Duration of the audio file - defaults to the end of the last annotation.
+    """
+    if xmax is None:
+        xmax = max([row[2] for rows in data.values() for row in rows] or [0])
+    # Speakers in alphabetical order, followed by the unknown speaker:
+    speakers = sorted(
+        {row[0] or None for rows in data.values() for row in rows},
+        key=lambda s: (s is None, s or ''))
+    tiers = []
+    for speaker in speakers:
+        for name, kind, index in TIERS:
+            rows = [row for row in data[kind] if (row[0] or None) == speaker]
+            if rows and any(row[index - 1] for row in rows):
+                tiers.append((
+                    '{}: {}'.format(speaker or UNKNOWN_SPEAKER, name),
+                    intervals(rows, index, xmax)))
+    lines = [
+        'File type = "ooTextFile"',
+        'Object class = "TextGrid"',
+        '',
+        'xmin = 0',
+        'xmax = {}'.format(xmax),
+        'tiers? <exists>',
+        'size = {}'.format(len(tiers)),
+        'item []:',
+    ]
+    for i, (name, ivs) in enumerate(tiers, start=1):
+        lines.extend([
+            '    item [{}]:'.format(i),
+            '        class = "IntervalTier"',
+            '        name = {}'.format(quoted(name)),
+            '        xmin = 0',
+            '        xmax = {}'.format(xmax),
+            '        intervals: size = {}'.format(len(ivs)),
+        ])
+        for j, (start, end, text) in enumerate(ivs, start=1):
+            lines.extend([
+                '        intervals [{}]:'.format(j),
+                '            xmin = {}'.format(start),
+                '            xmax = {}'.format(end),
+                '            text = {}'.format(quoted(text)),
+            ])
+    return '\n'.join(lines) + '\n'
+
+
+def write_textgrid(path, data, xmax=None):
+    pathlib.Path(path).write_text(textgrid(data, xmax), encoding='utf8')
+    return path
+
+
+def run(args):
+    from util.wav import Wav
+
+    ds = Dataset()
+    durations = {row['ID']: Wav(p).duration for row, p in ds.iter_media()}
+    db = Database(ds.dir / 'doreco.sqlite')
+    args.out.mkdir(parents=True, exist_ok=True)
+    manifest = args.out / MANIFEST
+    checksums = json.loads(manifest.read_text(encoding='utf8')) if manifest.exists() else {}
+
+    written, skipped = 0, 0
+    workers = args.workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}  # Maps futures to (file ID, checksum).
+
+        def finish(futures):
+            nonlocal written
+            for future in futures:
+                fid, checksum = pending.pop(future)
+                future.result()
+                # Only record the checksum once the TextGrid has been written successfully:
+                checksums[fid] = checksum
+                written += 1
+
+        try:
+            with db.connection() as conn:
+                media = {r[0] for r in conn.execute('SELECT cldf_id FROM mediatable')}
+                for fid, data in iter_files(conn):
+                    if fid not in media:
+                        continue
+                    path = args.out / '{}.TextGrid'.format(fid)
+                    xmax = durations.get(fid)
+                    checksum = hashlib.md5(repr((data, xmax)).encode('utf8')).hexdigest()
+                    if path.exists() and checksums.get(fid) == checksum and not args.force:
+                        skipped += 1
+                        continue
+                    checksums.pop(fid, None)
+                    pending[executor.submit(write_textgrid, path, data, xmax)] = (fid, checksum)
+                    if len(pending) >= 2 * workers:
+                        # Limit the number of files held in memory:
+                        done, _ = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        finish(done)
+            for future in concurrent.futures.as_completed(list(pending)):
+                finish([future])
+        finally:
+            manifest.write_text(json.dumps(checksums, indent=2, sort_keys=True), encoding='utf8')
+    args.log.info('{} TextGrids written, {} unchanged'.format(written, skipped))
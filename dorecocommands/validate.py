@@ -0,0 +1,37 @@
+"""
+Validate the CLDF dataset - much faster than `cldf validate`.
+
+All tables are streamed once, in parallel, checking datatypes and formats, primary and foreign keys
+and the time alignment of phones within words. Every violation is reported with its table and
+(1-based) row number.
+"""
+from clldutils.clilib import Table, add_format, PathType
+
+from cldfbench_doreco import Dataset
+
+
+def register(parser):
+    parser.add_argument(
+        '--cldf-dir',
+        type=PathType(type='dir'),
+        default=None,
+        help='Directory containing the CLDF dataset '
+             '(defaults to the cldf directory of the dataset).')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (defaults to the number of CPUs).')
+    add_format(parser, 'simple')
+
+
+def run(args):
+    from util.validate import Validator
+
+    violations = Validator(args.cldf_dir or Dataset().cldf_dir).validate(workers=args.workers)
+    if violations:
+        with Table(args, 'table', 'row', 'column', 'message') as t:
+            t.extend(violations)
+        args.log.error('{} violations'.format(len(violations)))
+        return 1
+    args.log.info('valid')
@@ -1,45 +1,31 @@
+-- Indexes for the positional columns of phones: Partial indexes - i.e. on the (few) word or
+-- utterance initial phones only - for the views below, and indexes to look up neighbouring phones.
+CREATE INDEX IF NOT EXISTS phones_wd_initial ON 'phones.csv'(token_type) WHERE wd_initial;
+CREATE INDEX IF NOT EXISTS phones_u_initial ON 'phones.csv'(token_type) WHERE u_initial;
+CREATE INDEX IF NOT EXISTS phones_prev_ph_id ON 'phones.csv'(prev_ph_ID);
+CREATE INDEX IF NOT EXISTS phones_next_ph_id ON 'phones.csv'(next_ph_ID);
+
 -- Word initial phones
+DROP VIEW IF EXISTS word_initials;
 CREATE VIEW IF NOT EXISTS word_initials AS
-SELECT s.* FROM (
-    SELECT
-        p.*,
-        -- We use a window function to be able to determine the first row in a batch.
-        row_number() OVER (PARTITION BY wd_ID ORDER BY cldf_id) rownum
-    FROM
-        'phones.csv' AS p
-    ) AS s
-WHERE
-    s.rownum = 1 AND s.token_type = 'xsampa';
+SELECT p.* FROM 'phones.csv' AS p WHERE p.wd_initial AND p.token_type = 'xsampa';
 
 -- Utterance initial phones
+DROP VIEW IF EXISTS utterance_initials;
 CREATE VIEW IF NOT EXISTS utterance_initials AS
-SELECT s.* FROM (
-    SELECT
-        p.*,
-        -- We use a window function to be able to determine the first row in a batch.
-        row_number() OVER (PARTITION BY u_ID ORDER BY cldf_id) rownum
-    FROM
-        'phones.csv' AS p
-    ) AS s
-WHERE
-    s.rownum = 1 AND s.token_type = 'xsampa';
+SELECT p.* FROM 'phones.csv' AS p WHERE p.u_initial AND p.token_type = 'xsampa';
 
 -- Utterance information
+-- Utterances are listed in the `utterances.csv` table, this view is kept for backwards compatibility.
 DROP VIEW IF EXISTS utterances;
 CREATE VIEW IF NOT EXISTS utterances AS
 SELECT
-    p.u_id AS u_id,
-	-- count of utterance to see how many phones in utterance
-    count(p.u_id)/sum(p.duration) AS speech_rate,
-    log(exp(1), count(p.cldf_id)/sum(p.duration)) AS log_speech_rate,
-	w.cldf_languageReference AS cldf_languageReference
+    u.cldf_id AS u_id,
+    u.speech_rate AS speech_rate,
+    log(exp(1), u.speech_rate) AS log_speech_rate,
+	u.cldf_languageReference AS cldf_languageReference
 FROM
-    'phones.csv' AS p
-LEFT JOIN
-	'words.csv' AS w
-ON
-	p.wd_id = w.cldf_id
-GROUP BY p.u_id;
+    'utterances.csv' AS u;
 
 -- Number of phones per word
 DROP VIEW IF EXISTS phones_per_word;
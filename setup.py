@@ -23,11 +23,15 @@ setup(
         'tqdm',
         'cldfbench',
         'pydub',
-        'pyigt'
+        'pyigt',
+        'numpy',
     ],
     extras_require={
         'test': [
             'pytest-cldf',
         ],
+        'arrow': [
+            'pyarrow',
+        ],
     },
 )
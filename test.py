@@ -1,5 +1,820 @@
+import sys
+import json
+import subprocess
+
+import pytest
+
+from util import igt
+from util.timeindex import TimeIndex
+from util.corpus import DorecoCorpus
+from util.validate import Validator
+from util.diff import Diff
+from util.checkpoints import Checkpoints
+from dorecocommands.query import split_statements, Database
+
 
 def test_valid(cldf_dataset, cldf_logger):
     clts_ids = [r['CLTS_ID'] for r in cldf_dataset['ParameterTable']]
     assert len(set(clts_ids)) == len(clts_ids)
     assert cldf_dataset.validate(log=cldf_logger)
+    # The fast validator must not find any violations either - in particular of time alignment:
+    assert Validator(cldf_dataset.directory).validate() == []
+
+
+@pytest.mark.parametrize(
+    'text,type_,gc,expected',
+    [
+        (' a  ‎‎b ', 'tx', 'x', 'a b'),
+        ('â\x80\x9ca\tbâ\x80\x9d', 'ft', 'x', '“a b”'),
+        ('fr | en', 'ft', 'bain1259', 'en'),
+        ('fr | en', 'ft', 'x', 'fr | en'),
+        ('a b //', 'tx', 'beja1238', 'a b'),
+        ('a b //', 'ft', 'beja1238', 'a b //'),
+        ("'a  b'", 'ft', 'movi1243', 'a b'),
+        ("`a b'", 'ft', 'pnar1238', 'a b'),
+        ('EMPTY', 'ft', 'pnar1238', ''),
+    ]
+)
+def test_fix_text(text, type_, gc, expected):
+    assert igt.fix_text(text, type_, gc) == expected
+
+
+@pytest.mark.parametrize(
+    'morphemes,type_,expected',
+    [
+        (['a-b-c'], 'm', 'a–b–c'),
+        (['a-b-c'], 'g', 'a.b.c'),
+        (['a', 'b', '=c'], 'm', 'a-b=c'),
+        (['-a', '-', 'b', '='], 'g', 'a-b'),
+        (['a=', '-b'], 'm', 'a=b'),
+        (['a-' * 5000 + 'a'], 'g', '.'.join(5001 * 'a')),
+    ]
+)
+def test_combine_morphemes(morphemes, type_, expected):
+    assert igt.combine_morphemes(morphemes, type_) == expected
+
+
+def test_TimeIndex(tmp_path):
+    index = TimeIndex.from_rows({
+        'words': [('w2', 'f', 1.0, 2.0), ('w1', 'f', 0.0, 3.0), ('w3', 'g', 0.0, 1.0)],
+        'phones': [('p1', 'f', 1.0, 1.5), ('p2', 'f', 1.5, 2.0)],
+    })
+    index.save(tmp_path / 'index')
+    index = TimeIndex.load(tmp_path / 'index')
+    assert [r[0] for r in index.overlapping('f', 2.5, 4.0, level='words')] == ['w1']
+    assert [r[0] for r in index.overlapping('f', 1.5, 1.5)] == ['p2']
+    assert index.overlapping('x', 0, 1) == []
+    assert index.nearest_boundary('f', 1.6) == 1.5
+    with pytest.raises(ValueError):
+        index.overlapping('f', 0, 1, level='examples')
+
+
+def test_DorecoCorpus(tmp_path):
+    tmp_path.joinpath('words.csv').write_text(
+        'wd_ID,wd,Language_ID,File_ID,Speaker_ID,start,end,duration\n'
+        'w1,a,l1,f1,s1,0,1,1\n'
+        'w2,b,l2,,,1,2,1\n',
+        encoding='utf8')
+    tmp_path.joinpath('phones.csv').write_text(
+        'ph_ID,ph,IPA,u_ID,Token_Type,start,end,duration,wd_ID\n'
+        'p1,a,1,1,xsampa,0,0.5,0.5,w1\n'
+        'p2,<p:>,,,pause,0.5,1,0.5,w1\n'
+        'p3,a,1,2,xsampa,1,2,1,w2\n',
+        encoding='utf8')
+    phones = DorecoCorpus.from_cldf(tmp_path).phones
+    assert list(phones['wd']) == [0, 0, 1] and list(phones['u']) == [0, -1, 1]
+    rows = phones.filter(ph='a', Speaker_ID=None)
+    assert phones.strings('ph_ID', rows) == ['p3']
+    assert phones.aggregate('Language_ID', 'duration', sum) == {'l1': 1.0, 'l2': 1.0}
+
+
+def test_Validator(tmp_path):
+    tmp_path.joinpath('md.json').write_text(json.dumps({'tables': [
+        {'url': 'words.csv', 'tableSchema': {
+            'columns': [{'name': 'wd_ID'}, {'name': 'start', 'datatype': 'decimal'},
+                        {'name': 'end', 'datatype': 'decimal'}],
+            'primaryKey': ['wd_ID']}},
+        {'url': 'phones.csv', 'tableSchema': {
+            'columns': [{'name': 'ph_ID', 'required': True}, {'name': 'wd_ID'},
+                        {'name': 'Token_Type', 'datatype': {'base': 'string', 'format': 'xsampa|pause'}},
+                        {'name': 'start', 'datatype': 'decimal'},
+                        {'name': 'end', 'datatype': 'decimal'}],
+            'primaryKey': ['ph_ID'],
+            'foreignKeys': [{'columnReference': ['wd_ID'],
+                             'reference': {'resource': 'words.csv', 'columnReference': ['wd_ID']}}]}},
+    ]}), encoding='utf8')
+    tmp_path.joinpath('words.csv').write_text('wd_ID,start,end\nw1,0,1\nw2,1,2\n', encoding='utf8')
+    tmp_path.joinpath('phones.csv').write_text(
+        'ph_ID,wd_ID,Token_Type,start,end\n'
+        'p1,w1,xsampa,0,0.5\n'
+        'p2,w1,label,0.4,1\n'
+        'p3,w2,xsampa,1,2.5\n'
+        'p3,w3,pause,x,1\n',
+        encoding='utf8')
+    assert [v[:3] for v in Validator(tmp_path, metadata='md.json').validate(workers=1)] == [
+        ('phones.csv', 2, 'Token_Type'),
+        ('phones.csv', 2, 'start'),
+        ('phones.csv', 3, 'ph_ID'),
+        ('phones.csv', 3, 'wd_ID'),
+        ('phones.csv', 4, 'ph_ID'),
+        ('phones.csv', 4, 'start'),
+        ('phones.csv', 4, 'wd_ID'),
+    ]
+
+
+def test_Diff(tmp_path):
+    md = json.dumps({'tables': [
+        {'url': 'words.csv', 'tableSchema': {
+            'columns': [{'name': 'wd_ID'}, {'name': 'Language_ID'}, {'name': 'File_ID'},
+                        {'name': 'start'}],
+            'primaryKey': ['wd_ID']}},
+        {'url': 'phones.csv', 'tableSchema': {
+            'columns': [{'name': 'ph_ID'}, {'name': 'wd_ID'}, {'name': 'IPA'}],
+            'primaryKey': ['ph_ID']}},
+    ]})
+    for name, words, phones in [
+        ('old', 'w1,abcd1234,f1,0\nw2,abcd1234,f2,1\nw3,efgh1234,f3,0\n', 'p1,w1,a\np2,w2,b\n'),
+        ('new', 'w1,abcd1234,f1,0\nw2,abcd1234,f1,2\nw3,efgh1234,f3,0\n', 'p1,w1,a\np2,w2,b\np3,w2,c\n'),
+    ]:
+        d = tmp_path / name
+        d.mkdir()
+        d.joinpath('md.json').write_text(md, encoding='utf8')
+        d.joinpath('words.csv').write_text('wd_ID,Language_ID,File_ID,start\n' + words)
+        d.joinpath('phones.csv').write_text('ph_ID,wd_ID,IPA\n' + phones)
+    words, phones = Diff(tmp_path / 'old', tmp_path / 'new', metadata='md.json').diff()
+    assert words.counts == {'abcd1234': {'changed': 1}}
+    assert words.columns == {'File_ID': 1, 'start': 1}
+    # p2 moved to another file, with its word, but did not change:
+    assert phones.counts == {'abcd1234': {'added': 1}}
+    assert phones.samples == [('added', 'p3', None, None, None)]
+
+
+def test_Checkpoints(tmp_path):
+    raw = tmp_path / 'abcd1234_ph.csv'
+    raw.write_text('a,b\n', encoding='utf8')
+    cp = Checkpoints(tmp_path / 'cp')
+    cp.save('phones', 'abcd1234', cp.fingerprint(0, raw), dict(uid=5))
+    assert cp.load('phones', 'abcd1234', cp.fingerprint(0, raw)) is None  # Not resuming.
+
+    cp = Checkpoints(tmp_path / 'cp', resume=True)
+    assert cp.load('phones', 'abcd1234', cp.fingerprint(0, raw)) == dict(uid=5)
+    raw.write_text('a,b\n1,2\n', encoding='utf8')
+    assert cp.load('phones', 'abcd1234', cp.fingerprint(0, raw)) is None
+
+    assert Checkpoints(tmp_path / 'cp').load('phones', 'abcd1234', cp.fingerprint(0, raw)) is None
+    assert not list(tmp_path.joinpath('cp').iterdir())
+    cp.clear()
+    assert not tmp_path.joinpath('cp').exists()
+
+    # Only checkpoint files are removed from a directory passed by the user:
+    tmp_path.joinpath('data', 'sub').mkdir(parents=True)
+    tmp_path.joinpath('data', 'notes.txt').write_text('keep', encoding='utf8')
+    tmp_path.joinpath('data', 'my-data.pickle').write_text('keep', encoding='utf8')
+    cp = Checkpoints(tmp_path / 'data')
+    cp.save('words', 'abcd1234', 'x', [])
+    cp = Checkpoints(tmp_path / 'data')
+    assert not cp.path('words', 'abcd1234').exists()
+    cp.save('words', 'abcd1234', 'x', [])
+    cp.clear()
+    assert sorted(p.name for p in tmp_path.joinpath('data').iterdir()) == ['my-data.pickle', 'notes.txt', 'sub']
+
+
+def test_query_import_time():
+    # `dorecocommands.query` is run many times from scripts, so importing it must be cheap.
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import sys, dorecocommands.query; print(" ".join(sys.modules))'],
+        capture_output=True, text=True, check=True)
+    modules = set(res.stdout.split())
+    for heavy in [
+        'cldfbench', 'pyclts', 'pybtex', 'tqdm', 'requests', 'pyigt', 'clldutils.lgr', 'pydub',
+    ]:
+        assert heavy not in modules
+    cumulative = int(res.stderr.strip().splitlines()[-1].split('|')[1])
+    assert cumulative < 250000  # microseconds
+
+
+def test_cli_import():
+    # Building the `cldfbench` CLI imports all modules in `dorecocommands`, so these must not import
+    # heavy dependencies at module level either.
+    script = """
+import sys
+import cldfbench.commands
+from clldutils.clilib import get_parser_and_subparsers, register_subcommands
+
+parser, subparsers = get_parser_and_subparsers('cldfbench')
+register_subcommands(subparsers, cldfbench.commands)
+builtin = set(sys.modules)
+parser, subparsers = get_parser_and_subparsers('cldfbench')
+register_subcommands(subparsers, cldfbench.commands, entry_point='cldfbench.commands')
+assert parser.parse_args(['doreco.query', 'SELECT 1']).main.__module__ == 'dorecocommands.query'
+print(' '.join(sys.modules))
+print(' '.join(set(sys.modules) - builtin))
+"""
+    res = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    modules, added = [set(line.split()) for line in res.stdout.splitlines()]
+    assert {'dorecocommands.{}'.format(m) for m in ['query', 'kwic', 'shards', 'summary']} <= added
+    for heavy in [
+        'numpy', 'pyarrow', 'pydub', 'pyigt', 'util.wav', 'util.acoustics', 'util.arrays',
+        'util.diff', 'util.validate', 'util.shards', 'util.summary',
+    ]:
+        assert heavy not in modules
+    # `pycldf.db` is imported by cldfbench's own commands - but not by ours:
+    assert not {'pycldf.db', 'pyclts', 'pycldf'} & added
+
+
+def test_split_statements():
+    assert split_statements("-- x\nSELECT ';'; SELECT 2;\n/* c */ SELECT 3\n-- end\n") == [
+        "-- x\nSELECT ';';", 'SELECT 2;', '/* c */ SELECT 3\n-- end\n;']
+    assert split_statements('SELECT 1 -- count') == ['SELECT 1 -- count\n;']
+    assert split_statements('SELECT 1;\nSELECT 2\n-- note') == ['SELECT 1;', 'SELECT 2\n-- note\n;']
+    assert split_statements('SELECT 1; -- note') == ['SELECT 1;']
+
+
+def test_Database_explain(tmp_path):
+    import sqlite3
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute('CREATE TABLE `words.csv` (cldf_id TEXT PRIMARY KEY, cldf_languageReference TEXT)')
+    conn.execute('CREATE TABLE `phones.csv` (cldf_id TEXT PRIMARY KEY, wd_id TEXT, duration REAL)')
+    conn.execute("INSERT INTO `words.csv` VALUES ('w1', 'abcd1234')")
+    conn.execute("INSERT INTO `phones.csv` VALUES ('p1', 'w1', 0.1), ('p2', 'w1', 0.2)")
+    conn.commit()
+    conn.close()
+    sql = "SELECT w.cldf_languageReference AS lang, count(*) FROM `phones.csv` AS p " \
+          "JOIN `words.csv` AS w ON p.wd_id = w.cldf_id GROUP BY lang"
+    db = Database(db, slow_log=tmp_path / 'slow.log', slow_threshold=0)
+    plan = db.explain(sql)
+    assert any(flag == 'full scan of phones.csv' for _, _, flag in plan.steps)
+    assert plan.indexes == ['CREATE INDEX IF NOT EXISTS `phones_wd_id` ON `phones.csv`(wd_id);']
+    with db.connection() as conn:
+        res = db.execute(conn, sql, name='q', profile=True)
+        assert res.rows == [('abcd1234', 2)] and res.profile.rows == 1
+        conn.execute(plan.indexes[0])
+    assert not db.explain(sql).indexes
+    assert json.loads(tmp_path.joinpath('slow.log').read_text(encoding='utf8'))['name'] == 'q'
+
+
+def test_shards(tmp_path):
+    import sqlite3
+    from dorecocommands.shards import write_catalog
+
+    for gc in ['abcd1234', 'efgh1234']:
+        conn = sqlite3.connect(str(tmp_path / '{}.sqlite'.format(gc)))
+        conn.execute('CREATE TABLE ParameterTable (cldf_id TEXT PRIMARY KEY)')
+        conn.execute("INSERT INTO ParameterTable VALUES ('a')")
+        conn.execute('CREATE TABLE `phones.csv` (cldf_id TEXT PRIMARY KEY, duration REAL)')
+        conn.execute("INSERT INTO `phones.csv` VALUES (?, 0.1)", (gc,))
+        conn.execute('CREATE VIEW long_phones AS SELECT * FROM `phones.csv` WHERE duration > 0')
+        conn.commit()
+        conn.close()
+    write_catalog(tmp_path, ['ParameterTable'], tmp_path / 'abcd1234.sqlite')
+
+    db = Database.from_shards(tmp_path)
+    assert db.query('SELECT count(*) FROM ParameterTable') == [(1,)]
+    assert db.query('SELECT cldf_id FROM long_phones ORDER BY cldf_id') == [
+        ('abcd1234',), ('efgh1234',)]
+    assert [r.rows for r in db.run_batch([('q', 'SELECT count(*) FROM `phones.csv`')])] == [[(2,)]]
+    assert Database.from_shards(tmp_path, ['efgh1234']).query(
+        'SELECT cldf_id FROM `phones.csv`') == [('efgh1234',)]
+    with pytest.raises(ValueError):
+        Database.from_shards(tmp_path, ['abcd1234', 'xyzz1234']).query('SELECT 1')
+
+
+def test_summarize():
+    import sqlite3
+    import numpy as np
+    from dorecocommands.summary import SQL, summarize
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        'CREATE TABLE `words.csv` (cldf_id TEXT PRIMARY KEY, cldf_name TEXT, duration REAL, '
+        'cldf_languageReference TEXT, Speaker_ID TEXT, cldf_mediaReference TEXT)')
+    conn.execute('CREATE TABLE `phones.csv` '
+                 '(cldf_id TEXT PRIMARY KEY, cldf_name TEXT, Token_Type TEXT, wd_ID TEXT, duration REAL)')
+    conn.execute("INSERT INTO `words.csv` VALUES ('w1', 'a', 1.0, 'abcd1234', 's1', 'f1')")
+    conn.execute("INSERT INTO `words.csv` VALUES ('w2', '<<fp>>', 0.5, 'abcd1234', NULL, NULL)")
+    durations = np.random.default_rng(1).lognormal(-2.3, 0.4, 1000)
+    conn.executemany(
+        "INSERT INTO `phones.csv` VALUES (?, 'a', 'xsampa', 'w1', ?)",
+        [(str(i), d) for i, d in enumerate(durations)])
+
+    res = {key: row for key, *row in summarize(conn, SQL['phones']).rows()}
+    n, sum_, min_, max_, _, mean, sd, q05, q25, median, q75, q95 = \
+        res[('speaker', 's1', 'xsampa', '')]
+    assert n == 1000 and min_ == durations.min() and max_ == durations.max()
+    assert mean == pytest.approx(durations.mean()) and sd == pytest.approx(durations.std(ddof=1))
+    for q, est in zip([0.05, 0.25, 0.5, 0.75, 0.95], [q05, q25, median, q75, q95]):
+        assert est == pytest.approx(np.quantile(durations, q), rel=0.03)
+
+    res = {key: row for key, *row in summarize(conn, SQL['words'], ('<p:>',)).rows()}
+    assert res[('language', 'abcd1234', 'label', 'fp')][0] == 1
+    assert ('speaker', 's1', 'label', '') not in res
+
+
+def test_Database_fetch_arrays(tmp_path):
+    import sqlite3
+    import numpy as np
+    from dorecocommands.query import write_npz
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute('CREATE TABLE `phones.csv` (cldf_id TEXT PRIMARY KEY, duration REAL, pos INTEGER)')
+    conn.executemany(
+        "INSERT INTO `phones.csv` VALUES (?, ?, ?)",
+        [('p{}'.format(i), i / 10, i if i % 2 else None) for i in range(25)])
+    conn.commit()
+    conn.close()
+
+    res = Database(db).fetch_arrays(
+        'SELECT cldf_id, duration, pos, count(*) OVER () AS n FROM `phones.csv`', batch_size=10)
+    assert [(k, str(v.dtype), len(v)) for k, v in res.items()] == [
+        ('cldf_id', 'object', 25), ('duration', 'float64', 25), ('pos', 'float64', 25),
+        ('n', 'int64', 25)]
+    assert res['duration'][24] == 2.4 and res['pos'][1] == 1
+
+    write_npz(tmp_path / 'res.npz', res)
+    assert list(np.load(str(tmp_path / 'res.npz'))['cldf_id'][:2]) == ['p0', 'p1']
+
+
+def test_iter_utterances(tmp_path):
+    import sqlite3
+    from dorecocommands.audio import iter_utterances
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute('CREATE TABLE `words.csv` '
+                 '(cldf_id TEXT PRIMARY KEY, cldf_name TEXT, ipa TEXT, cldf_mediaReference TEXT)')
+    conn.execute('CREATE TABLE `phones.csv` '
+                 '(cldf_id TEXT PRIMARY KEY, u_id TEXT, wd_id TEXT, start REAL, end REAL)')
+    # Two overlapping utterances:
+    conn.executemany(
+        "INSERT INTO `words.csv` VALUES (?, ?, NULL, 'f')",
+        [('w1', 'a'), ('w2', 'b'), ('w3', 'c'), ('w4', 'd')])
+    conn.executemany(
+        "INSERT INTO `phones.csv` VALUES (?, ?, ?, ?, ?)",
+        [('p1', '1', 'w1', 0.0, 1.0), ('p2', '2', 'w3', 0.5, 1.5),
+         ('p3', '1', 'w2', 1.0, 2.0), ('p4', '2', 'w4', 1.5, 2.5)])
+    conn.commit()
+    conn.close()
+    res = [(uid, [w.ipa for w in words]) for uid, words in iter_utterances(Database(db), 'f')]
+    assert res == [('1', ['a', 'b']), ('2', ['c', 'd'])]
+
+
+def test_shards_union(tmp_path):
+    import sqlite3
+    from dorecocommands.shards import write_catalog
+
+    def write_shard(gc, duration=0.2):
+        if tmp_path.joinpath('{}.sqlite'.format(gc)).exists():
+            tmp_path.joinpath('{}.sqlite'.format(gc)).unlink()
+        conn = sqlite3.connect(str(tmp_path / '{}.sqlite'.format(gc)))
+        conn.execute('CREATE TABLE ParameterTable (cldf_id TEXT PRIMARY KEY)')
+        conn.execute("INSERT INTO ParameterTable VALUES ('a')")
+        conn.execute('CREATE TABLE `words.csv` (cldf_id TEXT PRIMARY KEY, cldf_name TEXT)')
+        conn.execute("INSERT INTO `words.csv` VALUES (?, 'x')", (gc,))
+        conn.execute(
+            'CREATE TABLE `phones.csv` (cldf_id TEXT PRIMARY KEY, wd_id TEXT, duration REAL)')
+        conn.execute('CREATE INDEX phones_wd_id ON `phones.csv` (wd_id)')
+        conn.execute(
+            "INSERT INTO `phones.csv` VALUES (?, ?, 0.1), (?, ?, ?)",
+            (gc, gc, gc + '_2', gc, duration))
+        conn.execute('CREATE VIEW long_phones AS SELECT * FROM `phones.csv` WHERE duration > 0.15')
+        conn.commit()
+        conn.close()
+
+    gcs = ['abcd{}'.format(1000 + i) for i in range(12)]
+    for gc in gcs:
+        write_shard(gc)
+    write_catalog(tmp_path, ['ParameterTable'], tmp_path / '{}.sqlite'.format(gcs[0]))
+
+    # More shards than SQLite can attach at once:
+    db = Database.from_shards(tmp_path)
+    assert sorted(r[0] for r in db.query('SELECT cldf_id FROM long_phones')) == \
+        ['{}_2'.format(gc) for gc in gcs]
+    assert db.query('SELECT * FROM ParameterTable') == [('a',)]
+    assert db.query('SELECT count(*) FROM `phones.csv`') == [(24,)]
+    assert db.query('SELECT cldf_id FROM `phones.csv` ORDER BY cldf_id DESC LIMIT 1') == \
+        [(gcs[-1] + '_2',)]
+    assert db.query('SELECT count(*) FROM `phones.csv` AS p JOIN `words.csv` AS w '
+                    'ON p.wd_id = w.cldf_id WHERE p.duration > 0.15') == [(12,)]
+    # Joins across corpora:
+    assert db.query('SELECT count(*) FROM `words.csv` AS w1 JOIN `words.csv` AS w2 '
+                    'ON w1.cldf_name = w2.cldf_name') == [(144,)]
+    assert len(db.fetch_arrays('SELECT duration FROM `phones.csv`', batch_size=5)['duration']) == 24
+    assert [r.rows for r in db.run_batch([('q', 'SELECT * FROM `phones.csv`')])][0][-1][0] == \
+        gcs[-1] + '_2'
+    assert Database.from_shards(tmp_path, gcs[:10]).query('SELECT count(*) FROM `phones.csv`') \
+        == [(20,)]
+    # The union is re-created when a shard changes:
+    write_shard(gcs[-1], duration=0.1)
+    assert db.query('SELECT count(*) FROM long_phones') == [(11,)]
+    assert len(list(tmp_path.glob('union-*.sqlite'))) == 1
+
+
+def test_Concordance_kwic(tmp_path):
+    import sqlite3
+    from dorecocommands.kwic import Concordance
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute(
+        'CREATE TABLE `words.csv` (cldf_id TEXT PRIMARY KEY, cldf_languageReference TEXT, '
+        'cldf_mediaReference TEXT, cldf_name TEXT, start REAL, end REAL)')
+    # Words separated by many silent pauses - and a word in another file:
+    words = []
+    for i, form in enumerate('a b c d e f g'.split()):
+        words.append(form)
+        words.extend(['<p:>'] * 6)
+    conn.executemany(
+        "INSERT INTO `words.csv` VALUES (?, 'abcd1234', 'f1', ?, ?, ?)",
+        [('w{:03d}'.format(i), form, i, i + 1) for i, form in enumerate(words)])
+    conn.execute("INSERT INTO `words.csv` VALUES ('x', 'abcd1234', 'f2', 'd', 0, 1)")
+    conn.commit()
+    conn.close()
+
+    conc = Concordance.from_db(Database(db))
+    res = list(conc.kwic(conc.positions(['d']), context=3))
+    assert [r[5:] for r in res] == [('a b c', 'd', 'e f g'), ('', 'd', '')]
+    assert list(conc.kwic(conc.positions(['b']), context=5))[0][5:] == ('a', 'b', 'c d e f g')
+    assert list(conc.kwic(conc.positions(['b']), context=1, skip=()))[0][5:] == \
+        ('<p:>', 'b', '<p:>')
+
+
+def test_Database_iter_record_batches(tmp_path):
+    import sqlite3
+    pa = pytest.importorskip('pyarrow')
+    from dorecocommands.query import write_arrow
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute('CREATE TABLE t (id TEXT, x INTEGER)')
+    conn.executemany(
+        "INSERT INTO t VALUES (?, ?)", [('r{}'.format(i), i if i < 15 else None) for i in range(25)])
+    conn.commit()
+    conn.close()
+    db = Database(db)
+    # `y` is inferred as integer from the first batch, but holds floats in later ones:
+    sql = 'SELECT id, x, CASE WHEN x < 10 THEN 1 ELSE 0.5 END AS y FROM t'
+    with db.connection() as conn:
+        batches = list(db.iter_record_batches(conn, sql, batch_size=10))
+        assert [str(b.schema.field('y').type) for b in batches] == ['int64', 'double', 'double']
+        assert batches[-1].column('x').null_count == 5
+        assert write_arrow(
+            tmp_path / 'res.arrow', db.iter_record_batches(conn, sql, batch_size=10)) == 25
+    table = pa.ipc.open_file(str(tmp_path / 'res.arrow')).read_all()
+    assert table.column('y').to_pylist() == [1.0] * 10 + [0.5] * 15
+    assert not list(tmp_path.glob('*.tmp*'))
+
+
+def test_Validator_foreign_keys(tmp_path):
+    tmp_path.joinpath('md.json').write_text(json.dumps({'tables': [
+        {'url': 'languages.csv', 'tableSchema': {
+            'columns': [{'name': 'ID'}, {'name': 'Glottocode'}], 'primaryKey': ['ID']}},
+        {'url': 'media.csv', 'tableSchema': {
+            'columns': [{'name': 'ID'}, {'name': 'Glottocode'}, {'name': 'Speakers', 'separator': ' '}],
+            'primaryKey': ['ID'],
+            'foreignKeys': [
+                # A foreign key to a column which is not the primary key:
+                {'columnReference': ['Glottocode'],
+                 'reference': {'resource': 'languages.csv', 'columnReference': ['Glottocode']}},
+                # A list-valued foreign key:
+                {'columnReference': ['Speakers'],
+                 'reference': {'resource': 'speakers.csv', 'columnReference': ['ID']}}]}},
+        {'url': 'speakers.csv', 'tableSchema': {'columns': [{'name': 'ID'}], 'primaryKey': ['ID']}},
+    ]}), encoding='utf8')
+    tmp_path.joinpath('languages.csv').write_text('ID,Glottocode\nl1,abcd1234\n', encoding='utf8')
+    tmp_path.joinpath('speakers.csv').write_text('ID\ns1\ns2\n', encoding='utf8')
+    tmp_path.joinpath('media.csv').write_text(
+        'ID,Glottocode,Speakers\n'
+        'f1,abcd1234,s1 s2\n'
+        'f2,l1,s1 s3 s4\n',
+        encoding='utf8')
+    assert [v[:4] for v in Validator(tmp_path, metadata='md.json').validate(workers=1)] == [
+        ('media.csv', 2, 'Glottocode', 'unresolved foreign key: l1'),
+        ('media.csv', 2, 'Speakers', 'unresolved foreign key: s1 s3 s4'),
+    ]
+
+
+def test_SearchIndex(tmp_path):
+    import sqlite3
+    from dorecocommands.search import SearchIndex
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute('CREATE TABLE ExampleTable (cldf_id TEXT PRIMARY KEY, '
+                 'cldf_languageReference TEXT, cldf_analyzedWord TEXT, cldf_gloss TEXT)')
+    conn.execute('CREATE TABLE `words.csv` (cldf_id TEXT PRIMARY KEY, '
+                 'cldf_languageReference TEXT, cldf_name TEXT, mb TEXT, gl TEXT)')
+    conn.execute('CREATE TABLE `glosses.csv` (cldf_id TEXT PRIMARY KEY, '
+                 'cldf_languageReference TEXT, cldf_name TEXT, Meaning TEXT)')
+    conn.executemany(
+        'INSERT INTO ExampleTable VALUES (?, ?, ?, ?)',
+        [('e1', 'aaaa1000', 'a-b c', '3SG.ERG-PL stem'), ('e2', 'bbbb1000', 'b', 'PLACE')])
+    conn.executemany(
+        'INSERT INTO `words.csv` VALUES (?, ?, ?, ?, ?)',
+        [('w1', 'aaaa1000', 'ab', 'a -b', 'stem -PL'),
+         ('w2', 'bbbb1000', 'b', 'b', 'PLACE'),
+         ('w3', 'aaaa1000', 'c', 'c', 'AAA'),
+         ('w4', 'aaaa1000', 'd', 'd', 'zzz')])
+    conn.execute("INSERT INTO `glosses.csv` VALUES ('g1', 'aaaa1000', 'PL', 'plural')")
+    conn.commit()
+    conn.close()
+
+    index = SearchIndex(Database(db))
+    index.update()
+    assert {(r[0], r[1], r[3]) for r in index.search('PL')} == {
+        ('ExampleTable', 'e1', 'gloss'), ('words.csv', 'w1', 'gloss'), ('glosses.csv', 'g1', 'gloss')}
+    assert [r[1] for r in index.search('ERG')] == ['e1']
+    assert index.search('ERG')[0][-1] == 'a-b c / 3SG.ERG-PL stem'
+    assert {r[1] for r in index.search('PL', prefix=True)} == {'e1', 'w1', 'g1', 'e2', 'w2'}
+    assert {r[1] for r in index.search('PL', prefix=True, language='bbbb1000')} == {'e2', 'w2'}
+    assert [r[1] for r in index.search('b', field='morpheme', source='words.csv')] == ['w1', 'w2']
+    assert len(index.search('b', limit=1)) == 1
+
+    # An edit which keeps length, minimum and maximum of the values is picked up, too:
+    conn = sqlite3.connect(str(db))
+    conn.execute("UPDATE `words.csv` SET gl = 'stem -DU' WHERE cldf_id = 'w1'")
+    conn.execute("DELETE FROM ExampleTable WHERE cldf_id = 'e2'")
+    conn.commit()
+    conn.close()
+    index.update()
+    assert [r[1] for r in index.search('DU', source='words.csv')] == ['w1']
+    assert [r[1] for r in index.search('PL', source='words.csv')] == []
+    assert [r[1] for r in index.search('PLACE')] == ['w2']
+
+
+def test_peak_pyramid(tmp_path, monkeypatch):
+    import wave
+    import numpy as np
+    from util import wav
+
+    samples = (np.sin(np.arange(1000) / 7) * 3000).astype('<i2')
+    with wave.open(str(tmp_path / 'test.wav'), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(100)
+        w.writeframes(samples.tobytes())
+    # Stream over the file in several blocks:
+    monkeypatch.setattr(wav, 'BLOCK_SIZE', 64)
+    pyramid = wav.peak_pyramid(wav.Wav(tmp_path / 'test.wav'), levels=(16, 4))
+    normalized = samples.astype(np.float32) / 2 ** 15
+    for level in [4, 16]:
+        assert np.allclose(pyramid[level], wav.peaks(normalized, level))
+    assert pyramid[16].shape == (63, 2)
+    assert np.isclose(pyramid[16][0, 1], normalized[:16].max())
+
+    with pytest.raises(AssertionError):
+        wav.peak_pyramid(wav.Wav(tmp_path / 'test.wav'), levels=(4, 6))
+
+
+def test_load_peaks(tmp_path):
+    import wave
+    import numpy as np
+    from util import wav
+
+    samples = np.zeros((1000, 2), dtype='<i2')
+    samples[:, 1] = 16000
+    with wave.open(str(tmp_path / 'test.wav'), 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(1000)
+        w.writeframes(samples.tobytes())
+    pk = wav.load_peaks(tmp_path / 'test.wav')
+    assert pk['channel'] == 1 and max(pk['levels'][0]['data']) == 0
+    assert wav.read_peaks(tmp_path / 'test.wav', channel=2) is None
+    # The sidecar is recomputed for another channel:
+    pk = wav.load_peaks(tmp_path / 'test.wav', channel=2)
+    assert pk['channel'] == 2 and max(pk['levels'][0]['data']) == 62
+    assert wav.read_peaks(tmp_path / 'test.wav', channel=2) == pk
+    assert wav.peak_slice(pk, 0, 0.5, min_pixels=1)[:2] == [0.488, 0.488]
+
+
+def test_best_lag():
+    import numpy as np
+    from util.acoustics import best_lag
+
+    reference = np.random.default_rng(1).normal(size=500)
+    signal = np.concatenate([np.zeros(7), reference[:-7]])
+    lag, corr = best_lag(signal, reference, 20)
+    assert lag == 7 and corr > 0.9
+    assert best_lag(reference, signal, 20)[0] == -7
+    # Lags beyond max_lag are not considered:
+    assert best_lag(signal, reference, 5)[1] < 0.5
+
+
+def test_count_ngrams():
+    import numpy as np
+    from dorecocommands.ngrams import count_ngrams
+
+    # Utterances "a b | c", "a b" and "a <pause> b", with code 3 for the pause:
+    codes = np.array([0, 1, 2, 0, 1, 0, 3, 1], dtype=np.int32)
+    langs = np.zeros(8, dtype=np.int32)
+    ok = np.array([True] * 6 + [False, True])
+    wb = np.array([True, False, True, True, False, True, True, True])
+    ub = np.array([True, False, False, True, False, True, False, False])
+
+    def counts(n):
+        res = {}
+        for context, lcodes, ngrams, cnts in count_ngrams(n, codes, langs, ok, wb, ub):
+            assert set(lcodes) == {0}
+            for ngram, c in zip(ngrams, cnts):
+                res[context, tuple(int(i) for i in ngram)] = int(c)
+        return res
+
+    assert counts(2) == {
+        ('word', (0, 1)): 2,
+        ('boundary', (1, 2)): 1,
+        ('initial', (0, 1)): 2,
+        ('final', (1, 2)): 1,
+        ('final', (0, 1)): 1,
+    }
+    assert counts(3) == {
+        ('boundary', (0, 1, 2)): 1,
+        ('initial', (0, 1, 2)): 1,
+        ('final', (0, 1, 2)): 1,
+    }
+    assert counts(9) == {}
+
+
+def test_Sampler(tmp_path):
+    import os
+    import sqlite3
+    from dorecocommands.sample import Sampler
+
+    db = tmp_path / 'db.sqlite'
+    conn = sqlite3.connect(str(db))
+    conn.execute(
+        'CREATE TABLE `words.csv` (cldf_id TEXT PRIMARY KEY, cldf_languageReference TEXT, '
+        'Speaker_ID TEXT, cldf_mediaReference TEXT, start REAL, end REAL)')
+    conn.executemany(
+        "INSERT INTO `words.csv` VALUES (?, ?, ?, 'f', ?, ?)",
+        [('w{}'.format(i), 'ab' if i % 3 else 'cd', 's{}'.format(i % 2), i, i + 1)
+         for i in range(300)])
+    conn.commit()
+    conn.close()
+
+    sampler = Sampler(Database(db))
+    sample = sampler.sample('words', by=['language', 'speaker'], size=10, seed=42)
+    assert len(sample) == 40
+    assert len(set(r[1] for r in sample)) == 40
+    assert sample == sampler.sample('words', by=['language', 'speaker'], size=10, seed=42)
+    assert sample != sampler.sample('words', by=['language', 'speaker'], size=10, seed=43)
+    for (lang, spk), wid, *_ in sample:
+        i = int(wid[1:])
+        assert lang == ('ab' if i % 3 else 'cd') and spk == 's{}'.format(i % 2)
+    # Samples for a stratum do not depend on which other strata are sampled:
+    assert sampler.sample('words', by=['language', 'speaker'], size=10, seed=42, language='cd') \
+        == [r for r in sample if r[0][0] == 'cd']
+    # Strata smaller than the sample size are sampled completely:
+    assert len(sampler.sample('words', by=['language'], size=150, seed=1)) == 250
+
+    # The index is re-created when the table changes:
+    conn = sqlite3.connect(str(db))
+    conn.execute("INSERT INTO `words.csv` VALUES ('x', 'ef', 's0', 'f', 0, 1)")
+    conn.commit()
+    conn.close()
+    assert sampler.sample('words', by=['language'], size=5, seed=1, language='ef')[0][1] == 'x'
+
+    # ... and when rows are updated in place:
+    conn = sqlite3.connect(str(db))
+    conn.execute("UPDATE `words.csv` SET Speaker_ID = 's9' WHERE cldf_id = 'w1'")
+    conn.commit()
+    conn.close()
+    # File timestamps may be coarser than the time between the writes:
+    st = db.stat()
+    os.utime(str(db), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert sampler.sample('words', by=['speaker'], size=5, seed=1, speaker='s9')[0][1] == 'w1'
+    assert json.loads((tmp_path / 'doreco.sample.json').read_text())['sources'] == ['words']
+
+    with pytest.raises(ValueError):
+        sampler.sample('words', by=['parameter'])
+
+
+def test_synthetic(tmp_path):
+    import csv
+    import wave
+    from benchmarks import synthetic
+
+    wavs = synthetic.generate(tmp_path / 'ds', scale=0.002, corpora=2, wavs=1)
+    raw = tmp_path / 'ds' / 'raw'
+    assert tmp_path.joinpath('ds', 'etc', 'orthography.tsv').exists()
+
+    def read(name):
+        with raw.joinpath(name).open(encoding='utf8') as f:
+            rows = list(csv.reader(f))
+        return rows[0], rows[1:]
+
+    header, rows = read('languages.csv')
+    assert header == synthetic.LANGUAGES_HEADER
+    assert [r[1] for r in rows] == ['synt1000', 'synt1001']
+    assert raw.joinpath('sources.bib').read_text(encoding='utf8').count('@misc') == 2
+    for gc in ['synt1000', 'synt1001']:
+        header, rows = read('{}_metadata.csv'.format(gc))
+        assert header == synthetic.METADATA_HEADER and len(rows) == 1
+        assert list(json.loads(raw.joinpath('{}_files.json'.format(gc)).read_text())) == \
+            [synthetic.file_id(gc, 0)]
+        header, rows = read('{}_gloss-abbreviations.csv'.format(gc))
+        assert len(rows) == len(synthetic.GLOSSES)
+
+        header, phones = read('{}_ph.csv'.format(gc))
+        assert header == synthetic.PH_HEADER
+        # Files are filled up with utterances of at most 8 words of 7 phones and a pause:
+        assert synthetic.PHONES_PER_FILE <= len(phones) < synthetic.PHONES_PER_FILE + 57
+        header, words = read('{}_wd.csv'.format(gc))
+        assert header == synthetic.WD_HEADER
+        assert [r[4] for r in words] == sorted({r[4] for r in phones}, key=lambda s: int(s[1:]))
+        assert all(len(r) == len(synthetic.WD_HEADER) for r in words)
+        # Words span their phones:
+        assert words[-1][7] == phones[-1][8]
+
+    # One WAV file of noise, a second longer than the annotations:
+    fid = synthetic.file_id('synt1000', 0)
+    assert list(wavs) == [fid]
+    with wave.open(str(wavs[fid])) as w:
+        assert (w.getnchannels(), w.getsampwidth(), w.getframerate()) == (1, 2, 16000)
+        duration = w.getnframes() / w.getframerate()
+    assert duration == pytest.approx(float(read('synt1000_ph.csv')[1][-1][8]) + 1, abs=0.001)
+
+    # The output is reproducible:
+    synthetic.generate(tmp_path / 'ds2', scale=0.002, corpora=2, wavs=0)
+    assert tmp_path.joinpath('ds2', 'raw', 'synt1001_ph.csv').read_bytes() == \
+        raw.joinpath('synt1001_ph.csv').read_bytes()
+
+
+def test_textgrid_intervals():
+    from dorecocommands.textgrid import intervals
+
+    rows = [('s', 1.0, 2.0, 'b'), ('s', 0.5, 1.0, 'a'), ('s', 1.5, 2.5, 'c'), ('s', 3.0, 4.0, None)]
+    # Gaps are filled with empty intervals, overlaps are clipped:
+    assert intervals(rows, 4, 5.0) == [
+        (0.0, 0.5, ''), (0.5, 1.0, 'a'), (1.0, 2.0, 'b'), (2.0, 2.5, 'c'), (2.5, 3.0, ''),
+        (3.0, 4.0, ''), (4.0, 5.0, '')]
+    # Intervals contained in preceding ones are dropped:
+    assert intervals([('s', 0.0, 2.0, 'a'), ('s', 0.5, 1.0, 'b')], 4, 2.0) == [(0.0, 2.0, 'a')]
+    # Intervals are clipped at xmax:
+    assert intervals([('s', 0.0, 1.0, 'a'), ('s', 1.0, 3.0, 'b'), ('s', 3.0, 4.0, 'c')], 4, 2.0) \
+        == [(0.0, 1.0, 'a'), (1.0, 2.0, 'b')]
+
+
+def test_textgrid_iter_files():
+    import sqlite3
+    from dorecocommands.textgrid import iter_files
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        'CREATE TABLE `words.csv` (cldf_id TEXT, cldf_mediaReference TEXT, Speaker_ID TEXT, '
+        'start REAL, end REAL, cldf_name TEXT, mb TEXT, gl TEXT)')
+    conn.execute('CREATE TABLE `phones.csv` (wd_id TEXT, start REAL, end REAL, cldf_name TEXT)')
+    conn.execute(
+        'CREATE TABLE `utterances.csv` (cldf_id TEXT, cldf_mediaReference TEXT, Speaker_ID TEXT, '
+        'start REAL, end REAL)')
+    conn.executemany('INSERT INTO `words.csv` VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+        ('w1', 'f2', 's', 0, 1, 'ab', 'a-b', 'x-PL'),
+        ('w2', 'f1', 's', 1, 2, 'c', 'c', 'y'),
+        ('w3', 'f1', 's', 0, 1, 'd', None, None),
+        ('w4', None, 's', 0, 1, 'e', None, None),
+    ])
+    conn.executemany('INSERT INTO `phones.csv` VALUES (?, ?, ?, ?)', [
+        ('w1', 0.5, 1, 'b'), ('w1', 0, 0.5, 'a'), ('w2', 1, 2, 'c'), ('w4', 0, 1, 'e')])
+    conn.executemany(
+        'INSERT INTO `utterances.csv` VALUES (?, ?, ?, ?, ?)',
+        [('u1', 'f1', 's', 0, 2), ('u2', 'f3', 's', 0, 1)])
+    res = list(iter_files(conn))
+    assert [fid for fid, _ in res] == ['f1', 'f2', 'f3']
+    assert res[0][1] == {
+        'phones': [('s', 1, 2, 'c')],
+        'words': [('s', 0, 1, 'd', None, None), ('s', 1, 2, 'c', 'c', 'y')],
+        'utterances': [('s', 0, 2, 'u1')]}
+    assert res[1][1]['phones'] == [('s', 0, 0.5, 'a'), ('s', 0.5, 1, 'b')]
+    assert res[1][1]['utterances'] == []
+    assert res[2][1] == {'phones': [], 'words': [], 'utterances': [('s', 0, 1, 'u2')]}
+
+
+def test_textgrid():
+    from dorecocommands.textgrid import textgrid, UNKNOWN_SPEAKER
+
+    data = {
+        'phones': [('s1', 0.0, 1.0, 'a'), (None, 1.0, 2.0, 'b')],
+        'words': [('s1', 0.0, 1.0, 'a', None, None), (None, 1.0, 2.0, 'b', None, None)],
+        'utterances': [('s1', 0.0, 1.0, 'u"1')],
+    }
+    tg = textgrid(data)
+    assert tg.startswith(
+        'File type = "ooTextFile"\nObject class = "TextGrid"\n\nxmin = 0\nxmax = 2.0\n')
+    assert 'size = 5\n' in tg
+    names = [line.split('=')[1].strip() for line in tg.split('\n') if 'name =' in line]
+    # No tiers for morphemes and glosses, rows without speaker are grouped as unknown speaker:
+    assert names == [
+        '"s1: utterances"', '"s1: words"', '"s1: phones"',
+        '"{}: words"'.format(UNKNOWN_SPEAKER), '"{}: phones"'.format(UNKNOWN_SPEAKER)]
+    assert 'text = "u""1"' in tg
+    assert tg.count('intervals: size = 2') == 5  # Each tier is filled up to xmax.
+
+    # The duration of the audio file determines xmax:
+    tg = textgrid(data, xmax=3.5)
+    # TextGrid, tiers and the empty intervals filling the tiers up to the end of the audio:
+    assert tg.count('xmax = 3.5') == 1 + 5 + 5
+    tg = textgrid(data, xmax=1.5)
+    assert 'xmax = 2.0' not in tg
@@ -0,0 +1,181 @@
+"""
+Vectorised acoustic measures for time-aligned intervals (e.g. phones) in a recording.
+
+All measures are computed for all intervals of a recording in batched array operations: Per-sample
+measures are aggregated over intervals via prefix sums, spectral measures are computed for short,
+overlapping analysis frames at once and then aggregated over the frames centered in an interval.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from util.wav import Wav
+
+FRAME_LENGTH = 0.032  # Length of analysis frames in seconds.
+FRAME_STEP = 0.010  # Hop size between analysis frames in seconds.
+F0_MIN, F0_MAX = 60, 500  # Search range for the F0 estimate in Hz.
+VOICING_THRESHOLD = 0.4  # Minimal normalized autocorrelation of a frame to count as voiced.
+# Maximal number of frames read into memory at once.
+BLOCK_SIZE = 2 ** 20
+FEATURES = ['rms', 'zcr', 'spectral_centroid', 'f0', 'voiced']
+
+
+def frames(samples: np.ndarray, length: int, step: int) -> np.ndarray:
+    """
+    View `samples` as (Hann-windowed) overlapping analysis frames, of shape (n, length).
+    """
+    if len(samples) < length:
+        samples = np.concatenate([samples, np.zeros(length - len(samples), dtype=samples.dtype)])
+    return sliding_window_view(samples, length)[::step] * np.hanning(length).astype(np.float32)
+
+
+def frame_features(frms: np.ndarray, rate: int) -> dict:
+    """
+    Compute power, spectral centroid and F0 estimate for each frame.
+    """
+    length = frms.shape[1]
+    nfft = 1 << (2 * length - 1).bit_length()  # Zero-padding to compute linear autocorrelation.
+    spec = np.abs(np.fft.rfft(frms, n=nfft, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(nfft, d=1 / rate)
+    power = spec.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroid = np.where(power > 0, (spec * freqs).sum(axis=1) / power, 0)
+    # Autocorrelation as inverse FFT of the power spectrum:
+    ac = np.fft.irfft(spec, n=nfft, axis=1)[:, :length]
+    lo, hi = int(rate / F0_MAX), min(int(rate / F0_MIN), length - 1)
+    lag = lo + np.argmax(ac[:, lo:hi + 1], axis=1)
+    rows = np.arange(len(ac))
+    y0, y1, y2 = ac[rows, lag - 1], ac[rows, lag], ac[rows, np.minimum(lag + 1, length - 1)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        strength = np.where(ac[:, 0] > 0, y1 / ac[:, 0], 0)
+        # Refine the lag by parabolic interpolation around the maximum:
+        shift = np.nan_to_num(0.5 * (y0 - y2) / (y0 - 2 * y1 + y2))
+    voiced = strength >= VOICING_THRESHOLD
+    f0 = np.where(voiced, rate / (lag + np.clip(shift, -0.5, 0.5)), 0)
+    return dict(power=power, centroid=centroid, f0=f0, voiced=voiced)
+
+
+def _interval_sums(cumsum: np.ndarray, s: np.ndarray, e: np.ndarray) -> np.ndarray:
+    """
+    Sums over intervals [s, e), given the prefix sums of an array (with a leading 0).
+    """
+    return cumsum[e] - cumsum[s]
+
+
+def _cumsum(a) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(a, dtype=np.float64)])
+
+
+def _iter_chunks(starts, ends, size):
+    """
+    Group intervals sorted by start into chunks, by the block of `size` frames they start in.
+    """
+    bins = starts // size
+    bounds = np.flatnonzero(np.diff(bins)) + 1
+    for i, j in zip(np.r_[0, bounds], np.r_[bounds, len(starts)]):
+        yield i, j, starts[i], ends[i:j].max()
+
+
+def interval_features(wav: Wav, starts, ends, channel: int = 1) -> dict:
+    """
+    Compute acoustic measures for intervals of a recording.
+
+    :param starts: Start times of the intervals in seconds.
+    :param ends: End times of the intervals in seconds.
+    :return: `dict` mapping the names in `FEATURES` to arrays aligned with `starts`:
+        - rms: root mean square amplitude (full scale = 1),
+        - zcr: zero crossings per second,
+        - spectral_centroid: power-weighted mean frequency of the frames centered in the interval,
+        - f0: mean F0 estimate (autocorrelation method) of voiced frames centered in the interval,
+          or NaN if there are none,
+        - voiced: fraction of frames centered in the interval which are voiced.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    order = np.argsort(starts, kind='stable')
+    fs = np.clip(np.round(starts[order] * wav.rate).astype(np.int64), 0, wav.nframes)
+    fe = np.clip(np.round(ends[order] * wav.rate).astype(np.int64), 0, wav.nframes)
+    fe = np.maximum(fe, fs)
+    length, step = int(FRAME_LENGTH * wav.rate), int(FRAME_STEP * wav.rate)
+    res = {k: np.full(len(order), np.nan) for k in FEATURES}
+    if not len(order):
+        return res
+
+    for i, j, a, b in _iter_chunks(fs, fe, BLOCK_SIZE):
+        s, e = fs[i:j], fe[i:j]
+        # Pad by half a frame on either side, so frames are centered around the first sample:
+        pa = max(a - length // 2, 0)
+        x = wav.read(channel=channel, start=pa / wav.rate, end=(b + length // 2) / wav.rate)
+        ls, le, n = s - a, e - a, np.maximum(e - s, 1)
+        y = x[a - pa:a - pa + (b - a)]
+
+        energy = _cumsum(y.astype(np.float64) ** 2)
+        res['rms'][order[i:j]] = np.sqrt(_interval_sums(energy, ls, le) / n)
+        crossings = _cumsum(np.signbit(y[1:]) != np.signbit(y[:-1]))
+        res['zcr'][order[i:j]] = \
+            _interval_sums(crossings, ls, np.maximum(le - 1, ls)) / (n / wav.rate)
+
+        ff = frame_features(frames(x, length, step), wav.rate)
+        centers = pa + np.arange(len(ff['power'])) * step + length // 2
+        fi = np.searchsorted(centers, s)
+        fj = np.maximum(np.searchsorted(centers, e), np.minimum(fi + 1, len(centers)))
+        fi = np.minimum(fi, fj - 1)  # Intervals shorter than a frame step get the nearest frame.
+        nf = np.maximum(fj - fi, 1)
+        power = _cumsum(ff['power'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            res['spectral_centroid'][order[i:j]] = \
+                _interval_sums(_cumsum(ff['power'] * ff['centroid']), fi, fj) / \
+                _interval_sums(power, fi, fj)
+            nvoiced = _interval_sums(_cumsum(ff['voiced']), fi, fj)
+            res['voiced'][order[i:j]] = nvoiced / nf
+            res['f0'][order[i:j]] = np.where(
+                nvoiced > 0, _interval_sums(_cumsum(ff['f0']), fi, fj) / nvoiced, np.nan)
+    return res
+
+
+def energy_envelope(wav: Wav, step: float = FRAME_STEP) -> np.ndarray:
+    """
+    Compute the energy (in dB full scale) of consecutive, non-overlapping frames of `step` seconds
+    for all channels of a recording, in one pass over the file.
+
+    :return: array of shape (n, channels).
+    """
+    hop = int(step * wav.rate)
+    res = []
+    for _, x in wav.iter_blocks(channel=None, size=(BLOCK_SIZE // hop) * hop):
+        m = -(-len(x) // hop)
+        if m * hop > len(x):
+            x = np.concatenate([x, np.zeros((m * hop - len(x), x.shape[1]), dtype=x.dtype)])
+        res.append((x.reshape(m, hop, -1).astype(np.float64) ** 2).mean(axis=1))
+    env = np.concatenate(res) if res else np.zeros((0, wav.channels))
+    return 10 * np.log10(env + 1e-10)
+
+
+def interval_means(values: np.ndarray, starts, ends, step: float = FRAME_STEP) -> np.ndarray:
+    """
+    Mean of frame-level `values` (as computed by `energy_envelope`) over intervals given in seconds.
+    Intervals shorter than a frame get the value of the frame they start in.
+    """
+    i = np.clip((np.asarray(starts) / step).astype(np.int64), 0, len(values) - 1)
+    j = np.clip(np.round(np.asarray(ends) / step).astype(np.int64), i + 1, len(values))
+    cs = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return (cs[j] - cs[i]) / (j - i).reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+def best_lag(signal: np.ndarray, reference: np.ndarray, max_lag: int):
+    """
+    Find the lag (in frames) at which `signal` correlates best with `reference`, using FFT-based
+    cross-correlation of the standardized series.
+
+    :return: pair (lag, correlation), where a positive lag means `signal` is delayed with respect \
+    to `reference`.
+    """
+    def standardized(a):
+        a = a - a.mean()
+        return a / (np.linalg.norm(a) or 1)
+
+    s, r = standardized(signal), standardized(reference)
+    n = 1 << (len(s) + len(r)).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(s, n) * np.conj(np.fft.rfft(r, n)), n)
+    lags = np.r_[np.arange(0, max_lag + 1), np.arange(-max_lag, 0)]
+    k = np.argmax(corr[lags])
+    return int(lags[k]), float(corr[lags[k]])
@@ -0,0 +1,25 @@
+"""
+Helpers to store string columns in compact `numpy` arrays, which can be saved with `numpy.save` and
+loaded (memory-mapped) without pickling.
+"""
+import numpy as np
+
+
+def pack(strings):
+    """
+    Pack a list of strings into a pair of arrays (UTF-8 bytes, offsets).
+    """
+    encoded = [s.encode('utf8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack(data, offsets, indices=None):
+    """
+    Unpack (selected) strings packed with `pack`.
+    """
+    if indices is None:
+        data = data.tobytes()
+        return [data[s:e].decode('utf8') for s, e in zip(offsets[:-1], offsets[1:])]
+    return [data[offsets[i]:offsets[i + 1]].tobytes().decode('utf8') for i in indices]
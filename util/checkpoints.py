@@ -0,0 +1,88 @@
+"""
+Checkpoints for the CLDF conversion.
+
+`Dataset.cmd_makecldf` processes the corpora one by one - first the phones, then the words and
+examples. The results of each completed stage of a corpus are pickled to a work directory, keyed by
+a fingerprint of the inputs of the stage (the raw files and - for phones - the utterance counter at
+the start of the corpus). When resuming after a failure, a stage of a corpus is only re-run if there
+is no checkpoint with matching fingerprint.
+"""
+import os
+import re
+import pickle
+import hashlib
+import pathlib
+
+__all__ = ['Checkpoints']
+
+# Names of checkpoint files - and of their temporary versions - as written by `Checkpoints.save`:
+FILENAME_PATTERN = re.compile(r'[a-z]+-[a-z0-9]{4}[0-9]{4}\.pickle(\.tmp)?')
+
+
+class Checkpoints:
+    def __init__(self, directory, resume=False):
+        """
+        :param resume: Flag signaling whether to re-use existing checkpoints - otherwise these are \
+        removed.
+        """
+        self.dir = pathlib.Path(directory)
+        self.resume = resume
+        if not resume:
+            self._remove()
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _remove(self):
+        """
+        Remove the checkpoint files - but nothing else - from the directory, which may be passed by
+        the user and thus contain other files.
+        """
+        if self.dir.exists():
+            for p in self.dir.iterdir():
+                if p.is_file() and FILENAME_PATTERN.fullmatch(p.name):
+                    p.unlink()
+
+    @staticmethod
+    def fingerprint(*items) -> str:
+        """
+        :param items: Paths of input files - hashed by content - or other values, hashed by `repr`.
+        """
+        h = hashlib.md5()
+        for item in items:
+            if isinstance(item, pathlib.Path):
+                h.update(item.name.encode('utf8'))
+                if item.exists():
+                    with item.open('rb') as f:
+                        for chunk in iter(lambda: f.read(2 ** 20), b''):
+                            h.update(chunk)
+            else:
+                h.update(repr(item).encode('utf8'))
+        return h.hexdigest()
+
+    def path(self, stage, corpus) -> pathlib.Path:
+        return self.dir / '{}-{}.pickle'.format(stage, corpus)
+
+    def load(self, stage, corpus, fingerprint):
+        """
+        :return: The checkpointed data or `None` if there is no valid checkpoint.
+        """
+        p = self.path(stage, corpus)
+        if self.resume and p.exists():
+            with p.open('rb') as f:
+                fp, data = pickle.load(f)
+            if fp == fingerprint:
+                return data
+        return None
+
+    def save(self, stage, corpus, fingerprint, data):
+        p = self.path(stage, corpus)
+        tmp = p.parent / '{}.tmp'.format(p.name)
+        with tmp.open('wb') as f:
+            pickle.dump((fingerprint, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(p)
+
+    def clear(self):
+        self._remove()
+        if self.dir.exists() and not any(self.dir.iterdir()):
+            self.dir.rmdir()
@@ -0,0 +1,306 @@
+"""
+Columnar access to the phones and words of the DoReCo CLDF dataset.
+
+Reading `phones.csv.zip` and `words.csv.zip` with `pycldf` results in millions of `dict`s, which
+takes minutes and gigabytes of memory. A `DorecoCorpus` holds the (analysis-relevant) columns of
+these tables as typed `numpy` arrays instead:
+- categorical columns like `ph`, `Token_Type`, `Language_ID` or `Speaker_ID` as integer codes into
+  a list of values,
+- `start`, `end` and `duration` as floats,
+- links from phones to words (`wd_ID`) and utterances (`u_ID`) as row offsets, in columns `wd` and
+  `u` (with the utterance IDs available as `phones.values('u_ID')`).
+
+Phones also get `Language_ID`, `Speaker_ID` and `File_ID` of their word, to make filtering and
+grouping phones by these straightforward:
+
+    >>> corpus = DorecoCorpus.load('cldf')
+    >>> phones = corpus.phones
+    >>> vowels = phones.filter(Token_Type='xsampa', ph=['a', 'e', 'i', 'o', 'u'])
+    >>> phones.aggregate('Language_ID', 'duration', rows=vowels)['teop1238']
+    0.0812
+
+The arrays are cached in a directory of `.npy` files next to the CLDF directory, keyed by a
+checksum of the CLDF metadata (and the zipped tables), and memory-mapped when loaded.
+"""
+import io
+import csv
+import json
+import typing
+import hashlib
+import pathlib
+import zipfile
+import collections
+
+import numpy as np
+
+from util.arrays import pack, unpack
+
+__all__ = ['DorecoCorpus', 'Table']
+
+# Columns per table and kind: "code" (categorical), "float" or "string" (stored packed).
+COLUMNS = {
+    'words': collections.OrderedDict([
+        ('wd_ID', 'string'),
+        ('wd', 'code'),
+        ('Language_ID', 'code'),
+        ('File_ID', 'code'),
+        ('Speaker_ID', 'code'),
+        ('start', 'float'),
+        ('end', 'float'),
+        ('duration', 'float'),
+        ('Example_ID', 'string'),
+    ]),
+    'phones': collections.OrderedDict([
+        ('ph_ID', 'string'),
+        ('ph', 'code'),
+        ('IPA', 'code'),
+        ('Token_Type', 'code'),
+        ('start', 'float'),
+        ('end', 'float'),
+        ('duration', 'float'),
+    ]),
+}
+# Codes of the word's language, speaker and file are copied to phones.
+PHONE_WORD_CODES = ['Language_ID', 'Speaker_ID', 'File_ID']
+
+
+def iter_csv(path: pathlib.Path):
+    """
+    Iterate over rows of a - possibly zipped - CSV file as `dict`s.
+    """
+    if not path.exists() and path.parent.joinpath(path.name + '.zip').exists():
+        with zipfile.ZipFile(str(path.parent.joinpath(path.name + '.zip'))) as zf:
+            with zf.open(path.name) as f:
+                yield from csv.DictReader(io.TextIOWrapper(f, encoding='utf8'))
+    else:
+        with path.open(encoding='utf8', newline='') as f:
+            yield from csv.DictReader(f)
+
+
+def checksum(cldf_dir: pathlib.Path) -> str:
+    """
+    Checksum of the CLDF metadata, combined with size and modification time of the phones and
+    words tables, which are not described by the metadata in a way which reflects data changes.
+    """
+    md5 = hashlib.md5(cldf_dir.joinpath('Generic-metadata.json').read_bytes())
+    for name in ['phones.csv', 'words.csv']:
+        for p in [cldf_dir / name, cldf_dir / (name + '.zip')]:
+            if p.exists():
+                md5.update('{}:{}:{}'.format(p.name, p.stat().st_size, p.stat().st_mtime_ns).encode())
+    return md5.hexdigest()
+
+
+class Table:
+    """
+    A table as mapping of column names to arrays of equal length.
+
+    For a categorical column `c`, `self[c]` holds integer codes (with `-1` for NULL) into
+    `self.values(c)`. For string columns, use `self.strings(c, rows)`.
+    """
+    def __init__(self, arrays: typing.Dict[str, np.ndarray], kinds: typing.Dict[str, str]):
+        self.arrays = arrays
+        self.kinds = kinds
+        self._values, self._codes = {}, {}
+
+    def __len__(self):
+        return len(self.arrays['start'])
+
+    def __getitem__(self, col) -> np.ndarray:
+        return self.arrays[col]
+
+    def __contains__(self, col):
+        return col in self.kinds
+
+    @property
+    def columns(self):
+        return list(self.kinds)
+
+    def values(self, col) -> typing.List[str]:
+        """
+        The values of a categorical column, indexed by code.
+        """
+        if col not in self._values:
+            self._values[col] = unpack(
+                self.arrays['{}.values_data'.format(col)], self.arrays['{}.values_offsets'.format(col)])
+            self._codes[col] = {v: i for i, v in enumerate(self._values[col])}
+        return self._values[col]
+
+    def code(self, col, value) -> typing.Optional[int]:
+        """
+        The code of `value` in a categorical column (or `None` if the value does not occur).
+        """
+        self.values(col)
+        return -1 if value is None else self._codes[col].get(value)
+
+    def strings(self, col, rows=None) -> typing.List[typing.Optional[str]]:
+        """
+        Values of a column as Python objects.
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        if self.kinds[col] == 'code':
+            values = self.values(col)
+            return [values[c] if c >= 0 else None for c in self.arrays[col][rows]]
+        if self.kinds[col] == 'string':
+            res = unpack(self.arrays['{}_data'.format(col)], self.arrays['{}_offsets'.format(col)], rows)
+            return [s or None for s in res]
+        return self.arrays[col][rows].tolist()
+
+    def filter(self, rows=None, **conditions) -> np.ndarray:
+        """
+        Indices of rows matching all conditions.
+
+        :param rows: Indices of rows to filter, e.g. the result of another call to `filter`.
+        :param conditions: Mapping of column names to a value, a list of values or a function \
+        which is called with the column array and must return a boolean array.
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        for col, cond in conditions.items():
+            values = self.arrays[col][rows]
+            if callable(cond):
+                mask = cond(values)
+            else:
+                conds = cond if isinstance(cond, (list, tuple, set)) else [cond]
+                if self.kinds.get(col) == 'code':
+                    conds = [c for c in (self.code(col, v) for v in conds) if c is not None]
+                mask = np.isin(values, list(conds))
+            rows = rows[mask]
+        return rows
+
+    def groupby(self, by, rows=None) -> typing.Dict[typing.Any, np.ndarray]:
+        """
+        Group (selected) rows by the values of one or more (categorical) columns.
+
+        :return: `dict` mapping group keys - values of `by` or tuples of values - to row indices.
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        if not len(rows):
+            return {}
+        cols = [by] if isinstance(by, str) else list(by)
+        keys = np.stack([self.arrays[c][rows] for c in cols], axis=1)
+        uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind='stable')
+        bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(uniq)))[:-1]
+        res = {}
+        for key, group in zip(uniq, np.split(rows[order], bounds)):
+            key = tuple(
+                (self.values(c)[k] if k >= 0 else None) if self.kinds.get(c) == 'code' else k.item()
+                for c, k in zip(cols, key))
+            res[key[0] if isinstance(by, str) else key] = group
+        return res
+
+    def aggregate(self, by, col, func=np.mean, rows=None) -> typing.Dict[typing.Any, typing.Any]:
+        """
+        Apply `func` to the values of `col` per group.
+
+            >>> phones.aggregate(['Language_ID', 'Token_Type'], 'duration', np.median)
+        """
+        values = self.arrays[col]
+        return {k: func(values[group]) for k, group in self.groupby(by, rows=rows).items()}
+
+
+class DorecoCorpus:
+    """
+    Phones and words of the DoReCo CLDF dataset as columnar `Table`s.
+    """
+    def __init__(self, tables: typing.Dict[str, Table]):
+        self.tables = tables
+        self.phones = tables['phones']
+        self.words = tables['words']
+
+    @classmethod
+    def from_cldf(cls, cldf_dir) -> 'DorecoCorpus':
+        """
+        Parse the (zipped) CSV files of the CLDF dataset.
+        """
+        cldf_dir = pathlib.Path(cldf_dir)
+        tables = {}
+        wids = {}
+        for name in ['words', 'phones']:
+            kinds = COLUMNS[name]
+            cols = {col: [] for col in kinds}
+            codes = {col: {} for col, kind in kinds.items() if kind == 'code'}
+            links = {'wd': [], 'u': []}
+            uids = {}
+            for i, row in enumerate(iter_csv(cldf_dir / '{}.csv'.format(name))):
+                for col, kind in kinds.items():
+                    v = row.get(col) or None
+                    if kind == 'code':
+                        v = -1 if v is None else codes[col].setdefault(v, len(codes[col]))
+                    elif kind == 'float':
+                        v = float(v) if v is not None else np.nan
+                    cols[col].append(v)
+                if name == 'words':
+                    wids[row['wd_ID']] = i
+                else:
+                    links['wd'].append(wids[row['wd_ID']])
+                    links['u'].append(uids.setdefault(row['u_ID'], len(uids)) if row['u_ID'] else -1)
+
+            arrays = {}
+            for col, kind in kinds.items():
+                if kind == 'code':
+                    arrays[col] = np.array(cols[col], dtype=np.int32)
+                    arrays['{}.values_data'.format(col)], arrays['{}.values_offsets'.format(col)] = \
+                        pack(list(codes[col]))
+                elif kind == 'float':
+                    arrays[col] = np.array(cols[col], dtype=np.float64)
+                else:
+                    arrays['{}_data'.format(col)], arrays['{}_offsets'.format(col)] = \
+                        pack([s or '' for s in cols[col]])
+            kinds = dict(kinds)
+            if name == 'phones':
+                words = tables['words']
+                arrays['wd'] = np.array(links['wd'], dtype=np.int64)
+                arrays['u'] = np.array(links['u'], dtype=np.int64)
+                arrays['u_ID.values_data'], arrays['u_ID.values_offsets'] = pack(list(uids))
+                kinds.update(wd='offset', u='offset')
+                for col in PHONE_WORD_CODES:
+                    arrays[col] = words[col][arrays['wd']]
+                    arrays['{}.values_data'.format(col)] = words['{}.values_data'.format(col)]
+                    arrays['{}.values_offsets'.format(col)] = words['{}.values_offsets'.format(col)]
+                    kinds[col] = 'code'
+            tables[name] = Table(arrays, kinds)
+        return cls(tables)
+
+    def save(self, path, checksum=None):
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if path.joinpath('corpus.json').exists():
+            path.joinpath('corpus.json').unlink()
+        for name, table in self.tables.items():
+            for key, array in table.arrays.items():
+                np.save(path / '{}.{}.npy'.format(name, key), np.ascontiguousarray(array))
+        # The manifest is written last, so an interrupted save does not leave a valid-looking cache.
+        path.joinpath('corpus.json').write_text(json.dumps(dict(
+            checksum=checksum,
+            tables={
+                name: dict(kinds=table.kinds, arrays=sorted(table.arrays))
+                for name, table in self.tables.items()},
+        )), encoding='utf8')
+
+    @classmethod
+    def load(cls, cldf_dir, cache_dir=None, mmap=True) -> 'DorecoCorpus':
+        """
+        Load the corpus from the cache, (re-)creating the cache if the CLDF data has changed.
+
+        :param cache_dir: Directory to store the cached arrays in, defaulting to `doreco.corpus` \
+        next to the CLDF directory.
+        """
+        cldf_dir = pathlib.Path(cldf_dir)
+        cache_dir = pathlib.Path(cache_dir or cldf_dir.parent / 'doreco.corpus')
+        md5 = checksum(cldf_dir)
+        manifest = cache_dir / 'corpus.json'
+        if manifest.exists():
+            md = json.loads(manifest.read_text(encoding='utf8'))
+            if md['checksum'] == md5:
+                return cls({
+                    name: Table(
+                        {
+                            key: np.load(
+                                cache_dir / '{}.{}.npy'.format(name, key),
+                                mmap_mode='r' if mmap else None)
+                            for key in spec['arrays']},
+                        spec['kinds'])
+                    for name, spec in md['tables'].items()})
+        res = cls.from_cldf(cldf_dir)
+        res.save(cache_dir, checksum=md5)
+        return res
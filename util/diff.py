@@ -0,0 +1,266 @@
+"""
+Fast diff of two builds of the DoReCo CLDF dataset.
+
+The rows of each table are hashed and grouped into partitions per corpus and file - phones are
+assigned to the partition of their word. Digests of the (sorted) row hashes per partition, of the
+partition digests per corpus and of the corpus digests per table form a Merkle tree: Comparing the
+digests top-down, unchanged tables, corpora and files are skipped without comparing their rows.
+To determine which columns changed, tables with changes are read again - hashing and comparing only
+the rows of changed partitions.
+
+    >>> for d in Diff('old/cldf', 'cldf').diff():
+    ...     print(d.table, d.counts['movi1243'], d.columns.most_common(1))
+    phones.csv Counter({'changed': 1520}) [('IPA', 1520)]
+"""
+import json
+import typing
+import hashlib
+import pathlib
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from util.corpus import iter_csv
+from util.validate import key_hash
+
+__all__ = ['Diff', 'TableDiff']
+
+# Columns with the corpus and the file of a row, per table. Other tables form one partition.
+PARTITIONS = {
+    'languages.csv': ('ID', None),
+    'contributions.csv': ('ID', None),
+    'media.csv': ('Glottocode', 'ID'),
+    'examples.csv': ('Language_ID', 'File_ID'),
+    'speakers.csv': ('Language_ID', None),
+    'utterances.csv': ('Language_ID', 'File_ID'),
+    'words.csv': ('Language_ID', 'File_ID'),
+    'glosses.csv': ('Glottocode', None),
+}
+# Tables partitioned like the rows they reference: phones like their word.
+PARTITIONS_VIA = {'phones.csv': ('wd_ID', 'words.csv')}
+SAMPLE_SIZE = 5
+
+
+def digest(*items) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for item in items:
+        h.update(item if isinstance(item, bytes) else str(item).encode('utf8'))
+        h.update(b'\x1f')
+    return h.hexdigest()
+
+
+class Partition(typing.NamedTuple):
+    keys: np.ndarray  # Sorted hashes of the primary keys.
+    rows: np.ndarray  # Hashes of the rows, in the same order.
+
+    @property
+    def digest(self) -> str:
+        return digest(self.keys.tobytes(), self.rows.tobytes())
+
+
+class TableHashes(typing.NamedTuple):
+    columns: typing.List[str]
+    pk: str
+    # Partitions keyed by (corpus, file):
+    partitions: typing.Dict[typing.Tuple[str, str], Partition]
+
+    def corpus_digests(self) -> typing.Dict[str, str]:
+        files = collections.defaultdict(list)
+        for (corpus, file), part in sorted(self.partitions.items()):
+            files[corpus].append(digest(file, part.digest))
+        return {corpus: digest(*digests) for corpus, digests in files.items()}
+
+    @property
+    def digest(self) -> str:
+        return digest(*sorted(self.corpus_digests().items()))
+
+
+def hash_table(path, columns, pk, partition_of) -> TableHashes:
+    parts = collections.defaultdict(lambda: ([], []))
+    for row in iter_csv(path):
+        keys, rows = parts[partition_of(row)]
+        keys.append(key_hash(row[pk]))
+        rows.append(key_hash('\x1f'.join(row.get(col) or '' for col in columns)))
+    partitions = {}
+    for part, (keys, rows) in parts.items():
+        keys, rows = np.array(keys, dtype=np.int64), np.array(rows, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        partitions[part] = Partition(keys[order], rows[order])
+    return TableHashes(columns, pk, partitions)
+
+
+def partitioner(url, pk, lookups, record=False) -> typing.Callable:
+    """
+    :param lookups: `dict` mapping tables referenced in `PARTITIONS_VIA` to `dict`s mapping IDs to \
+    partitions.
+    :param record: Flag signaling whether to record the partitions of rows in `lookups`.
+    :return: Function returning the partition (corpus, file) of a row of table `url`.
+    """
+    if url in PARTITIONS:
+        corpus, file = PARTITIONS[url]
+        lookup = lookups.get(url) if record else None
+
+        def partition_of(row):
+            part = (row[corpus], row[file] if file else '')
+            if lookup is not None:
+                lookup[row[pk]] = part
+            return part
+    elif url in PARTITIONS_VIA:
+        col, ref = PARTITIONS_VIA[url]
+
+        def partition_of(row):
+            return lookups[ref].get(row[col], ('', ''))
+    else:
+        def partition_of(row):
+            return ('', '')
+    return partition_of
+
+
+def hash_build(cldf_dir: pathlib.Path, schemas: dict) -> typing.Tuple[
+        typing.Dict[str, TableHashes], typing.Dict[str, typing.Dict[str, typing.Tuple[str, str]]]]:
+    """
+    Hash all tables of one build - tables partitioned via foreign keys last.
+
+    :return: Pair (`dict` of `TableHashes`, lookups of partitions of referenced rows).
+    """
+    res, lookups = {}, {ref: {} for _, ref in PARTITIONS_VIA.values()}
+    for url in sorted(schemas, key=lambda u: u in PARTITIONS_VIA):
+        schema = schemas[url]
+        columns = [c['name'] for c in schema['columns']]
+        pk = (schema.get('primaryKey') or [columns[0]])[0]
+        res[url] = hash_table(
+            cldf_dir / url, columns, pk, partitioner(url, pk, lookups, record=True))
+    return res, lookups
+
+
+class TableDiff(typing.NamedTuple):
+    table: str
+    # Numbers of added, removed and changed rows per corpus:
+    counts: typing.Dict[str, collections.Counter]
+    # Numbers of changed rows per column:
+    columns: collections.Counter
+    # Samples (status, ID, column, old value, new value):
+    samples: typing.List[typing.Tuple[str, str, typing.Optional[str], typing.Any, typing.Any]]
+
+
+class Diff:
+    def __init__(self, old, new, metadata='Generic-metadata.json', samples=SAMPLE_SIZE):
+        self.dirs = [pathlib.Path(old), pathlib.Path(new)]
+        self.schemas = [
+            collections.OrderedDict(
+                (t['url'], t['tableSchema'])
+                for t in json.loads(d.joinpath(metadata).read_text(encoding='utf8'))['tables'])
+            for d in self.dirs]
+        self.samples = samples
+        self.lookups = [{}, {}]
+
+    def diff(self) -> typing.List[TableDiff]:
+        """
+        :return: `list` of `TableDiff`s for the tables which changed.
+        """
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            (old, olookups), (new, nlookups) = executor.map(hash_build, self.dirs, self.schemas)
+        self.lookups = [olookups, nlookups]
+
+        res = []
+        for url in list(self.schemas[1]) + [u for u in self.schemas[0] if u not in new]:
+            o, n = old.get(url), new.get(url)
+            if o and n and o.digest == n.digest:
+                continue
+            changes = self.changed_keys(o, n)
+            if changes:
+                res.append(self.table_diff(url, o, n, changes))
+        return res
+
+    @staticmethod
+    def changed_keys(old, new) -> typing.Dict[str, typing.Dict[str, np.ndarray]]:
+        """
+        Compare the partitions of corpora and files with differing digests.
+
+        :return: `dict` mapping corpora to `dict`s of key hashes per status.
+        """
+        empty = Partition(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        oparts, nparts = (old.partitions if old else {}), (new.partitions if new else {})
+        ocorpora = old.corpus_digests() if old else {}
+        ncorpora = new.corpus_digests() if new else {}
+        res = collections.defaultdict(lambda: collections.defaultdict(list))
+        # Row hashes of rows which are not in the same partition in both builds:
+        hashes = [{}, {}]
+        for part in sorted(set(oparts) | set(nparts)):
+            if ocorpora.get(part[0]) == ncorpora.get(part[0]):
+                continue  # Unchanged corpus.
+            o, n = oparts.get(part, empty), nparts.get(part, empty)
+            if o.digest == n.digest:
+                continue  # Unchanged file.
+            for i, (p1, p2, status) in enumerate([(o, n, 'removed'), (n, o, 'added')]):
+                only = ~np.isin(p1.keys, p2.keys)
+                res[part[0]][status].append(p1.keys[only])
+                hashes[i].update(zip(p1.keys[only].tolist(), p1.rows[only].tolist()))
+            common, oi, ni = np.intersect1d(o.keys, n.keys, assume_unique=True, return_indices=True)
+            res[part[0]]['changed'].append(common[o.rows[oi] != n.rows[ni]])
+
+        # Rows moving between partitions show up as removed and added:
+        moved = set(hashes[0]) & set(hashes[1])
+        keys = {}
+        for corpus, statuses in res.items():
+            k = {status: np.concatenate(arrays) for status, arrays in statuses.items()}
+            if moved:
+                added = k['added'][np.isin(k['added'], list(moved))]
+                k['removed'] = k['removed'][~np.isin(k['removed'], list(moved))]
+                k['added'] = k['added'][~np.isin(k['added'], list(moved))]
+                k['changed'] = np.concatenate([k['changed'], np.array(
+                    [h for h in added.tolist() if hashes[0][h] != hashes[1][h]], dtype=np.int64)])
+            if any(len(v) for v in k.values()):
+                keys[corpus] = k
+        return keys
+
+    def table_diff(self, url, old, new, changes) -> TableDiff:
+        """
+        Re-read the table in both builds, to determine changed columns and collect samples. Only
+        rows in partitions with differing digests are hashed and compared.
+        """
+        counts = {
+            corpus: collections.Counter({s: len(v) for s, v in k.items() if len(v)})
+            for corpus, k in changes.items()}
+        wanted = {
+            status: set(np.concatenate([k[status] for k in changes.values()]).tolist())
+            for status in ['added', 'removed', 'changed']}
+        oparts, nparts = (old.partitions if old else {}), (new.partitions if new else {})
+        parts = {
+            part for part in set(oparts) | set(nparts)
+            if part not in oparts or part not in nparts
+            or oparts[part].digest != nparts[part].digest}
+        columns, samples = collections.Counter(), []
+        old_rows = {}
+        if old:
+            partition_of = partitioner(url, old.pk, self.lookups[0])
+            for row in iter_csv(self.dirs[0] / url):
+                if partition_of(row) not in parts:
+                    continue
+                h = key_hash(row[old.pk])
+                if h in wanted['changed']:
+                    old_rows[h] = row
+                elif h in wanted['removed'] and \
+                        sum(1 for s in samples if s[0] == 'removed') < self.samples:
+                    samples.append(('removed', row[old.pk], None, None, None))
+        if new:
+            partition_of = partitioner(url, new.pk, self.lookups[1])
+            csamples = collections.Counter()
+            for row in iter_csv(self.dirs[1] / url):
+                if partition_of(row) not in parts:
+                    continue
+                h = key_hash(row[new.pk])
+                if h in wanted['changed']:
+                    orow = old_rows.pop(h)
+                    for col in sorted(set(row) | set(orow), key=lambda c: c not in row):
+                        if row.get(col) != orow.get(col):
+                            columns[col] += 1
+                            if csamples[col] < self.samples:
+                                csamples[col] += 1
+                                samples.append(
+                                    ('changed', row[new.pk], col, orow.get(col), row.get(col)))
+                elif h in wanted['added'] and \
+                        sum(1 for s in samples if s[0] == 'added') < self.samples:
+                    samples.append(('added', row[new.pk], None, None, None))
+        return TableDiff(url, counts, columns, samples)
@@ -1,46 +1,100 @@
 import re
 import decimal
+import functools
 
 from pyigt.igt import NON_OVERT_ELEMENT
-from pyigt.lgrmorphemes import MORPHEME_SEPARATORS, split_morphemes
+from pyigt.lgrmorphemes import MORPHEME_SEPARATORS
 from pyigt import IGT
 
+# A hyphen between two non-hyphen characters:
+INNER_HYPHEN = re.compile(r'(?<=[^-])-(?=[^-])')
+SEPARATOR_RUN = re.compile(r'[-=]+')
+# Splitting with a capturing group keeps the separators, i.e. at odd positions of the result.
+MORPHEME_SPLIT = re.compile('({})'.format('|'.join(re.escape(c) for c in MORPHEME_SEPARATORS)))
+
 
 # bora: translations in spanish -> raw/languages.csv:Translation
 # even1259 : russian! not english, as claimed in languages.csv!
 # sout2856: "§ 014-002" prefixes (and infixes) for tx
 # apah: tx: "(\<+)(x+)(\>+)", e.g. "<<xxx>>" meaning what?
+# FIXME:
+# arap1274: leading "“", trailing "”"
+
+# Fixes applied to transcriptions (tx) and translations (ft), in order. Each fix is specified as
+# tuple (Glottocodes of the corpora it applies to or None for all, text types or None for all, name
+# of the fix, argument).
+TEXT_FIXES = [
+    (None, None, 'replace', {'â\x80\x9d': '”', 'â\x80\x9c': '“', '\u200e\u200e': ''}),
+    # bain1259: "french | english" translations, separated by pipe.
+    ({'bain1259'}, {'ft'}, 'after', '|'),
+    # beja1238: tx ends with / or //
+    ({'bain1259', 'anal1239', 'beja1238'}, {'tx'}, 'rstrip', '/'),
+    # movi: leading and trailing "'" for translation
+    # pnar: translations in `...'
+    (None, {'ft'}, 'unquote', [("'", "'"), ("`", "'")]),
+    # pnar: ft may be EMPTY
+    (None, {'ft'}, 'empty', {'EMPTY'}),
+]
+WHITESPACE = re.compile(r'\s+')
+
+
+def _replace(mapping):
+    pattern = re.compile('|'.join(re.escape(k) for k in mapping))
+    return lambda s: pattern.sub(lambda m: mapping[m.group(0)], s)
+
+
+def _after(sep):
+    return lambda s: s.partition(sep)[2].strip() if sep in s else s
+
+
+def _rstrip(char):
+    def fix(s):
+        while s.endswith(char):
+            s = s[:-1].strip()
+        return s
+    return fix
+
+
+def _unquote(quotes):
+    def fix(s):
+        for left, right in quotes:
+            if s.startswith(left) and s.endswith(right):
+                return s[len(left):-len(right)].strip()
+        return s
+    return fix
 
-def fix_text(s, type_, gc):
-    s = s.strip()
-    for m, repl in {'â\x80\x9d': '”', 'â\x80\x9c': '“', '\u200e\u200e': ''}.items():
-        s = s.replace(m, repl)
 
-    if gc == 'bain1259' and type_ == 'ft' and '|' in s:
-        # bain1259: "french | english" translations, separated by pipe.
-        french, _, s = s.partition('|')
+def _empty(values):
+    return lambda s: '' if s in values else s
+
+
+@functools.lru_cache(maxsize=None)
+def text_normalizer(gc, type_):
+    """
+    Compile the fixes in `TEXT_FIXES` applicable to texts of type `type_` in corpus `gc` into one
+    function.
+    """
+    factories = dict(replace=_replace, after=_after, rstrip=_rstrip, unquote=_unquote, empty=_empty)
+    fixes = [
+        factories[name](arg) for gcs, types, name, arg in TEXT_FIXES
+        if (gcs is None or gc in gcs) and (types is None or type_ in types)]
+
+    def normalize(s):
         s = s.strip()
+        for fix in fixes:
+            s = fix(s)
+        return WHITESPACE.sub(' ', s)
+    return normalize
 
-    if (gc == 'bain1259' or gc == 'anal1239' or gc == 'beja1238') and type_ == 'tx':
-        # beja1238: tx ends with / or //
-        while s.endswith('/'):
-            s = s[:-1].strip()
 
-    if type_ == 'ft':
-        # movi: leading and trailing "'" for translation
-        # pnar: translations in `...'  , ft may be EMPTY
-        if s.startswith("'") and s.endswith("'"):
-            s = s[1:-1].strip()
-        elif s.startswith("`") and s.endswith("'"):
-            s = s[1:-1].strip()
-        # FIXME:
-        # arap1274: leading "“", trailing "”"
-        if s == 'EMPTY':
-            s = ''
+@functools.lru_cache(maxsize=2 ** 16)
+def fix_text(s, type_, gc):
+    """
+    Normalize a transcription (`type_='tx'`) or translation (`type_='ft'`) of corpus `gc`.
 
-    # Normalize whitespace!
-    s = re.sub(r'\s+', ' ', s)
-    return s
+    Since the same text is repeated for each word of an utterance, results are memoized.
+    """
+    return text_normalizer(gc, type_)(s)
 
 
 def harmonize_separators(morphemes, glosses):
@@ -58,51 +112,61 @@ def harmonize_separators(morphemes, glosses):
     #
     nms, ngs = [], []
     for morpheme, gloss in zip(morphemes, glosses):
-        mparts = split_morphemes(morpheme)
-        gparts = split_morphemes(gloss)
-        if len(mparts) == len(gparts):
-            for i, sep in enumerate(mparts):
-                if i % 2 == 1:  # a separator! copy it over to the gloss parts
-                    gparts[i] = sep
-            morpheme = ''.join(mparts)
-            gloss = ''.join(gparts)
+        morpheme, gloss = _harmonize(morpheme, gloss)
         nms.append(morpheme)
         ngs.append(gloss)
     return nms, ngs
 
 
+@functools.lru_cache(maxsize=2 ** 16)
+def _harmonize(morpheme, gloss):
+    mparts = MORPHEME_SPLIT.split(morpheme)
+    gparts = MORPHEME_SPLIT.split(gloss)
+    if len(mparts) == len(gparts):
+        # Separators are at the odd positions. Copy them over to the gloss parts:
+        gparts[1::2] = mparts[1::2]
+        return ''.join(mparts), ''.join(gparts)
+    return morpheme, gloss
+
+
+@functools.lru_cache(maxsize=None)
+def _collapse_separators(run):
+    return run.replace('--', '-').replace('=-', '=').replace('==', '=')
+
+
 def combine_morphemes(morphemes, type_):
     """
     FIXME:
     goro1270
     tsoobu>-kwí>----dir=í
-    liquid.honey>---DemM>---place\LF
+    liquid.honey>---DemM>---place\\LF
 
-    \LF or \F to =LF, =F? or just remove the "="?
+    \\LF or \\F to =LF, =F? or just remove the "="?
     What to do with
     "~$A~","","v Attaches to any category"
     """
-    innerhyphen = re.compile(r'([^-]+)-([^-]+)')
-
-    def replace_innerhyphen(s, repl):
-        while innerhyphen.search(s):
-            s = ''.join(innerhyphen.sub(
-                lambda m: '{}{}{}'.format(m.groups()[0], repl, m.groups()[1]), s))
-        return s
-
-    word = ''
+    repl = '.' if type_ == 'g' else '–'
+    parts = []
     for morpheme in morphemes:
         if morpheme:
             # replace inner hyphens!
-            morpheme = replace_innerhyphen(morpheme, '.' if type_ == 'g' else '–')
-            if word and (not word[-1] in MORPHEME_SEPARATORS) and (not morpheme[0] in MORPHEME_SEPARATORS):
-                word += '-'
-            word += morpheme
-    while word and (word[-1] in MORPHEME_SEPARATORS):
-        word = word[:-1]
-    while word and word[0] in MORPHEME_SEPARATORS:
-        word = word[1:]
-    return word.replace('--', '-').replace('=-', '=').replace('==', '=')
+            morpheme = INNER_HYPHEN.sub(repl, morpheme)
+            if parts and (parts[-1][-1] not in MORPHEME_SEPARATORS) \
+                    and (morpheme[0] not in MORPHEME_SEPARATORS):
+                parts.append('-')
+            parts.append(morpheme)
+    word = ''.join(parts).strip(''.join(MORPHEME_SEPARATORS))
+    # Collapse sequences of separators, e.g. "--" to "-" or "=-" to "=". Since these replacements
+    # only involve "-" and "=", we can do them for each run of these characters separately.
+    return SEPARATOR_RUN.sub(lambda m: _collapse_separators(m.group()), word)
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def lgr_conformance(phrase, gloss):
+    """
+    Name of the LGR conformance level of the IGT with `phrase` and `gloss` (passed as tuples).
+    """
+    return IGT(phrase=list(phrase), gloss=list(gloss)).conformance.name
 
 
 def igt(rows, tx, ft, eids, fid):
@@ -137,18 +201,13 @@ def igt(rows, tx, ft, eids, fid):
     if any(mbs):
         if len(mbs) == len(gls):
             mbs, gls = harmonize_separators(mbs, gls)
-        igt = IGT(phrase=mbs, gloss=gls)
-        #if not igt.is_valid(strict=True):
-        #    inv += 1
-        #else:
-        #    valid += 1
         res = dict(
             ID=eid,
             Language_ID=gc,
             Primary_Text=tx,
             Analyzed_Word=[k if k else NON_OVERT_ELEMENT for k in mbs],
             Gloss=[k if k else NON_OVERT_ELEMENT for k in gls],
-            LGR_Conformance=igt.conformance.name,
+            LGR_Conformance=lgr_conformance(tuple(mbs), tuple(gls)),
             Translated_Text=ft,
             start=decimal.Decimal(rows[0]["start"]),
             end=decimal.Decimal(rows[-1]["end"]),
@@ -0,0 +1,86 @@
+"""
+Writing the CLDF data into one SQLite database per corpus, see `dorecocommands.shards`.
+"""
+import sqlite3
+import pathlib
+import contextlib
+import collections
+
+from pycldf.db import Database as CLDFDatabase
+
+# Columns linking rows of a table to a corpus. Tables not listed here or in LANGUAGE_VIA are shared.
+LANGUAGE_COLUMNS = {
+    'languages.csv': 'ID',
+    'contributions.csv': 'ID',
+    'media.csv': 'Glottocode',
+    'examples.csv': 'Language_ID',
+    'speakers.csv': 'Language_ID',
+    'utterances.csv': 'Language_ID',
+    'words.csv': 'Language_ID',
+    'glosses.csv': 'Glottocode',
+}
+# Tables linked to a corpus via a foreign key: phones via their word.
+LANGUAGE_VIA = {'phones.csv': ('wd_ID', 'words.csv')}
+
+
+class Sharder(CLDFDatabase):
+    """
+    Writes the rows of each corpus to a separate database, using the schema of `cldf createdb`.
+
+        >>> Sharder(Dataset().cldf_reader(), 'shards').write_from_tg()
+
+    The catalog listing the shards is written by `dorecocommands.shards.write_catalog`.
+    """
+    def __init__(self, dataset, out_dir, glottocodes=None, views=None):
+        """
+        :param views: SQL creating views, which is run in each shard.
+        """
+        super().__init__(dataset, fname=None)
+        self.out_dir = pathlib.Path(out_dir)
+        self.glottocodes = set(glottocodes or [])
+        self.views = views
+        self.written = []
+        self.shared = []
+
+    def write(self, _force=False, _exists_ok=False, **items):
+        """
+        Called from `write_from_tg` with the rows of all tables.
+        """
+        shards = collections.defaultdict(lambda: collections.defaultdict(list))
+        shared = {}
+        keys = {ref: {} for _, ref in LANGUAGE_VIA.values()}
+        # Tables linked via a foreign key come last, when the keys of the referenced tables are known.
+        for url in sorted(items, key=lambda u: u in LANGUAGE_VIA):
+            if url in LANGUAGE_COLUMNS:
+                col, lookup = LANGUAGE_COLUMNS[url], None
+            elif url in LANGUAGE_VIA:
+                col, ref = LANGUAGE_VIA[url]
+                lookup = keys[ref]
+            else:
+                shared[url] = items[url]
+                continue
+            pk = self.tg.tabledict[url].tableSchema.primaryKey[0]
+            for row in items[url]:
+                gc = lookup[row[col]] if lookup is not None else row[col]
+                if self.glottocodes and gc not in self.glottocodes:
+                    continue
+                shards[gc][url].append(row)
+                if url in keys:
+                    keys[url][row[pk]] = gc
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        for gc in sorted(shards):
+            # Write to a temporary file first, to not disturb readers of an existing shard.
+            path = self.out_dir / '{}.sqlite'.format(gc)
+            self.fname = path.parent / '{}.tmp'.format(path.name)
+            super().write(
+                _force=True, **{url: shared.get(url, shards[gc][url]) for url in items})
+            if self.views:
+                with contextlib.closing(sqlite3.connect(str(self.fname))) as conn:
+                    conn.executescript(self.views)
+            self.fname.replace(path)
+            self.written.append(path)
+        self.fname = None
+
+        # The names of the shared tables in the databases, to be copied into the catalog:
+        self.shared = [self.translate(url) for url in shared]
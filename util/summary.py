@@ -0,0 +1,92 @@
+"""
+Accumulators for summary statistics of durations per group, see `dorecocommands.summary`.
+
+Besides count, sum, sum of squares, minimum and maximum, a sketch of the distribution - a histogram
+with logarithmic bins - is kept per group, from which quantiles can be estimated with a relative
+error below 2%.
+"""
+import math
+
+import numpy as np
+
+QUANTILES = [('q05', 0.05), ('q25', 0.25), ('median', 0.5), ('q75', 0.75), ('q95', 0.95)]
+# Durations below MIN_DURATION go into bin 0, other durations d into bin
+# 1 + floor(log(d / MIN_DURATION, GAMMA)), i.e. relative accuracy is (GAMMA - 1) / (GAMMA + 1).
+MIN_DURATION = 0.001
+GAMMA = 1.04
+NBINS = 2 + int(math.log(3600 / MIN_DURATION, GAMMA))
+
+
+class Summary:
+    """
+    Accumulators of durations per group.
+
+        >>> s = Summary()
+        >>> s.add([('a',), ('a',), ('b',)], np.array([0.1, 0.3, 0.2]))
+        >>> s.rows()[0][:4]
+        (('a',), 2, 0.4, 0.1)
+    """
+    def __init__(self):
+        self.groups = {}
+        self.n = np.zeros(0, dtype=np.int64)
+        self.sum = np.zeros(0, dtype=np.float64)
+        self.sum_squares = np.zeros(0, dtype=np.float64)
+        self.min = np.zeros(0, dtype=np.float64)
+        self.max = np.zeros(0, dtype=np.float64)
+        self.sketch = np.zeros((0, NBINS), dtype=np.int64)
+
+    def _grow(self):
+        k = len(self.groups) - len(self.n)
+        if k > 0:
+            self.n = np.concatenate([self.n, np.zeros(k, dtype=np.int64)])
+            self.sum = np.concatenate([self.sum, np.zeros(k)])
+            self.sum_squares = np.concatenate([self.sum_squares, np.zeros(k)])
+            self.min = np.concatenate([self.min, np.full(k, np.inf)])
+            self.max = np.concatenate([self.max, np.full(k, -np.inf)])
+            self.sketch = np.concatenate([self.sketch, np.zeros((k, NBINS), dtype=np.int64)])
+
+    @staticmethod
+    def bins(durations: np.ndarray) -> np.ndarray:
+        res = np.zeros(len(durations), dtype=np.int64)
+        ok = durations >= MIN_DURATION
+        res[ok] = 1 + np.floor(np.log(durations[ok] / MIN_DURATION) / math.log(GAMMA))
+        return np.minimum(res, NBINS - 1)
+
+    def add(self, keys: list, durations: np.ndarray):
+        """
+        :param keys: Group keys - one per duration.
+        """
+        codes = np.array([self.groups.setdefault(k, len(self.groups)) for k in keys], dtype=np.int64)
+        self._grow()
+        n = len(self.groups)
+        self.n += np.bincount(codes, minlength=n)
+        self.sum += np.bincount(codes, weights=durations, minlength=n)
+        self.sum_squares += np.bincount(codes, weights=durations ** 2, minlength=n)
+        np.minimum.at(self.min, codes, durations)
+        np.maximum.at(self.max, codes, durations)
+        np.add.at(self.sketch, (codes, self.bins(durations)), 1)
+
+    def quantiles(self, q: float) -> np.ndarray:
+        """
+        Estimate the `q`-quantile for each group from the sketches.
+        """
+        rank = np.floor(q * (self.n - 1))
+        idx = np.argmax(np.cumsum(self.sketch, axis=1) > rank[:, None], axis=1)
+        # The middle of the bin:
+        res = MIN_DURATION * GAMMA ** (idx - 1) * (1 + GAMMA) / 2
+        res[idx == 0] = 0
+        return np.clip(res, self.min, self.max)
+
+    def rows(self) -> list:
+        """
+        :return: `list` of tuples (key, n, sum, min, max, sum_squares, mean, sd, *quantiles).
+        """
+        mean = self.sum / self.n
+        var = (self.sum_squares - self.sum * mean) / np.maximum(self.n - 1, 1)
+        sd = np.where(self.n > 1, np.sqrt(np.maximum(var, 0)), np.nan)
+        qs = [self.quantiles(q) for _, q in QUANTILES]
+        return [
+            (key, int(self.n[i]), float(self.sum[i]), float(self.min[i]), float(self.max[i]),
+             float(self.sum_squares[i]), float(mean[i]), None if np.isnan(sd[i]) else float(sd[i]))
+            + tuple(round(float(q[i]), 4) for q in qs)
+            for key, i in self.groups.items()]
@@ -0,0 +1,203 @@
+"""
+Time-range lookups of phones, words and examples per audio file.
+
+Phones carry no File_ID, so finding the phones which overlap seconds X-Y of a file requires a range
+scan over `phones.csv` joined to `words.csv` in SQL. A `TimeIndex` stores start and end times of
+phones, words and examples sorted per File_ID in `numpy` arrays, and answers overlap and
+nearest-boundary queries with binary search:
+
+    >>> index = TimeIndex.cached(Database('doreco.sqlite'))
+    >>> index.overlapping('doreco_teop1238_Mat_01', 10.0, 10.5, level='words')
+    [('teop1238_w123', 9.85, 10.12), ('teop1238_w124', 10.12, 10.61)]
+    >>> index.nearest_boundary('doreco_teop1238_Mat_01', 10.3, level='phones')
+    10.29
+
+The index is saved as a directory of `.npy` files, which are memory-mapped when loaded.
+"""
+import json
+import typing
+import pathlib
+
+import numpy as np
+
+from util.arrays import pack, unpack
+
+SQL = {
+    'phones': """
+SELECT
+    p.cldf_id, w.cldf_mediaReference, p.start, p.end
+FROM
+    `phones.csv` AS p,
+    `words.csv` AS w
+WHERE
+    p.wd_id = w.cldf_id AND w.cldf_mediaReference IS NOT NULL""",
+    'words': """
+SELECT
+    cldf_id, cldf_mediaReference, start, end
+FROM
+    `words.csv`
+WHERE
+    cldf_mediaReference IS NOT NULL""",
+    'examples': """
+SELECT
+    cldf_id, cldf_mediaReference, start, end
+FROM
+    ExampleTable
+WHERE
+    cldf_mediaReference IS NOT NULL""",
+}
+LEVELS = list(SQL)
+
+
+class TimeIndex:
+    """
+    Intervals per level and file, sorted by file and start time.
+
+    For each level, the arrays are
+    - `<level>_start`, `<level>_end`: Interval boundaries.
+    - `<level>_maxend`: Running maximum of `end` within each file. Since intervals may overlap (e.g.
+      words of different speakers), this - rather than `end` - is what we can search for the first
+      interval which may overlap a time range.
+    - `<level>_files`: Intervals of file `i` are at `files[i]:files[i + 1]`.
+    - `<level>_bounds`, `<level>_bounds_files`: Sorted, unique boundaries per file.
+    - `<level>_id_data`, `<level>_id_offsets`: The IDs of the intervals, see `util.arrays.pack`.
+    """
+    def __init__(self, arrays: typing.Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.files = unpack(arrays['file_data'], arrays['file_offsets'])
+        self.codes = {fid: i for i, fid in enumerate(self.files)}
+
+    @classmethod
+    def from_rows(cls, rows: typing.Dict[str, typing.Iterable[tuple]]) -> 'TimeIndex':
+        """
+        :param rows: Mapping of level to iterable of tuples (ID, File_ID, start, end).
+        """
+        rows = {level: list(r) for level, r in rows.items()}
+        files = sorted({r[1] for level in rows.values() for r in level})
+        codes = {fid: i for i, fid in enumerate(files)}
+        arrays = {}
+        arrays['file_data'], arrays['file_offsets'] = pack(files)
+        for level, items in rows.items():
+            items.sort(key=lambda r: (codes[r[1]], float(r[2]), float(r[3]), r[0]))
+            file = np.array([codes[r[1]] for r in items], dtype=np.int64)
+            start = np.array([float(r[2]) for r in items], dtype=np.float64)
+            end = np.array([float(r[3]) for r in items], dtype=np.float64)
+            offsets = np.searchsorted(file, np.arange(len(files) + 1))
+            maxend = end.copy()
+            bounds, bounds_files = [], [0]
+            for i in range(len(files)):
+                s, e = offsets[i], offsets[i + 1]
+                np.maximum.accumulate(maxend[s:e], out=maxend[s:e])
+                bounds.append(np.unique(np.concatenate([start[s:e], end[s:e]])))
+                bounds_files.append(bounds_files[-1] + len(bounds[-1]))
+            arrays['{}_start'.format(level)] = start
+            arrays['{}_end'.format(level)] = end
+            arrays['{}_maxend'.format(level)] = maxend
+            arrays['{}_files'.format(level)] = offsets.astype(np.int64)
+            arrays['{}_bounds'.format(level)] = \
+                np.concatenate(bounds) if bounds else np.zeros(0, dtype=np.float64)
+            arrays['{}_bounds_files'.format(level)] = np.array(bounds_files, dtype=np.int64)
+            arrays['{0}_id_data'.format(level)], arrays['{0}_id_offsets'.format(level)] = \
+                pack([r[0] for r in items])
+        return cls(arrays)
+
+    @classmethod
+    def from_db(cls, db, levels=None) -> 'TimeIndex':
+        """
+        :param db: `dorecocommands.query.Database` instance.
+        """
+        with db.connection() as conn:
+            return cls.from_rows(
+                {level: conn.execute(SQL[level]).fetchall() for level in levels or LEVELS})
+
+    def save(self, path, fingerprint=None):
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if path.joinpath('index.json').exists():
+            path.joinpath('index.json').unlink()
+        for name, array in self.arrays.items():
+            np.save(path / '{}.npy'.format(name), np.ascontiguousarray(array))
+        # The manifest is written last, so an interrupted save does not leave a valid-looking index.
+        path.joinpath('index.json').write_text(
+            json.dumps(dict(arrays=sorted(self.arrays), fingerprint=fingerprint)), encoding='utf8')
+
+    @classmethod
+    def load(cls, path, mmap=True) -> 'TimeIndex':
+        path = pathlib.Path(path)
+        md = json.loads(path.joinpath('index.json').read_text(encoding='utf8'))
+        return cls({
+            name: np.load(path / '{}.npy'.format(name), mmap_mode='r' if mmap else None)
+            for name in md['arrays']})
+
+    @classmethod
+    def cached(cls, db, path=None) -> 'TimeIndex':
+        """
+        Load the index from `path` (defaulting to `doreco.timeindex` next to the database),
+        rebuilding it if the database has changed.
+        """
+        dbpath = pathlib.Path(db.fname)
+        path = pathlib.Path(path or dbpath.parent / 'doreco.timeindex')
+        fingerprint = [dbpath.stat().st_size, dbpath.stat().st_mtime_ns]
+        manifest = path / 'index.json'
+        if manifest.exists() and \
+                json.loads(manifest.read_text(encoding='utf8'))['fingerprint'] == fingerprint:
+            return cls.load(path)
+        res = cls.from_db(db)
+        res.save(path, fingerprint=fingerprint)
+        return res
+
+    def _slice(self, level, fid):
+        if '{}_start'.format(level) not in self.arrays:
+            raise ValueError('Unknown level: {}'.format(level))
+        code = self.codes.get(fid)
+        if code is None:
+            return 0, 0
+        offsets = self.arrays['{}_files'.format(level)]
+        return int(offsets[code]), int(offsets[code + 1])
+
+    def indices(self, fid, start, end, level='phones') -> np.ndarray:
+        """
+        Positions of the intervals of `level` in file `fid` which overlap [start, end].
+
+        Intervals overlap the range if they start before its end and end after its start. Thus,
+        for `start == end`, the intervals containing the time point are returned.
+        """
+        lo, hi = self._slice(level, fid)
+        starts = self.arrays['{}_start'.format(level)][lo:hi]
+        # Intervals before `first` end at or before `start`:
+        first = np.searchsorted(self.arrays['{}_maxend'.format(level)][lo:hi], start, side='right')
+        # Intervals from `last` on start at or after `end` (or after the time point `end`):
+        last = np.searchsorted(starts, end, side='right' if start == end else 'left')
+        candidates = np.arange(first, max(first, last))
+        return candidates[self.arrays['{}_end'.format(level)][lo:hi][candidates] > start] + lo
+
+    def overlapping(self, fid, start, end, level='phones') -> typing.List[tuple]:
+        """
+        :return: `list` of tuples (ID, start, end) of the intervals of `level` in file `fid` which \
+        overlap [start, end], ordered by start time.
+        """
+        idx = self.indices(fid, start, end, level=level)
+        return list(zip(
+            unpack(
+                self.arrays['{}_id_data'.format(level)],
+                self.arrays['{}_id_offsets'.format(level)],
+                idx),
+            self.arrays['{}_start'.format(level)][idx].tolist(),
+            self.arrays['{}_end'.format(level)][idx].tolist()))
+
+    def nearest_boundary(self, fid, t, level='phones') -> typing.Optional[float]:
+        """
+        The start or end time of an interval of `level` in file `fid` closest to `t`, e.g. to snap
+        a selection to phone boundaries.
+        """
+        self._slice(level, fid)
+        code = self.codes.get(fid)
+        if code is None:
+            return None
+        offsets = self.arrays['{}_bounds_files'.format(level)]
+        bounds = self.arrays['{}_bounds'.format(level)][offsets[code]:offsets[code + 1]]
+        if not len(bounds):
+            return None
+        i = np.searchsorted(bounds, t)
+        candidates = bounds[max(i - 1, 0):i + 1]
+        return float(candidates[np.argmin(np.abs(candidates - t))])
@@ -0,0 +1,288 @@
+"""
+Fast validation of the DoReCo CLDF dataset.
+
+`pycldf.Dataset.validate` reads every row of the big tables into `dict`s of typed values, which is
+the slowest part of a release. Here, each table is streamed once - in parallel, one process per
+table - and checked against the schema in the metadata:
+- required values, datatypes (integers, decimals with minimum and maximum, booleans) and `format`
+  regexes of string columns (values which passed are memoized per column),
+- uniqueness of primary keys and resolvability of foreign keys, compared as arrays of 64-bit
+  hashes of the key values,
+- interval invariants: `start <= end` for all rows, and phones in non-overlapping, increasing
+  order within their word and within the word's time bounds.
+
+    >>> for v in Validator('cldf').validate():
+    ...     print(v)
+    Violation(table='phones.csv', row=17, column='wd_ID', message='unresolved foreign key: x')
+"""
+import re
+import json
+import typing
+import decimal
+import hashlib
+import pathlib
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from util.corpus import iter_csv
+
+__all__ = ['Validator', 'Violation']
+
+NUMERIC = {'decimal', 'float', 'double', 'number', 'integer'}
+BOOLEAN = {'true', 'false', 'True', 'False', '1', '0'}
+# Tables of intervals with a foreign key to the table of intervals they must be contained in.
+CONTAINED = {'phones.csv': ('wd_ID', 'words.csv')}
+# Maximal number of valid values memoized per column.
+MEMO_SIZE = 100000
+
+
+class Violation(typing.NamedTuple):
+    table: str
+    row: int  # 1-based number of the data row, i.e. excluding the header.
+    column: typing.Optional[str]
+    message: str
+
+
+def key_hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode('utf8'), digest_size=8).digest(), 'little', signed=True)
+
+
+class Column:
+    def __init__(self, spec):
+        self.name = spec['name']
+        dt = spec.get('datatype') or 'string'
+        dt = {'base': dt} if isinstance(dt, str) else dt
+        self.base = dt.get('base', 'string')
+        self.required = spec.get('required', False)
+        self.separator = spec.get('separator')
+        self.null = set(spec.get('null', ['']))
+        self.minimum = decimal.Decimal(dt['minimum']) if 'minimum' in dt else None
+        self.maximum = decimal.Decimal(dt['maximum']) if 'maximum' in dt else None
+        self.format, self.booleans = None, BOOLEAN
+        if dt.get('format'):
+            if self.base == 'boolean':
+                self.booleans = set(dt['format'].split('|'))
+            elif self.base not in NUMERIC:
+                self.format = re.compile(dt['format'])
+        self.valid = set()
+
+    def values(self, s):
+        if s in self.null:
+            return []
+        return s.split(self.separator) if self.separator else [s]
+
+    def check(self, s) -> typing.Optional[str]:
+        """
+        :return: Description of the problem with value `s`, or `None` if `s` is valid.
+        """
+        if s in self.valid:
+            return None
+        if s in self.null:
+            return 'missing required value' if self.required else None
+        for v in self.values(s):
+            if self.base in NUMERIC:
+                try:
+                    n = decimal.Decimal(v)
+                except decimal.InvalidOperation:
+                    return 'invalid {}: {}'.format(self.base, v)
+                if self.base == 'integer' and n != n.to_integral_value():
+                    return 'invalid integer: {}'.format(v)
+                if (self.minimum is not None and n < self.minimum) or \
+                        (self.maximum is not None and n > self.maximum):
+                    return 'value out of range: {}'.format(v)
+            elif self.base == 'boolean':
+                if v not in self.booleans:
+                    return 'invalid boolean: {}'.format(v)
+            elif self.format and not self.format.fullmatch(v):
+                return 'value does not match format {}: {}'.format(self.format.pattern, v)
+        if len(self.valid) < MEMO_SIZE:
+            self.valid.add(s)
+        return None
+
+
+class TableResult(typing.NamedTuple):
+    violations: typing.List[Violation]
+    # Hashes of primary key values, of the values of columns referenced by foreign keys, and of
+    # foreign key values - with the referenced table and column and the row numbers:
+    keys: np.ndarray
+    referenced: typing.Dict[str, np.ndarray]
+    foreign_keys: typing.Dict[str, typing.Tuple[str, str, np.ndarray, np.ndarray]]
+    # Intervals: (key hashes, start, end, first rows) - see `check_table`.
+    intervals: typing.Optional[typing.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+
+
+def foreign_keys(schema: dict) -> typing.Dict[str, typing.Tuple[str, str]]:
+    """
+    :return: `dict` mapping (single) foreign key columns to the referenced table and column.
+    """
+    res = {}
+    for fk in schema.get('foreignKeys', []):
+        cols, ref = fk['columnReference'], fk['reference']
+        rcols = ref.get('columnReference')
+        cols, rcols = [cols] if isinstance(cols, str) else cols, \
+            [rcols] if isinstance(rcols, str) else (rcols or [])
+        if len(cols) == 1 and len(rcols) == 1:
+            res[cols[0]] = (ref['resource'], rcols[0])
+    return res
+
+
+def check_table(path: pathlib.Path, schema: dict, referenced=()) -> TableResult:
+    """
+    Stream over the rows of one table, checking values and collecting keys and intervals.
+
+    :param referenced: Names of columns of the table referenced by foreign keys.
+    """
+    table = path.name
+    columns = [Column(spec) for spec in schema['columns']]
+    by_name = {col.name: col for col in columns}
+    pk = (schema.get('primaryKey') or [None])[0]
+    fks = foreign_keys(schema)
+    referenced = [col for col in referenced if col != pk]
+    contained = CONTAINED.get(table)
+    timed = {'start', 'end'}.issubset(c.name for c in columns)
+
+    violations, keys = [], []
+    ref_values = {col: [] for col in referenced}
+    fk_values = {col: ([], []) for col in fks}
+    # For contained intervals, one (parent key, min start, max end, first row) per run of rows with
+    # the same parent key; else (key, start, end) per row.
+    ivs, run_key, prev_end = ([], [], [], []), None, None
+    for i, row in enumerate(iter_csv(path), start=1):
+        for col in columns:
+            msg = col.check(row.get(col.name) or '')
+            if msg:
+                violations.append(Violation(table, i, col.name, msg))
+        if pk:
+            keys.append(key_hash(row[pk]))
+        for col in referenced:
+            ref_values[col].extend(key_hash(v) for v in by_name[col].values(row.get(col) or ''))
+        for col in fks:
+            # Values of list-valued columns are resolved one by one:
+            for v in by_name[col].values(row.get(col) or '') if col in by_name else []:
+                fk_values[col][0].append(key_hash(v))
+                fk_values[col][1].append(i)
+        if not timed:
+            continue
+        try:
+            start, end = float(row['start']), float(row['end'])
+        except ValueError:
+            continue
+        if start > end:
+            violations.append(Violation(table, i, 'end', 'end before start: {}'.format(row['end'])))
+        if contained:
+            key = row[contained[0]]
+            if key == run_key:
+                if start < prev_end:
+                    violations.append(Violation(
+                        table, i, 'start', 'interval overlaps with preceding interval in {}'.format(
+                            key)))
+                ivs[1][-1], ivs[2][-1] = min(ivs[1][-1], start), max(ivs[2][-1], end)
+            else:
+                ivs[0].append(key_hash(key))
+                ivs[1].append(start)
+                ivs[2].append(end)
+                ivs[3].append(i)
+            run_key, prev_end = key, end
+        elif pk:
+            ivs[0].append(keys[-1])
+            ivs[1].append(start)
+            ivs[2].append(end)
+
+    intervals = None
+    if timed:
+        intervals = (
+            np.array(ivs[0], dtype=np.int64),
+            np.array(ivs[1], dtype=np.float64),
+            np.array(ivs[2], dtype=np.float64),
+            np.array(ivs[3], dtype=np.int64))
+    return TableResult(
+        violations,
+        np.array(keys, dtype=np.int64),
+        {col: np.array(h, dtype=np.int64) for col, h in ref_values.items()},
+        {
+            col: fks[col] + (np.array(h, dtype=np.int64), np.array(rows, dtype=np.int64))
+            for col, (h, rows) in fk_values.items()},
+        intervals,
+    )
+
+
+class Validator:
+    def __init__(self, cldf_dir, metadata='Generic-metadata.json'):
+        self.cldf_dir = pathlib.Path(cldf_dir)
+        self.metadata = json.loads(self.cldf_dir.joinpath(metadata).read_text(encoding='utf8'))
+        self.schemas = collections.OrderedDict(
+            (t['url'], t['tableSchema']) for t in self.metadata['tables'])
+
+    def validate(self, workers=None) -> typing.List[Violation]:
+        """
+        Validate all tables, checking tables in parallel using up to `workers` processes.
+
+        :return: `list` of violations, sorted by table and row.
+        """
+        results, referenced = {}, collections.defaultdict(set)
+        for schema in self.schemas.values():
+            for ref, rcol in foreign_keys(schema).values():
+                referenced[ref].add(rcol)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    check_table, self.cldf_dir / url, schema, sorted(referenced[url])): url
+                for url, schema in self.schemas.items()}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+
+        violations = []
+        sorted_keys = {}
+        for url, res in results.items():
+            violations.extend(res.violations)
+            keys = np.sort(res.keys)
+            sorted_keys[url] = keys
+            dupes = np.unique(keys[1:][keys[1:] == keys[:-1]])
+            if len(dupes):
+                pk = self.schemas[url]['primaryKey'][0]
+                for row in np.flatnonzero(np.isin(res.keys, dupes)) + 1:
+                    violations.append(Violation(url, int(row), pk, 'duplicate primary key'))
+
+        unresolved = collections.defaultdict(lambda: collections.defaultdict(list))
+        for url, res in results.items():
+            for col, (ref, rcol, hashes, rows) in res.foreign_keys.items():
+                if ref not in results:
+                    continue
+                if rcol == (self.schemas[ref].get('primaryKey') or [None])[0]:
+                    targets = sorted_keys[ref]
+                else:
+                    targets = results[ref].referenced[rcol]
+                for row in np.unique(rows[~np.isin(hashes, targets)]):
+                    unresolved[url][int(row)].append(col)
+
+        for url, (col, parent) in CONTAINED.items():
+            if url not in results or parent not in results or results[url].intervals is None \
+                    or results[parent].intervals is None:
+                continue
+            pkeys, pstart, pend, _ = results[parent].intervals
+            order = np.argsort(pkeys, kind='stable')
+            keys, start, end, rows = results[url].intervals
+            idx = np.searchsorted(pkeys[order], keys)
+            found = idx < len(order)
+            found[found] = pkeys[order][idx[found]] == keys[found]
+            j = order[np.minimum(idx, len(order) - 1)]
+            bad = found & ((start < pstart[j]) | (end > pend[j]))
+            for row in rows[bad]:
+                violations.append(Violation(
+                    url,
+                    int(row),
+                    col,
+                    'intervals from this row on not within the bounds of the row in {}'.format(
+                        parent)))
+
+        if unresolved:
+            # Re-read only the tables with unresolved foreign keys to report the values.
+            for url, rows in unresolved.items():
+                for i, row in enumerate(iter_csv(self.cldf_dir / url), start=1):
+                    for col in rows.get(i, []):
+                        violations.append(Violation(
+                            url, i, col, 'unresolved foreign key: {}'.format(row[col])))
+        return sorted(violations, key=lambda v: (v.table, v.row, v.column or ''))
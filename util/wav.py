@@ -0,0 +1,239 @@
+"""
+Direct, memory-mapped access to the samples of (PCM) WAV files.
+
+The DoReCo recordings are long (often more than an hour), so reading them through `pydub` - which
+loads and decodes the full file - is wasteful if all we need is to run some array computation over
+the samples. Instead, we parse the RIFF header ourselves and expose the data chunk as `numpy.memmap`.
+"""
+import json
+import struct
+import typing
+import pathlib
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# Number of frames processed at once when streaming over a file.
+BLOCK_SIZE = 2 ** 22
+PEAK_LEVELS = (256, 1024, 4096, 16384)
+
+
+class Wav:
+    """
+    A WAV file, with samples accessible as (lazy) `numpy` arrays.
+
+        >>> wav = Wav('doreco_teop1238_Mat_01.wav')
+        >>> wav.duration
+        3612.5
+        >>> wav.read(channel=1, start=10.0, end=10.5).shape
+        (22050,)
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with self.path.open('rb') as f:
+            riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave != b'WAVE':
+                raise ValueError('Not a WAV file: {}'.format(self.path))
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError('No data chunk in {}'.format(self.path))
+                cid, size = struct.unpack('<4sI', header)
+                if cid == b'fmt ':
+                    fmt = f.read(size)
+                elif cid == b'data':
+                    self.offset, self.size = f.tell(), size
+                    break
+                else:
+                    f.seek(size, 1)
+                if size % 2:  # Chunks are word-aligned.
+                    f.seek(1, 1)
+        if fmt is None:
+            raise ValueError('No fmt chunk in {}'.format(self.path))
+        self.format, self.channels, self.rate, _, self.block_align, bits = \
+            struct.unpack('<HHIIHH', fmt[:16])
+        if self.format == WAVE_FORMAT_EXTENSIBLE:
+            self.format = struct.unpack('<H', fmt[24:26])[0]
+        self.sampwidth = bits // 8
+        # Some writers put bogus sizes into the header of unfinished files.
+        self.size = min(self.size, self.path.stat().st_size - self.offset)
+        self.nframes = self.size // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.nframes / self.rate
+
+    @property
+    def dtype(self):
+        if self.format == WAVE_FORMAT_IEEE_FLOAT:
+            return np.dtype('<f{}'.format(self.sampwidth))
+        if self.format == WAVE_FORMAT_PCM:
+            return {1: np.dtype('u1'), 2: np.dtype('<i2'), 3: np.dtype('u1'), 4: np.dtype('<i4')}[
+                self.sampwidth]
+        raise ValueError('Unsupported WAV format {} in {}'.format(self.format, self.path))
+
+    def memmap(self) -> np.ndarray:
+        """
+        The raw frames as memory-mapped array of shape (nframes, channels) - or (nframes, channels,
+        3) for 24-bit PCM.
+        """
+        shape = (self.nframes, self.channels)
+        if self.format == WAVE_FORMAT_PCM and self.sampwidth == 3:
+            shape += (3,)
+        return np.memmap(self.path, dtype=self.dtype, mode='r', offset=self.offset, shape=shape)
+
+    def frame(self, seconds: float) -> int:
+        return min(max(int(round(seconds * self.rate)), 0), self.nframes)
+
+    def read(self, channel: int = 1, start: float = None, end: float = None) -> np.ndarray:
+        """
+        Samples of one channel between `start` and `end` (in seconds) as float32 in [-1, 1].
+        """
+        assert 0 < channel <= self.channels
+        s = 0 if start is None else self.frame(start)
+        e = self.nframes if end is None else self.frame(end)
+        return self._normalize(self.memmap()[s:e, channel - 1])
+
+    def iter_blocks(self, channel: typing.Optional[int] = 1, size: int = BLOCK_SIZE):
+        """
+        Stream over the samples in blocks of `size` frames.
+
+        :param channel: Channel to read, or `None` to read all channels.
+        :return: Generator of pairs (index of first frame, float32 samples) - where samples are of \
+        shape (n,) if a single channel is read, else (n, channels).
+        """
+        assert channel is None or 0 < channel <= self.channels
+        mm = self.memmap()
+        for i in range(0, self.nframes, size):
+            block = mm[i:i + size]
+            yield i, self._normalize(block if channel is None else block[:, channel - 1])
+
+    def _normalize(self, a):
+        if self.sampwidth == 3 and self.format == WAVE_FORMAT_PCM:
+            # Assemble little-endian 24-bit integers in the upper bytes of int32.
+            b = np.zeros(a.shape[:-1] + (4,), dtype='u1')
+            b[..., 1:] = a
+            return (b.view('<i4')[..., 0] >> 8).astype(np.float32) / 2 ** 23
+        if a.dtype.kind == 'f':
+            return a.astype(np.float32)
+        if a.dtype.kind == 'u':  # 8-bit PCM is unsigned.
+            return (a.astype(np.float32) - 128) / 128
+        return a.astype(np.float32) / float(2 ** (8 * self.sampwidth - 1))
+
+
+def peaks(samples: np.ndarray, samples_per_pixel: int) -> np.ndarray:
+    """
+    Compute min/max peaks for consecutive buckets of `samples_per_pixel` samples.
+
+    :return: array of shape (n, 2), holding min and max per bucket.
+    """
+    n = -(-len(samples) // samples_per_pixel)
+    if n == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    pad = n * samples_per_pixel - len(samples)
+    if pad:
+        # Pad with the last value, so padding does not alter min or max of the last bucket.
+        samples = np.concatenate([samples, np.repeat(samples[-1:], pad)])
+    buckets = samples.reshape(n, samples_per_pixel)
+    return np.stack([buckets.min(axis=1), buckets.max(axis=1)], axis=1)
+
+
+def peak_pyramid(wav: Wav, channel: int = 1, levels=PEAK_LEVELS) -> dict:
+    """
+    Compute min/max peaks of a channel of a WAV file at several zoom levels.
+
+    Only the finest level is computed from the samples (streaming over the memory-mapped file),
+    coarser levels are aggregated from the next finer one.
+
+    :param levels: Increasing numbers of samples per pixel, each a multiple of the previous one.
+    :return: `dict` mapping samples per pixel to arrays of shape (n, 2).
+    """
+    levels = sorted(levels)
+    for finer, coarser in zip(levels, levels[1:]):
+        assert coarser % finer == 0, 'peak levels must be multiples of each other'
+    finest = levels[0]
+    block = (BLOCK_SIZE // finest) * finest
+    res = {finest: np.concatenate(
+        [peaks(samples, finest) for _, samples in wav.iter_blocks(channel, block)]
+        or [np.zeros((0, 2), dtype=np.float32)])}
+    for finer, coarser in zip(levels, levels[1:]):
+        p, k = res[finer], coarser // finer
+        res[coarser] = np.stack(
+            [peaks(p[:, 0], k)[:, 0], peaks(p[:, 1], k)[:, 1]], axis=1)
+    return res
+
+
+def peaks_path(path) -> pathlib.Path:
+    path = pathlib.Path(path)
+    return path.parent / '{}.peaks.json'.format(path.stem)
+
+
+def write_peaks(path, channel: int = 1, levels=PEAK_LEVELS) -> pathlib.Path:
+    """
+    Write the peak pyramid for the WAV file at `path` to a JSON sidecar file.
+
+    Peaks are quantized to 8 bits and stored as interleaved min/max values (as in the JSON format
+    of BBC's audiowaveform, which is understood by WaveSurfer).
+    """
+    wav = Wav(path)
+    out = peaks_path(path)
+    out.write_text(json.dumps(dict(
+        sample_rate=wav.rate,
+        duration=wav.duration,
+        channel=channel,
+        bits=8,
+        levels=[
+            dict(
+                samples_per_pixel=spp,
+                length=len(p),
+                data=np.clip(np.round(p * 127), -128, 127).astype(int).ravel().tolist())
+            for spp, p in sorted(peak_pyramid(wav, channel, levels).items())],
+    ), separators=(',', ':')), encoding='utf8')
+    return out
+
+
+def read_peaks(path, channel: int = 1) -> typing.Optional[dict]:
+    """
+    Read the peaks sidecar for the WAV file at `path`.
+
+    :return: The peaks or `None` if the sidecar is missing, older than the WAV file or computed for \
+    a different channel.
+    """
+    path = pathlib.Path(path)
+    sidecar = peaks_path(path)
+    if sidecar.exists() and sidecar.stat().st_mtime >= path.stat().st_mtime:
+        pk = json.loads(sidecar.read_text(encoding='utf8'))
+        if pk.get('channel') == channel:
+            return pk
+    return None
+
+
+def load_peaks(path, channel: int = 1) -> dict:
+    """
+    Load the peaks sidecar for the WAV file at `path`, (re)computing it if it is missing or stale.
+    """
+    pk = read_peaks(path, channel=channel)
+    if pk is None:
+        pk = json.loads(write_peaks(path, channel=channel).read_text(encoding='utf8'))
+    return pk
+
+
+def peak_slice(pk: dict, start: float, end: float, min_pixels: int = 400) -> list:
+    """
+    Normalized, interleaved min/max peaks for the interval between `start` and `end` seconds.
+
+    The coarsest level providing at least `min_pixels` peaks for the interval is used.
+    """
+    frames = (end - start) * pk['sample_rate']
+    level = pk['levels'][0]
+    for lvl in pk['levels']:
+        if frames / lvl['samples_per_pixel'] >= min_pixels:
+            level = lvl
+    spp = level['samples_per_pixel']
+    s = max(int(start * pk['sample_rate'] // spp), 0)
+    e = min(int(-(-end * pk['sample_rate'] // spp)), level['length'])
+    scale = 2 ** (pk['bits'] - 1) - 1
+    return [round(v / scale, 3) for v in level['data'][2 * s:2 * e]]